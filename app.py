@@ -1,116 +1,184 @@
 #!/usr/bin/env python3
 """
 ЛА-ЛА-ГЕЙМ - Викторина с элементами караоке
-Основное Flask-приложение с улучшенной архитектурой
+Основное Flask-приложение с улучшенной архитектурой.
+Эндпоинты работают только с хранилищем (storage): SQLite, MySQL или память,
+выбор делает run.py через use_storage()
 """
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 from flask_cors import CORS
-import sqlite3
-import os
-import random
+import gzip
 import json
+import hashlib
+import importlib
+import atexit
+import logging
+import signal
 from typing import Optional, Dict, Any
 
+from question_bank import QuestionBank, pack_bag, bag_item
+from precompressed import PrecompressedPayload
+from assets import AssetPipeline
+from write_behind import WriteBehindBuffer
+from session_janitor import SessionJanitor, ARCHIVE_EXPIRED
+from game_archive import GameArchive, archive_record
+from storage import (Storage, StorageError, create_storage, STATE_COLUMNS, VERSIONED_STATE_COLUMNS, GAME_STATE_COLUMNS,
+                     STATE_DEFAULTS)
+from board import cell_index, parse_board_layout, assign_cell_questions, unpack_cell_questions
+import config
+from config import COLS
+from models import remove_session, dispose_engines
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
-DATABASE = 'database.db'
+assets = AssetPipeline(app)  # Content-hashed static files, pre-rendered pages
+
+logger = logging.getLogger(__name__)
+
+# Хранилище по умолчанию - файл SQLite; соединения открываются при первом запросе
+storage: Storage = create_storage('sqlite')
+
+# Сохранения состояния и раскладки копятся по сессиям и пишутся пачкой раз в интервал
+state_buffer = WriteBehindBuffer(lambda states: storage.game_states.upsert_many(states))
+
+# Законченные игры переносятся из рабочих таблиц в архив по дням (SESSION_ARCHIVE_DIR)
+game_archive = GameArchive()
 
+# Сессии без активности дольше SESSION_TTL_HOURS удаляются фоновым потоком небольшими пачками
+# (и архивируются, если каталог архива задан явно)
+janitor = SessionJanitor(lambda: storage, archive=game_archive if ARCHIVE_EXPIRED else None,
+                         forget=state_buffer.discard)
 
-def get_db_connection() -> Optional[sqlite3.Connection]:
+# При остановке сначала записываются отметки активности и буфер, затем закрывается хранилище
+# и пулы соединений движков SQLAlchemy (atexit вызывает в обратном порядке)
+atexit.register(dispose_engines)
+atexit.register(lambda: storage.close())
+atexit.register(state_buffer.stop)
+atexit.register(janitor.stop)
+
+question_bank = QuestionBank(lambda: storage.questions.all(), lambda: storage.questions.version())
+
+
+def use_storage(new_storage: Storage) -> Storage:
     """
-    Создает соединение с базой данных с надлежащей обработкой ошибок
+    Переключает приложение на другое хранилище и возвращает прежнее.
+    Несохраненные данные буфера записываются в прежнее хранилище
     """
-    try:
-        conn = sqlite3.connect(DATABASE)
-        conn.row_factory = sqlite3.Row  # Позволяет обращаться к столбцам по имени
-        return conn
-    except sqlite3.Error as e:
-        print(f"Database connection error: {e}")
-        return None
+    global storage
+    janitor.stop()
+    state_buffer.stop()
+    previous, storage = storage, new_storage
+    question_bank.invalidate()
+    return previous
+
+
+@app.before_request
+def touch_session() -> None:
+    """
+    Отмечает активность сессии запроса (session_id в параметрах или в теле JSON)
+    """
+    session_id = request.args.get('session_id')
+    if session_id is None and request.is_json:
+        data = request.get_json(silent=True)
+        session_id = data.get('session_id') if isinstance(data, dict) else None
+    janitor.touch(session_id)
+
+
+@app.teardown_appcontext
+def release_db_connection(exception=None) -> None:
+    """
+    Освобождает ресурсы хранилища после запроса, откатывая незавершенную транзакцию
+    """
+    storage.release()
+
+
+# Сессия общего реестра models (через него, например, MySQL заполняет вопросы) тоже живет один запрос
+app.teardown_appcontext(remove_session)
 
 
 def init_db() -> None:
     """
-    Инициализирует базу данных, создавая таблицы и заполняя начальными данными
+    Инициализирует хранилище, создавая таблицы и заполняя начальными данными
     """
-    conn = get_db_connection()
-    if conn is None:
-        print("Failed to connect to database for initialization")
-        return
-    
-    cursor = conn.cursor()
-
-    # Создание таблиц
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS questions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            round_num INTEGER,
-            question_text TEXT NOT NULL,
-            answer TEXT NOT NULL,
-            theme TEXT NOT NULL
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS game_states (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT UNIQUE NOT NULL,
-            current_round INTEGER DEFAULT 1,
-            current_cell TEXT,
-            score INTEGER DEFAULT 0,
-            revealed_cells TEXT,  -- JSON string of revealed cells
-            board_state TEXT,     -- JSON string of the entire board state
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS opened_cells (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT NOT NULL,
-            round_num INTEGER NOT NULL,
-            row_num INTEGER NOT NULL,
-            col_num INTEGER NOT NULL,
-            cell_value TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS scores (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT,
-            round_num INTEGER,
-            player_name TEXT,
-            score INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS players (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT,
-            player_name TEXT,
-            score INTEGER DEFAULT 0,
-            position INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # Добавление вопросов в базу данных
-    from config import get_questions
-    questions = get_questions()
-
-    cursor.executemany('INSERT OR IGNORE INTO questions (round_num, question_text, answer, theme) VALUES (?, ?, ?, ?)', questions)
-
-    conn.commit()
-    conn.close()
+    storage.init_schema()
+    question_bank.invalidate()
+
+
+@app.errorhandler(StorageError)
+def storage_error(error):
+    logger.error(f"Database operation failed: {error}")
+    return jsonify({'error': 'Database operation failed'}), 500
+
+
+def _game_state(session_id: str, columns=GAME_STATE_COLUMNS) -> Optional[Dict[str, Any]]:
+    """
+    Читает столбцы game_states сессии с учетом еще не записанных сохранений
+    """
+    state = state_buffer.overlay(session_id, storage.game_states.get(session_id, columns))
+    # Сессия есть только в буфере - недостающие столбцы получают значения по умолчанию из схемы
+    return {column: state.get(column, STATE_DEFAULTS.get(column)) for column in columns} if state else None
+
+
+def _state_fields(game_state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Состояние игры для клиента: board_state разбирается из JSON, version - для следующего сохранения
+    """
+    board_state = game_state['board_state']
+    # Try to parse board_state as JSON if it's not None
+    if board_state:
+        try:
+            board_state = json.loads(board_state)
+        except (json.JSONDecodeError, TypeError):
+            # If parsing fails, return as is (it might already be parsed)
+            pass
+    return {
+        'current_round': game_state['current_round'],
+        'current_cell': game_state['current_cell'],
+        'score': game_state['score'],
+        'revealed_cells': game_state['revealed_cells'],
+        'board_state': board_state,
+        'version': game_state['version']
+    }
+
+
+def _save_versioned(session_id: str, values: Dict[str, Any], version, **fields):
+    """
+    Условная запись столбцов состояния поверх версии, которую прочитал клиент: если другое
+    сохранение уже заменило эту версию, клиент получает 409 с текущим состоянием
+    """
+    if version is None:
+        return jsonify({'error': 'Missing version'}), 400
+    if not isinstance(version, int) or isinstance(version, bool) or version < 0:
+        return jsonify({'error': 'Invalid version'}), 400
+
+    if state_buffer.unchanged(session_id, values):
+        # Same content as the last save of this session: nothing to write if the client is up to date
+        stored = storage.game_states.get(session_id, ('version',))
+        if stored and stored['version'] == version:
+            return jsonify({'status': 'success', **fields, 'version': version})
+    # Only this session's buffered columns go first, other sessions stay coalesced in the buffer
+    state_buffer.flush_key(session_id)
+    saved, current = storage.game_states.save(session_id, values, version)
+    if not saved:
+        # The client gets the current state to show instead of its own
+        game_state = _game_state(session_id, VERSIONED_STATE_COLUMNS)
+        return jsonify({'error': 'Version conflict', **(_state_fields(game_state) if game_state else {}),
+                        'version': current}), 409
+    # The row was written past the buffer: remember the saved values, keep anything buffered since
+    state_buffer.written(session_id, values)
+    return jsonify({'status': 'success', **fields, 'version': current})
+
+
+def _buffered_board_state(session_id: str):
+    """
+    Раскладка поля из буфера, если она еще не записана в хранилище (иначе None)
+    """
+    return state_buffer.get(session_id).get('board_state')
 
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return assets.page('index.html')
 
 
 @app.route('/quiz')
@@ -128,79 +196,44 @@ def save_board_layout():
     data = request.json
     session_id = data.get('session_id')
     board_layout = data.get('board_layout')
+    round_num = data.get('round_num', 1)
 
-    import json
     board_layout_str = json.dumps(board_layout) if board_layout else None
 
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
-
     # First, try to load existing game state
-    cursor.execute('SELECT * FROM game_states WHERE session_id = ?', (session_id,))
-    existing_game = cursor.fetchone()
-
-    if existing_game:
-        # Update the board_state field
-        cursor.execute(
-            'UPDATE game_states SET board_state = ? WHERE session_id = ?',
-            (board_layout_str, session_id))
+    existing_game = _game_state(session_id, ('board_state', 'cell_questions'))
+
+    # Keep the question mapping while the layout is unchanged, otherwise assign questions up front
+    if existing_game and existing_game['cell_questions'] and parse_board_layout(existing_game['board_state']) == board_layout:
+        cell_questions = unpack_cell_questions(existing_game['cell_questions'])
     else:
-        # Create new game state with board layout
-        cursor.execute(
-            'INSERT INTO game_states (session_id, board_state) VALUES (?, ?)',
-            (session_id, board_layout_str))
+        cell_questions = assign_cell_questions(question_bank, round_num)
+    cell_questions_blob = pack_bag(cell_questions) if cell_questions else None
 
-    conn.commit()
-    conn.close()
+    values = {'board_state': board_layout_str, 'cell_questions': cell_questions_blob}
+    version = data.get('version')  # version of the state the client read
+    if version is not None:
+        return _save_versioned(session_id, values, version, cell_questions=cell_questions)
+    # Without a version: buffered, an unchanged layout is not written again. The write still
+    # bumps the version, so a client holding the replaced state gets a conflict on its next save
+    state_buffer.put(session_id, values)
 
-    return jsonify({'status': 'success'})
+    return jsonify({'status': 'success', 'cell_questions': cell_questions})
 
 
 @app.route('/api/init_game', methods=['POST'])
 def init_game():
     session_id = request.json.get('session_id')
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
 
     # Проверяем, существует ли уже игра с этим session_id
-    cursor.execute('SELECT * FROM game_states WHERE session_id = ?', (session_id,))
-    existing_game = cursor.fetchone()
-
-    if existing_game:
-        # Если игра существует, возвращаем текущее состояние
-        current_round = existing_game[2]
-        current_cell = existing_game[3]
-        score = existing_game[4]
-        revealed_cells = existing_game[5]
-        board_state = existing_game[6]
-    else:
-        # Иначе инициализируем новую игру
-        current_round = 1
-        current_cell = None
-        score = 0
-        revealed_cells = None
-        board_state = None
-
-        # Сохраняем начальное состояние игры
-        cursor.execute(
-            'INSERT OR REPLACE INTO game_states (session_id, current_round, current_cell, score, revealed_cells, board_state) VALUES (?, ?, ?, ?, ?, ?)',
-            (session_id, current_round, current_cell, score, revealed_cells, board_state))
-
-    conn.commit()
-    conn.close()
+    state = _game_state(session_id, VERSIONED_STATE_COLUMNS)
+    if state is None:
+        # Иначе инициализируем новую игру и сохраняем ее начальное состояние;
+        # create() вернет состояние, если игру уже создал параллельный запрос
+        initial = dict(zip(STATE_COLUMNS, (1, None, 0, None, None)))
+        state = storage.game_states.create(session_id, initial) or dict(initial, version=0)
 
-    return jsonify({
-        'session_id': session_id,
-        'current_round': current_round,
-        'current_cell': current_cell,
-        'score': score,
-        'revealed_cells': revealed_cells,
-        'board_state': board_state
-    })
+    return jsonify({'session_id': session_id, **state})
 
 
 @app.route('/api/get_question', methods=['POST'])
@@ -209,20 +242,29 @@ def get_question():
     session_id = data.get('session_id')
     round_num = data.get('round_num')
 
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
-
-    # Получаем случайный вопрос для текущего раунда
-    cursor.execute('SELECT id, question_text FROM questions WHERE round_num = ? ORDER BY RANDOM() LIMIT 1',
-                   (round_num,))
-    question = cursor.fetchone()
+    if not session_id:
+        # Без сессии - просто случайный вопрос раунда из банка вопросов
+        question = question_bank.random_question(round_num)
+        if question:
+            return jsonify({'question_id': question['id'], 'question_text': question['question_text']})
+        return jsonify({'error': 'No questions available for this round'}), 404
 
-    conn.close()
+    # Следующий вопрос из мешка сессии - без повторов до исчерпания раунда
+    shuffle = lambda: question_bank.shuffled_ids(round_num)
+    drawn = storage.bags.draw(session_id, round_num, shuffle)
+    question = question_bank.get(drawn[0]) if drawn else None
+    if drawn and question is None:
+        # Вопросы изменились после создания мешка - перемешиваем заново
+        storage.bags.reset(session_id, round_num)
+        drawn = storage.bags.draw(session_id, round_num, shuffle)
+        question = question_bank.get(drawn[0]) if drawn else None
 
     if question:
-        return jsonify({'question_id': question[0], 'question_text': question[1]})
+        return jsonify({
+            'question_id': question['id'],
+            'question_text': question['question_text'],
+            'remaining': drawn[1]
+        })
     else:
         return jsonify({'error': 'No questions available for this round'}), 404
 
@@ -233,24 +275,47 @@ def check_answer():
     question_id = data.get('question_id')
     user_answer = data.get('answer').strip().lower()
 
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
-
     # Получаем правильный ответ
-    cursor.execute('SELECT answer FROM questions WHERE id = ?', (question_id,))
-    correct_answer = cursor.fetchone()
-
-    conn.close()
+    question = question_bank.get(question_id)
 
-    if correct_answer:
-        correct = correct_answer[0].strip().lower() == user_answer
-        return jsonify({'correct': correct, 'correct_answer': correct_answer[0]})
+    if question:
+        correct = question['answer'].strip().lower() == user_answer
+        return jsonify({'correct': correct, 'correct_answer': question['answer']})
     else:
         return jsonify({'error': 'Question not found'}), 404
 
 
+@app.route('/api/get_cell_question', methods=['GET'])
+def get_cell_question():
+    """Return the question assigned to a board cell when the board was created"""
+    session_id = request.args.get('session_id')
+    index = cell_index(request.args.get('row'), request.args.get('col'))
+    if index is None:
+        return jsonify({'error': 'Invalid cell'}), 400
+
+    game_state = _game_state(session_id, ('cell_questions',))
+
+    cell_questions = game_state and game_state['cell_questions']
+    question = None
+    if cell_questions and index < len(cell_questions) // 4:
+        question = question_bank.get(bag_item(cell_questions, index))
+
+    if question:
+        return jsonify({'question_id': question['id'], 'question_text': question['question_text']})
+    else:
+        return jsonify({'error': 'No question assigned to this cell'}), 404
+
+
+@app.route('/api/get_round_questions', methods=['GET'])
+def get_round_questions():
+    """Return the texts of all questions of a round so the client can prefetch them"""
+    round_num = request.args.get('round_num', 1, type=int)
+    questions = [question_bank.get(question_id) for question_id in question_bank.round_ids(round_num)]
+    return jsonify({'questions': [
+        {'question_id': question['id'], 'question_text': question['question_text']} for question in questions
+    ]})
+
+
 @app.route('/api/save_state', methods=['POST'])
 def save_state():
     data = request.json
@@ -260,63 +325,25 @@ def save_state():
     score = data.get('score')
     revealed_cells = data.get('revealed_cells')  # JSON string of revealed cells
     board_state = data.get('board_state')  # JSON string of the entire board state
+    version = data.get('version')  # version of the state the client read: every save is conditional
 
-    import json
     board_state_str = json.dumps(board_state) if board_state else None
+    values = dict(zip(STATE_COLUMNS, (current_round, current_cell, score, revealed_cells, board_state_str)))
 
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
-
-    cursor.execute(
-        'INSERT OR REPLACE INTO game_states (session_id, current_round, current_cell, score, revealed_cells, board_state) VALUES (?, ?, ?, ?, ?, ?)',
-        (session_id, current_round, current_cell, score, revealed_cells, board_state_str))
-
-    conn.commit()
-    conn.close()
-
-    return jsonify({'status': 'success'})
+    return _save_versioned(session_id, values, version)
 
 
 @app.route('/api/load_state', methods=['GET'])
 def load_state():
     session_id = request.args.get('session_id')
 
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT current_round, current_cell, score, revealed_cells, board_state FROM game_states WHERE session_id = ?', (session_id,))
-    game_state = cursor.fetchone()
+    game_state = _game_state(session_id, VERSIONED_STATE_COLUMNS)
 
     # Get players for this session
-    cursor.execute('SELECT player_name, score FROM players WHERE session_id = ? ORDER BY position', (session_id,))
-    players = [{'player_name': row[0], 'score': row[1]} for row in cursor.fetchall()]
-
-    conn.close()
+    players = storage.players.list(session_id)
 
     if game_state:
-        import json
-        board_state = game_state[4]
-        # Try to parse board_state as JSON if it's not None
-        if board_state:
-            try:
-                parsed_board_state = json.loads(board_state)
-                board_state = parsed_board_state
-            except (json.JSONDecodeError, TypeError):
-                # If parsing fails, return as is (it might already be parsed)
-                pass
-
-        return jsonify({
-            'current_round': game_state[0],
-            'current_cell': game_state[1],
-            'score': game_state[2],
-            'revealed_cells': game_state[3],
-            'board_state': board_state,
-            'players': players
-        })
+        return jsonify({**_state_fields(game_state), 'players': players})
     else:
         return jsonify({'error': 'No saved state found'}), 404
 
@@ -324,18 +351,8 @@ def load_state():
 @app.route('/api/get_players', methods=['GET'])
 def get_players():
     session_id = request.args.get('session_id')
-    
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
 
-    cursor.execute('SELECT player_name, score FROM players WHERE session_id = ? ORDER BY position', (session_id,))
-    players = [{'player_name': row[0], 'score': row[1]} for row in cursor.fetchall()]
-
-    conn.close()
-    
-    return jsonify({'players': players})
+    return jsonify({'players': storage.players.list(session_id)})
 
 
 @app.route('/api/add_player', methods=['POST'])
@@ -343,25 +360,9 @@ def add_player():
     data = request.json
     session_id = data.get('session_id')
     player_name = data.get('player_name', f'Игрок {len(data.get("players", [])) + 1}')
-    
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
-
-    # Get the highest position to determine where to insert the new player
-    cursor.execute('SELECT MAX(position) FROM players WHERE session_id = ?', (session_id,))
-    max_pos = cursor.fetchone()[0]
-    new_position = 1 if max_pos is None else max_pos + 1
-
-    cursor.execute(
-        'INSERT INTO players (session_id, player_name, score, position) VALUES (?, ?, 0, ?)',
-        (session_id, player_name, new_position)
-    )
 
-    conn.commit()
-    conn.close()
-    
+    storage.players.add(session_id, player_name)
+
     return jsonify({'status': 'success', 'player': {'player_name': player_name, 'score': 0}})
 
 
@@ -372,27 +373,9 @@ def update_player():
     player_name = data.get('player_name')
     new_score = data.get('score', 0)
     new_player_name = data.get('new_player_name', player_name)  # If new name is provided, use it
-    
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
-
-    # If player name is changing, update it
-    if new_player_name != player_name:
-        cursor.execute(
-            'UPDATE players SET score = ?, player_name = ? WHERE session_id = ? AND player_name = ?',
-            (new_score, new_player_name, session_id, player_name)
-        )
-    else:
-        cursor.execute(
-            'UPDATE players SET score = ? WHERE session_id = ? AND player_name = ?',
-            (new_score, session_id, player_name)
-        )
-
-    conn.commit()
-    conn.close()
-    
+
+    storage.players.update(session_id, player_name, new_score, new_player_name)
+
     return jsonify({'status': 'success'})
 
 
@@ -401,23 +384,9 @@ def remove_player():
     data = request.json
     session_id = data.get('session_id')
     player_name = data.get('player_name')
-    
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
-
-    cursor.execute('DELETE FROM players WHERE session_id = ? AND player_name = ?', (session_id, player_name))
-
-    # Reorder positions after deletion
-    cursor.execute('SELECT id, player_name FROM players WHERE session_id = ? ORDER BY position', (session_id,))
-    remaining_players = cursor.fetchall()
-    for idx, (player_id, _) in enumerate(remaining_players, 1):
-        cursor.execute('UPDATE players SET position = ? WHERE id = ?', (idx, player_id))
-
-    conn.commit()
-    conn.close()
-    
+
+    storage.players.remove(session_id, player_name)
+
     return jsonify({'status': 'success'})
 
 
@@ -425,33 +394,20 @@ def remove_player():
 def reset_players():
     data = request.json
     session_id = data.get('session_id')
-    
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
 
-    cursor.execute('DELETE FROM players WHERE session_id = ?', (session_id,))
+    # Two default players
+    storage.players.reset(session_id, ['Игрок 1', 'Игрок 2'])
 
-    # Add two default players
-    cursor.execute('INSERT INTO players (session_id, player_name, score, position) VALUES (?, ?, 0, 1)', (session_id, 'Игрок 1'))
-    cursor.execute('INSERT INTO players (session_id, player_name, score, position) VALUES (?, ?, 0, 2)', (session_id, 'Игрок 2'))
-
-    conn.commit()
-    conn.close()
-    
     return jsonify({'status': 'success'})
 
 
-import config
-
-
-@app.route('/api/config', methods=['GET'])
-def get_config():
-    """Return game configuration"""
+def _config_payload() -> Dict[str, Any]:
+    """
+    Собирает конфигурацию игры, отправляемую клиенту
+    """
     from config import get_symbols, get_game_settings, get_body_style, get_cell_style, get_hover_cell_style, get_revealed_cell_style, get_number_cell_style, get_symbol_cell_style
     game_settings = get_game_settings()
-    config = {
+    return {
         'symbols': get_symbols(),
         'settings': game_settings,
         'body_style': get_body_style(),
@@ -461,7 +417,45 @@ def get_config():
         'number_cell_style': get_number_cell_style(),
         'symbol_cell_style': get_symbol_cell_style()
     }
-    return jsonify(config)
+
+
+# Serialized and compressed once; rebuilt by reload_config()
+config_payload = PrecompressedPayload.from_json(_config_payload())
+
+
+def reload_config() -> None:
+    """
+    Перечитывает config.py и заново готовит сжатый ответ /api/config
+    """
+    global config_payload
+    importlib.reload(config)
+    config_payload = PrecompressedPayload.from_json(_config_payload())
+
+
+def install_reload_signal() -> bool:
+    """
+    Перечитывает конфигурацию по сигналу SIGHUP (kill -HUP <pid>);
+    возвращает False, если в системе нет этого сигнала (Windows)
+    """
+    if not hasattr(signal, 'SIGHUP'):
+        return False
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload_config())
+    return True
+
+
+@app.route('/api/reload_config', methods=['POST'])
+def reload_config_endpoint():
+    """Re-read config.py without a restart; accepted only from the server machine itself"""
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({'error': 'Forbidden'}), 403
+    reload_config()
+    return jsonify({'status': 'success', 'version': config_payload.version})
+
+
+@app.route('/api/config', methods=['GET'])
+def get_config():
+    """Return game configuration (precompressed, 304 if the client's ETag is current)"""
+    return config_payload.response(request)
 
 
 @app.route('/api/mark_cell_opened', methods=['POST'])
@@ -472,124 +466,109 @@ def mark_cell_opened():
     row = data.get('row')
     col = data.get('col')
     cell_value = data.get('cell_value')
-    
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
-
-    # Check if this cell was already opened in this round for this session
-    cursor.execute('''
-        SELECT id FROM opened_cells 
-        WHERE session_id = ? AND round_num = ? AND row_num = ? AND col_num = ?
-    ''', (session_id, round_num, row, col))
-    
-    existing = cursor.fetchone()
-    if existing:
+
+    if cell_index(row, col) is None:
+        return jsonify({'error': 'Invalid cell'}), 400
+
+    history = storage.cells.open(session_id, round_num, row, col, cell_value)
+    if history is None:
         # Cell already opened, return error
-        conn.close()
         return jsonify({'error': 'Cell already opened'}), 400
 
-    # Insert the opened cell record
-    cursor.execute('''
-        INSERT INTO opened_cells (session_id, round_num, row_num, col_num, cell_value) 
-        VALUES (?, ?, ?, ?, ?)
-    ''', (session_id, round_num, row, col, cell_value))
-
-    conn.commit()
-    conn.close()
-    
-    return jsonify({'status': 'success'})
+    return jsonify({'status': 'success', **history})
 
 
 @app.route('/api/get_opened_cells', methods=['GET'])
 def get_opened_cells():
     session_id = request.args.get('session_id')
     round_num = request.args.get('round_num', type=int)
-    
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT row_num, col_num, cell_value FROM opened_cells 
-        WHERE session_id = ? AND round_num = ?
-    ''', (session_id, round_num))
-    
-    opened_cells = [{'row': row[0], 'col': row[1], 'value': row[2]} for row in cursor.fetchall()]
-
-    conn.close()
-    
+
+    opened_cells = storage.cells.load(session_id, round_num, _buffered_board_state(session_id))
+
     return jsonify({'opened_cells': opened_cells})
 
 
 @app.route('/api/revert_last_opened_cell', methods=['POST'])
 def revert_last_opened_cell():
-    """Revert the last opened cell for the session"""
+    """Revert the last opened cell (or the last `steps` opened cells) for the session"""
     data = request.json
     session_id = data.get('session_id')
     round_num = data.get('round_num', 1)
+    try:
+        steps = max(1, int(data.get('steps', 1)))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid steps'}), 400
+
+    last_cells = storage.cells.revert(session_id, round_num, steps)
 
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
-
-    # Get the last opened cell for this session
-    cursor.execute('''
-        SELECT id, row_num, col_num FROM opened_cells
-        WHERE session_id = ? AND round_num = ?
-        ORDER BY created_at DESC
-        LIMIT 1
-    ''', (session_id, round_num))
-    
-    last_cell = cursor.fetchone()
-    
-    if last_cell:
-        # Delete the last opened cell record
-        cell_id, row_num, col_num = last_cell
-        cursor.execute('DELETE FROM opened_cells WHERE id = ?', (cell_id,))
-        conn.commit()
-        
-        conn.close()
-        
+    if last_cells:
+        reverted_cells = [{'id': cell_id, 'row': row_num, 'col': col_num} for cell_id, row_num, col_num in last_cells]
         return jsonify({
             'status': 'success',
-            'reverted_cell': {'id': cell_id, 'row': row_num, 'col': col_num}
+            'reverted_cell': reverted_cells[0],
+            'reverted_cells': reverted_cells
         })
     else:
-        conn.close()
         return jsonify({'status': 'no_cells_to_revert'})
 
 
 @app.route('/api/set_opened_cells', methods=['POST'])
 def set_opened_cells():
-    """Set the opened cells state for a session"""
+    """Set the opened cells state for a session, writing only the cells that changed"""
     data = request.json
     session_id = data.get('session_id')
     round_num = data.get('round_num', 1)
     opened_cells = data.get('opened_cells', [])
-    
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
-
-    # Clear all opened cells for this session and round
-    cursor.execute('DELETE FROM opened_cells WHERE session_id = ? AND round_num = ?', (session_id, round_num))
-    
-    # Insert the provided opened cells
+
+    # Submitted cells by index; a repeated cell keeps its first value
+    submitted = {}
     for cell in opened_cells:
-        cursor.execute('''
-            INSERT INTO opened_cells (session_id, round_num, row_num, col_num, cell_value) 
-            VALUES (?, ?, ?, ?, ?)
-        ''', (session_id, round_num, cell['row'], cell['col'], cell['value']))
-    
-    conn.commit()
-    conn.close()
-    
-    return jsonify({'status': 'success'})
+        index = cell_index(cell.get('row'), cell.get('col'))
+        if index is None:
+            return jsonify({'error': 'Invalid cell'}), 400
+        submitted.setdefault(index, cell.get('value'))
+
+    to_open, to_close = storage.cells.replace(session_id, round_num, submitted)
+
+    return jsonify({
+        'status': 'success',
+        'opened': [{'row': index // COLS, 'col': index % COLS, 'value': submitted[index]} for index in to_open],
+        'closed': [{'row': index // COLS, 'col': index % COLS} for index in to_close]
+    })
+
+
+@app.route('/api/undo', methods=['POST'])
+def undo():
+    """Undo the last cell action of the session, returning only the changed cells"""
+    data = request.json
+    session_id = data.get('session_id')
+
+    changed_cells, history = storage.cells.undo(session_id)
+    if changed_cells is None:
+        return jsonify({'status': 'nothing_to_undo', 'changed_cells': [], **history})
+
+    return jsonify({'status': 'success', 'changed_cells': changed_cells, **history})
+
+
+@app.route('/api/redo', methods=['POST'])
+def redo():
+    """Redo the last undone cell action of the session, returning only the changed cells"""
+    data = request.json
+    session_id = data.get('session_id')
+
+    changed_cells, history = storage.cells.redo(session_id)
+    if changed_cells is None:
+        return jsonify({'status': 'nothing_to_redo', 'changed_cells': [], **history})
+
+    return jsonify({'status': 'success', 'changed_cells': changed_cells, **history})
+
+
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    """Return whether the session has actions to undo or redo"""
+    session_id = request.args.get('session_id')
+
+    return jsonify(storage.cells.history(session_id))
 
 
 @app.route('/api/clear_opened_cells', methods=['POST'])
@@ -597,43 +576,153 @@ def clear_opened_cells():
     data = request.json
     session_id = data.get('session_id')
     round_num = data.get('round_num', 1)
-    
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
-
-    # Delete all opened cells for this session and round
-    cursor.execute('DELETE FROM opened_cells WHERE session_id = ? AND round_num = ?', (session_id, round_num))
-
-    conn.commit()
-    conn.close()
-    
+
+    # Opened cells, the round's question bag and the undo/redo history start over
+    storage.cells.clear(session_id, round_num)
+
     return jsonify({'status': 'success'})
 
 
+def _section_version(section) -> str:
+    """
+    Версия раздела ответа /api/bootstrap: короткий хеш его JSON-представления
+    """
+    payload = json.dumps(section, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+@app.route('/api/bootstrap', methods=['GET'])
+def bootstrap():
+    """Return config, game state, board, players and opened cells for page load in one response"""
+    session_id = request.args.get('session_id')
+    round_num = request.args.get('round_num', 1, type=int)
+    # Sections whose version the client already has (versions=name:version,...) are omitted
+    known = dict(item.split(':', 1) for item in request.args.get('versions', '').split(',') if ':' in item)
+
+    # All sections come from the same snapshot of the storage
+    snapshot = storage.snapshot(session_id, round_num, _buffered_board_state(session_id))
+    game_state = state_buffer.overlay(session_id, snapshot['game_state'])
+    if game_state:
+        game_state = {column: game_state.get(column, STATE_DEFAULTS.get(column)) for column in GAME_STATE_COLUMNS}
+
+    sections = {
+        'config': config_payload.data,
+        'state': {
+            'current_round': game_state['current_round'],
+            'current_cell': game_state['current_cell'],
+            'score': game_state['score'],
+            'revealed_cells': game_state['revealed_cells'],
+            'version': game_state['version']
+        } if game_state else None,
+        'board': {
+            'layout': parse_board_layout(game_state['board_state']),
+            'cell_questions': unpack_cell_questions(game_state['cell_questions'])
+        } if game_state else None,
+        'players': snapshot['players'],
+        'opened_cells': snapshot['opened_cells'],
+        'history': snapshot['history']
+    }
+
+    # The change number the sections include: /api/changes continues from it
+    response = {'versions': {}, 'seq': snapshot['seq']}
+    for name, section in sections.items():
+        version = config_payload.version if name == 'config' else _section_version(section)
+        response['versions'][name] = version
+        if known.get(name) != version:
+            response[name] = section
+    return jsonify(response)
+
+
+@app.route('/api/changes', methods=['GET'])
+def get_changes():
+    """Return the cells and players changed after the client's change number, or a compact snapshot"""
+    session_id = request.args.get('session_id')
+    since = request.args.get('since', 0, type=int)
+    round_num = request.args.get('round_num', 1, type=int)
+
+    delta = storage.changes(session_id, since)
+    if delta is not None:
+        delta['cells'] = [cell for cell in delta['cells'] if cell['round_num'] == round_num]
+        return jsonify(delta)
+
+    # The client is too far behind (or the board was reset or saved since): the whole board,
+    # opened cells as [row, col, value]
+    snapshot = storage.snapshot(session_id, round_num, _buffered_board_state(session_id))
+    game_state = state_buffer.overlay(session_id, snapshot['game_state']) or {}
+    return jsonify({
+        'seq': snapshot['seq'],
+        'snapshot': True,
+        'layout': parse_board_layout(game_state.get('board_state')),
+        'cell_questions': unpack_cell_questions(game_state.get('cell_questions')),
+        'opened_cells': [[cell['row'], cell['col'], cell['value']] for cell in snapshot['opened_cells']],
+        'players': snapshot['players'],
+        'version': game_state.get('version', 0)
+    })
+
+
+@app.route('/api/finish_game', methods=['POST'])
+def finish_game():
+    """Move a finished game out of the live tables into the archive"""
+    session_id = request.json.get('session_id')
+    # Saves still in the buffer belong to the archived game
+    state_buffer.flush()
+    record = archive_record(storage, session_id)
+    if record is None:
+        return jsonify({'error': 'Game not found'}), 404
+    # The game is durably archived before its rows are deleted; a retry after a crash in between
+    # finds it archived unchanged, writes nothing and only deletes the rows
+    game_archive.append([record])
+    storage.delete_sessions([session_id])
+    state_buffer.discard(session_id)
+    return jsonify({'status': 'success'})
+
+
+@app.route('/api/archived_game', methods=['GET'])
+def archived_game():
+    """Return an archived game without touching the database (sent as stored when gzip is accepted)"""
+    chunks = game_archive.stream(request.args.get('session_id', ''))
+    if chunks is None:
+        return jsonify({'error': 'Game not found in archive'}), 404
+    if request.accept_encodings['gzip'] > 0:
+        response = Response(chunks, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(gzip.decompress(b''.join(chunks)), mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@app.route('/api/archived_games', methods=['GET'])
+def archived_games():
+    """Stream the games archived on a day (?day=YYYY-MM-DD) as JSON lines; without day, list the days"""
+    day = request.args.get('day')
+    if not day:
+        return jsonify({'days': game_archive.days()})
+    if day not in game_archive.days():
+        return jsonify({'error': 'No games archived on this day'}), 404
+    lines = (json.dumps(record, ensure_ascii=False) + '\n' for record in game_archive.records(day))
+    return Response(lines, mimetype='application/x-ndjson')
+
+
+@app.route('/api/db_stats', methods=['GET'])
+def db_stats():
+    """Return the storage backend counters (for SQLite: connections, write transactions, lock wait time)"""
+    return jsonify({'backend': storage.name, **storage.stats(), 'write_behind': dict(state_buffer.stats),
+                    'janitor': dict(janitor.stats)})
+
+
 @app.route('/api/get_all_questions', methods=['GET'])
 def get_all_questions():
-    """Return all questions from the database"""
-    conn = get_db_connection()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT id, round_num, question_text, answer, theme FROM questions')
-    questions = []
-    for row in cursor.fetchall():
-        questions.append({
-            'id': row[0],
-            'round_num': row[1],
-            'question_text': row[2],
-            'answer': row[3],
-            'theme': row[4]
-        })
+    """Return all questions from the question bank"""
+    return jsonify({'questions': question_bank.all_questions()})
+
 
-    conn.close()
-    
-    return jsonify({'questions': questions})
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint to verify storage connectivity"""
+    if storage.ping():
+        return jsonify({'status': 'healthy', 'database': 'connected', 'backend': storage.name})
+    return jsonify({'status': 'unhealthy', 'database': 'disconnected', 'backend': storage.name}), 503
 
 
 if __name__ == '__main__':
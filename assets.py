@@ -0,0 +1,75 @@
+"""
+Build-free static asset pipeline.
+
+Every file under static/ is read once at startup and published under a
+content-hashed name (css/index.css -> /assets/css/index.<hash>.css), so it can
+be cached by the browser forever; a changed file gets a new URL. Templates
+link assets with asset_url('css/index.css'). Pages are rendered once and kept
+in memory; all responses are precompressed and answer If-None-Match with 304.
+"""
+
+import hashlib
+import mimetypes
+import os
+from typing import Dict
+
+from flask import abort, render_template, request
+
+from precompressed import PrecompressedPayload
+
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+# Pages keep their URL, so browsers revalidate them (a 304 is a few hundred bytes)
+PAGE_CACHE = 'no-cache'
+
+
+class AssetPipeline:
+    """Content-hashed static files and pre-rendered pages served from memory."""
+
+    def __init__(self, app=None, folder: str = 'static', url_prefix: str = '/assets'):
+        self.folder = folder
+        self.url_prefix = url_prefix
+        self._urls: Dict[str, str] = {}  # source path -> hashed URL
+        self._payloads: Dict[str, PrecompressedPayload] = {}  # hashed path -> payload
+        self._pages: Dict[str, PrecompressedPayload] = {}  # template -> rendered page
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        self.load(os.path.join(app.root_path, self.folder))
+        app.add_url_rule(f'{self.url_prefix}/<path:filename>', 'hashed_asset', self._serve)
+        app.context_processor(lambda: {'asset_url': self.url})
+
+    def load(self, root: str) -> None:
+        """(Re)read the static folder and drop the rendered pages that link to it."""
+        urls, payloads = {}, {}
+        for directory, _, files in os.walk(root):
+            for name in files:
+                full_path = os.path.join(directory, name)
+                source = os.path.relpath(full_path, root).replace(os.sep, '/')
+                with open(full_path, 'rb') as f:
+                    body = f.read()
+                stem, ext = os.path.splitext(source)
+                hashed = f'{stem}.{hashlib.sha256(body).hexdigest()[:12]}{ext}'
+                mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                payloads[hashed] = PrecompressedPayload(body, mimetype=mimetype, cache_control=IMMUTABLE_CACHE)
+                urls[source] = f'{self.url_prefix}/{hashed}'
+        self._urls, self._payloads, self._pages = urls, payloads, {}
+
+    def url(self, source: str) -> str:
+        """Return the content-hashed URL of a file under the static folder."""
+        return self._urls[source]
+
+    def _serve(self, filename: str):
+        payload = self._payloads.get(filename)
+        if payload is None:
+            abort(404)
+        return payload.response(request)
+
+    def page(self, template: str):
+        """Serve a template rendered once (it must not depend on the request)."""
+        payload = self._pages.get(template)
+        if payload is None:
+            payload = PrecompressedPayload(render_template(template).encode('utf-8'),
+                                           mimetype='text/html', cache_control=PAGE_CACHE)
+            self._pages[template] = payload
+        return payload.response(request)
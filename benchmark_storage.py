@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the storage backends on the same game workload
+Usage: python benchmark_storage.py [--sessions N] [--backends sqlite,memory,orm,mysql]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from config import ROWS, COLS
+from storage import BACKENDS, StorageError, create_storage
+
+
+def _workload(storage, session_id):
+    """Operations of one short game, by name: (repository call, number of calls)"""
+    cells = [(row, col) for row in range(ROWS) for col in range(COLS)][:12]
+    return [
+        ('game_states.create', lambda: storage.game_states.create(session_id, {'current_round': 1, 'score': 0})),
+        ('players.add', lambda: [storage.players.add(session_id, f'Игрок {i}') for i in range(1, 4)]),
+        ('bags.draw', lambda: [storage.bags.draw(session_id, 1, lambda: list(range(1, 31))) for _ in range(10)]),
+        ('cells.open', lambda: [storage.cells.open(session_id, 1, row, col, '1') for row, col in cells]),
+        ('cells.undo', lambda: [storage.cells.undo(session_id) for _ in range(3)]),
+        ('cells.redo', lambda: [storage.cells.redo(session_id) for _ in range(3)]),
+        ('game_states.upsert_many', lambda: storage.game_states.upsert_many({session_id: {'score': 10}})),
+        ('snapshot', lambda: [storage.snapshot(session_id, 1) for _ in range(5)]),
+        ('cells.clear', lambda: storage.cells.clear(session_id, 1)),
+    ]
+
+
+def run(kind, sessions):
+    """Run the workload for `sessions` sessions and return seconds spent per operation"""
+    tmpdir = tempfile.mkdtemp()
+    # Durable where the backend can be: a database file for SQLite, a journal for memory;
+    # the ORM runs on LALA_ORM_URL or, without it, on a SQLite file like the sqlite backend
+    options = {
+        'sqlite': {'path': os.path.join(tmpdir, 'benchmark.db')},
+        'memory': {'path': tmpdir},
+        'orm': {'url': os.getenv('LALA_ORM_URL') or f"sqlite:///{os.path.join(tmpdir, 'benchmark-orm.db')}"}
+    }.get(kind, {})
+    storage = create_storage(kind, **options)
+    try:
+        storage.init_schema()
+        timings = {}
+        for number in range(sessions):
+            for name, operation in _workload(storage, f'benchmark-{kind}-{number}'):
+                started = time.perf_counter()
+                operation()
+                timings[name] = timings.get(name, 0.0) + time.perf_counter() - started
+        return timings
+    finally:
+        storage.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--backends', default='sqlite,memory')
+    args = parser.parse_args()
+
+    results = {}
+    for kind in args.backends.split(','):
+        if kind not in BACKENDS:
+            parser.error(f"unknown backend '{kind}'")
+        try:
+            results[kind] = run(kind, args.sessions)
+        except (ImportError, StorageError) as e:
+            print(f"{kind}: skipped ({e})")
+
+    if not results:
+        return
+    names = list(next(iter(results.values())))
+    print(f"{'operation':<26}" + ''.join(f'{kind:>12}' for kind in results) + '   (ms per session)')
+    for name in names + ['total']:
+        row = [sum(timings.values()) if name == 'total' else timings[name] for timings in results.values()]
+        print(f'{name:<26}' + ''.join(f'{seconds * 1000 / args.sessions:>12.3f}' for seconds in row))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Board helpers shared by the SQLite and MySQL versions of the application.
+
+The board is ROWS x COLS cells addressed in row-major order; the layout is
+stored in game_states.board_state as JSON (sometimes JSON-encoded twice,
+because the client sends an already serialized string to /api/save_state).
+
+The set of opened cells of a (session, round) is a fixed-width bitmap split
+into two 63-bit words, so each word fits a non-negative signed 64-bit SQL integer.
+"""
+
+import json
+import struct
+from typing import Iterable, List, Optional, Tuple
+
+from config import ROWS, COLS, TOTAL_CELLS
+
+BITMAP_WORD_BITS = 63
+assert TOTAL_CELLS <= 2 * BITMAP_WORD_BITS, 'board does not fit into the opened cells bitmap'
+
+
+def cell_index(row: int, col: int) -> Optional[int]:
+    """Return the row-major index of a cell, or None if it is off the board."""
+    try:
+        row, col = int(row), int(col)
+    except (TypeError, ValueError):
+        return None
+    if not (0 <= row < ROWS and 0 <= col < COLS):
+        return None
+    return row * COLS + col
+
+
+def parse_board_layout(raw) -> Optional[list]:
+    """Decode a stored board layout into a ROWS x COLS list (handles double encoding)."""
+    layout = raw
+    for _ in range(2):
+        if not isinstance(layout, str):
+            break
+        try:
+            layout = json.loads(layout)
+        except (json.JSONDecodeError, TypeError):
+            return None
+    return layout if isinstance(layout, list) else None
+
+
+def assign_cell_questions(question_bank, round_num) -> List[int]:
+    """
+    Assign a question id to every cell of the board.
+
+    Ids are taken from consecutive shuffle bags of the round, so a question
+    repeats only after every other question of the round has been assigned.
+    """
+    cell_questions: List[int] = []
+    while len(cell_questions) < TOTAL_CELLS:
+        question_ids = question_bank.shuffled_ids(round_num)
+        if not question_ids:
+            return []
+        cell_questions.extend(question_ids[:TOTAL_CELLS - len(cell_questions)])
+    return cell_questions
+
+
+def unpack_cell_questions(blob) -> List[int]:
+    """Unpack a stored cell-to-question mapping (packed like a shuffle bag, one int32 per cell)."""
+    if not blob:
+        return []
+    return list(struct.unpack(f'<{len(blob) // 4}i', blob))
+
+
+def cell_bit(index: int) -> Tuple[int, int]:
+    """Return the (lo, hi) bitmap words with only the given cell set."""
+    if index < BITMAP_WORD_BITS:
+        return 1 << index, 0
+    return 0, 1 << (index - BITMAP_WORD_BITS)
+
+
+def cells_bitmap(indices: Iterable[int]) -> Tuple[int, int]:
+    """Return the (lo, hi) bitmap words with the given cells set."""
+    bits_lo = bits_hi = 0
+    for index in indices:
+        lo, hi = cell_bit(index)
+        bits_lo |= lo
+        bits_hi |= hi
+    return bits_lo, bits_hi
+
+
+def bitmap_cells(bits_lo: int, bits_hi: int) -> List[int]:
+    """Return the indices of the cells set in the bitmap, in row-major order."""
+    bits = (bits_lo or 0) | ((bits_hi or 0) << BITMAP_WORD_BITS)
+    indices = []
+    while bits:
+        lowest = bits & -bits
+        indices.append(lowest.bit_length() - 1)
+        bits ^= lowest
+    return indices
+
+
+def decode_opened_cells(bits_lo: int, bits_hi: int, layout) -> List[dict]:
+    """Decode a bitmap into the opened cells JSON shape: [{'row', 'col', 'value'}]."""
+    cells = []
+    for index in bitmap_cells(bits_lo, bits_hi):
+        row, col = divmod(index, COLS)
+        try:
+            value = layout[row][col]
+        except (TypeError, IndexError, KeyError):
+            value = None
+        cells.append({'row': row, 'col': col, 'value': value})
+    return cells
@@ -18,6 +18,8 @@ COLS = 10
 TOTAL_CELLS = ROWS * COLS  # 80 cells
 NUM_QUESTIONS = 80  # Numbers representing questions
 NUM_SYMBOLS = 0  # No symbols, only numbers
+HISTORY_LIMIT = 50  # Undo/redo steps kept per session
+CHANGE_LOG_LIMIT = 256  # Changes kept per session for delta sync (clients further behind get a snapshot)
 
 # Style settings
 BODY_STYLE = {
@@ -4,9 +4,12 @@ and connection pooling for shared database access.
 """
 
 import os
+import threading
+import time
 from dotenv import load_dotenv
 from mysql.connector import pooling
 from mysql.connector.constants import ClientFlag
+from mysql.connector.errors import PoolError
 import mysql.connector
 from contextlib import contextmanager
 import logging
@@ -27,9 +30,14 @@ class DatabaseConfig:
         self.database = os.getenv('DB_NAME', 'mydb')
         self.user = os.getenv('DB_USER', 'lalagame_user')
         self.password = os.getenv('DB_PASSWORD', '')
-        self.pool_size = int(os.getenv('DB_POOL_SIZE', 10))
-        self.pool_timeout = int(os.getenv('DB_POOL_TIMEOUT', 30))
+        # mysql.connector pools hold at most pooling.CNX_POOL_MAXSIZE connections
+        self.pool_size = max(1, min(int(os.getenv('DB_POOL_SIZE', 10)), pooling.CNX_POOL_MAXSIZE))
+        self.pool_timeout = float(os.getenv('DB_POOL_TIMEOUT', 30))  # seconds to wait for a free connection
         self.pool_recycle = int(os.getenv('DB_POOL_RECYCLE', 3600))
+        # Resetting the session on every return costs a round trip; off by default,
+        # since connections are initialized once with init_command
+        self.pool_reset_session = os.getenv('DB_POOL_RESET_SESSION', 'false').lower() == 'true'
+        self.isolation_level = os.getenv('DB_ISOLATION_LEVEL', 'READ COMMITTED')
         
         # SSL configuration
         self.ssl_ca = os.getenv('DB_SSL_CA')
@@ -74,8 +82,11 @@ class DatabaseConfig:
             'password': self.password,
             'pool_size': self.pool_size,
             'pool_name': 'lalagame_pool',
-            'pool_reset_session': True,
-            'autocommit': False,  # We'll handle transactions manually
+            'pool_reset_session': self.pool_reset_session,
+            # Single statements commit on their own; get_db_transaction() starts explicit transactions
+            'autocommit': True,
+            # Runs once per physical connection (and again after a reconnect), not on every checkout
+            'init_command': f'SET SESSION TRANSACTION ISOLATION LEVEL {self.isolation_level}',
         }
         
         # Add SSL config if available (using individual parameters instead of 'ssl' dict)
@@ -94,37 +105,74 @@ class DatabaseConfig:
                 
         return config
 
-# Global connection pool
+# Global connection pool, created on first use
 connection_pool = None
+_pool_lock = threading.Lock()
+_pool_timeout = DatabaseConfig().pool_timeout
+
+# Checkout counters of the pool
+_pool_stats = {'checkouts': 0, 'waits': 0, 'wait_seconds': 0.0, 'exhausted': 0}
+_stats_lock = threading.Lock()
 
 def initialize_connection_pool():
     """Initialize the global connection pool."""
-    global connection_pool
-    try:
-        db_config = DatabaseConfig()
-        pool_config = db_config.get_pool_config()
-        connection_pool = pooling.MySQLConnectionPool(**pool_config)
-        logger.info(f"Connection pool initialized with size {db_config.pool_size}")
-    except Exception as e:
-        logger.error(f"Error initializing connection pool: {e}")
-        raise
+    global connection_pool, _pool_timeout
+    with _pool_lock:
+        if connection_pool is not None:
+            return
+        try:
+            db_config = DatabaseConfig()
+            pool_config = db_config.get_pool_config()
+            connection_pool = pooling.MySQLConnectionPool(**pool_config)
+            _pool_timeout = db_config.pool_timeout
+            logger.info(f"Connection pool initialized with size {db_config.pool_size}")
+        except Exception as e:
+            logger.error(f"Error initializing connection pool: {e}")
+            raise
+
+def _record_checkout(waited=None, exhausted=False):
+    with _stats_lock:
+        if exhausted:
+            _pool_stats['exhausted'] += 1
+        else:
+            _pool_stats['checkouts'] += 1
+        if waited is not None:
+            _pool_stats['waits'] += 1
+            _pool_stats['wait_seconds'] += waited
 
 def get_connection():
-    """Get a connection from the pool."""
-    global connection_pool
+    """Get a connection from the pool, waiting up to DB_POOL_TIMEOUT seconds while it is exhausted."""
     if connection_pool is None:
         initialize_connection_pool()
     
-    try:
-        conn = connection_pool.get_connection()
-        # Set proper isolation level for consistency
-        cursor = conn.cursor()
-        cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED")
-        cursor.close()
-        return conn
-    except Exception as e:
-        logger.error(f"Error getting connection from pool: {e}")
-        raise
+    started = None
+    delay = 0.001
+    while True:
+        try:
+            conn = connection_pool.get_connection()
+            _record_checkout(None if started is None else time.perf_counter() - started)
+            return conn
+        except PoolError as e:
+            # mysql.connector does not block on an empty pool - poll until a connection is returned
+            now = time.perf_counter()
+            if started is None:
+                started = now
+            elif now - started >= _pool_timeout:
+                _record_checkout(now - started, exhausted=True)
+                logger.error(f"Connection pool exhausted for {now - started:.1f}s: {e}")
+                raise
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        except Exception as e:
+            logger.error(f"Error getting connection from pool: {e}")
+            raise
+
+def pool_stats():
+    """Connection pool counters: checkouts, waits for a free connection, total wait time, give-ups."""
+    with _stats_lock:
+        stats = dict(_pool_stats)
+    stats['size'] = connection_pool.pool_size if connection_pool is not None else 0
+    return stats
 
 @contextmanager
 def get_db_connection():
@@ -171,10 +219,4 @@ def test_connection():
             return result is not None
     except Exception as e:
         logger.error(f"Connection test failed: {e}")
-        return False
-
-# Initialize the pool when module is imported
-try:
-    initialize_connection_pool()
-except Exception as e:
-    logger.warning(f"Could not initialize connection pool: {e}. Will initialize on first use.")
\ No newline at end of file
+        return False
\ No newline at end of file
@@ -0,0 +1,205 @@
+"""
+Cold storage of finished games.
+
+Finished games leave the live tables for an append-only archive: one segment
+file per day (UTC) in which every game is a gzip member of its own, so the
+segment reads as one gzipped JSON Lines stream while any single game can be
+cut out by offset. Next to each segment a small index lists
+[session_id, offset, length] per game. Replays and reports are served from
+the archive without touching the live database; a game can even be sent as
+stored, already gzipped. Archiving the same game again (a retry after a crash
+between the append and the delete of the live rows) writes nothing.
+"""
+
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from board import unpack_cell_questions
+from storage import Storage
+
+# Archive directory (SESSION_ARCHIVE_DIR)
+ARCHIVE_DIR = os.getenv('SESSION_ARCHIVE_DIR', 'archive')
+CHUNK_SIZE = 64 * 1024
+
+_SEGMENT = 'sessions-{day}.jsonl.gz'
+_INDEX = 'sessions-{day}.idx'
+
+Location = Tuple[str, int, int]  # day, offset, length
+
+
+def archive_record(storage: Storage, session_id: str) -> Optional[Dict[str, Any]]:
+    """Everything stored for the session as a JSON-ready dict; None if it never had a game or players."""
+    game_state = storage.game_states.get(session_id)
+    players = storage.players.list(session_id)
+    if game_state is None and not players:
+        return None
+    game_state = dict(game_state or {})
+    game_state['cell_questions'] = unpack_cell_questions(game_state.get('cell_questions'))
+    rounds = range(1, (game_state.get('current_round') or 1) + 1)
+    return {
+        'session_id': session_id,
+        'game_state': game_state,
+        'players': players,
+        'opened_cells': {str(round_num): storage.cells.load(session_id, round_num) for round_num in rounds},
+        # [seq, row, col] in the order the cells were opened, for replays
+        'opening_order': {str(round_num): [list(cell) for cell in storage.cells.opening_order(session_id, round_num)]
+                          for round_num in rounds}
+    }
+
+
+def archive_day(at: float) -> str:
+    """Segment day (UTC) of a unix time."""
+    return time.strftime('%Y-%m-%d', time.gmtime(at))
+
+
+class GameArchive:
+    """Day segments of gzip members with a session_id -> location index, loaded on first use."""
+
+    def __init__(self, directory: str = ARCHIVE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._index: Optional[Dict[str, Location]] = None  # latest location of every archived session
+        self._ends: Dict[str, int] = {}  # day -> end of the last indexed game in the segment
+
+    def _path(self, pattern: str, day: str) -> str:
+        return os.path.join(self.directory, pattern.format(day=day))
+
+    def _load(self) -> Dict[str, Location]:
+        """The index of every segment (call with the lock held)."""
+        if self._index is None:
+            index: Dict[str, Location] = {}
+            for path in sorted(glob.glob(self._path(_INDEX, '*'))):
+                day = os.path.basename(path)[len('sessions-'):-len('.idx')]
+                with open(path, encoding='utf-8') as entries:
+                    for line in entries:
+                        try:
+                            session_id, offset, length = json.loads(line)
+                        except ValueError:
+                            break  # an entry torn by a crash ends the index
+                        index[session_id] = (day, offset, length)
+                        self._ends[day] = offset + length
+            self._index = index
+        return self._index
+
+    def _member(self, location: Location) -> Dict[str, Any]:
+        """The game stored at the location."""
+        day, offset, length = location
+        with open(self._path(_SEGMENT, day), 'rb') as segment:
+            segment.seek(offset)
+            return json.loads(gzip.decompress(segment.read(length)))
+
+    def _archived(self, index: Dict[str, Location], record: Dict[str, Any]) -> bool:
+        """True if the latest archived copy of the session is this very game (call with the lock held)."""
+        location = index.get(record['session_id'])
+        if location is None:
+            return False
+        stored = self._member(location)
+        stored.pop('archived_at', None)
+        return stored == json.loads(json.dumps(record, ensure_ascii=False))
+
+    def append(self, records: List[Dict[str, Any]], at: Optional[float] = None) -> int:
+        """
+        Append the games (archive_record() dicts) to the day's segment; games already
+        archived unchanged are skipped. Returns how many were written.
+        """
+        at = time.time() if at is None else at
+        day = archive_day(at)
+        with self._lock:
+            index = self._load()
+            records = [record for record in records if not self._archived(index, record)]
+            if not records:
+                return 0
+            os.makedirs(self.directory, exist_ok=True)
+            segment_path = self._path(_SEGMENT, day)
+            end = self._ends.get(day, 0)
+            # Bytes past the last indexed game were written by an append that did not finish
+            if os.path.exists(segment_path) and os.path.getsize(segment_path) > end:
+                os.truncate(segment_path, end)
+            entries = []
+            with open(segment_path, 'ab') as segment:
+                for record in records:
+                    body = json.dumps({**record, 'archived_at': int(at)}, ensure_ascii=False) + '\n'
+                    member = gzip.compress(body.encode('utf-8'), mtime=0)
+                    segment.write(member)
+                    entries.append((record['session_id'], end, len(member)))
+                    end += len(member)
+                segment.flush()
+                os.fsync(segment.fileno())
+            # The index is written after the games it points to, and is on disk before the caller
+            # deletes the live rows
+            with open(self._path(_INDEX, day), 'a', encoding='utf-8') as index_file:
+                index_file.writelines(json.dumps(list(entry), ensure_ascii=False) + '\n' for entry in entries)
+                index_file.flush()
+                os.fsync(index_file.fileno())
+            for session_id, offset, length in entries:
+                index[session_id] = (day, offset, length)
+            self._ends[day] = end
+        return len(entries)
+
+    def locate(self, session_id: str) -> Optional[Location]:
+        """Day, offset and length of the session's archived game, or None."""
+        with self._lock:
+            return self._load().get(session_id)
+
+    def stream(self, session_id: str, chunk_size: int = CHUNK_SIZE) -> Optional[Iterator[bytes]]:
+        """The archived game as stored (one gzip member of JSON) in chunks; None if it is not archived."""
+        location = self.locate(session_id)
+        if location is None:
+            return None
+        day, offset, length = location
+
+        def chunks():
+            with open(self._path(_SEGMENT, day), 'rb') as segment:
+                segment.seek(offset)
+                remaining = length
+                while remaining:
+                    chunk = segment.read(min(chunk_size, remaining))
+                    if not chunk:
+                        return
+                    remaining -= len(chunk)
+                    yield chunk
+
+        return chunks()
+
+    def read(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """The archived game as a dict, or None."""
+        chunks = self.stream(session_id)
+        return None if chunks is None else json.loads(gzip.decompress(b''.join(chunks)))
+
+    def days(self) -> List[str]:
+        """Days that have a segment, oldest first."""
+        with self._lock:
+            self._load()
+            return sorted(self._ends)
+
+    def records(self, day: str) -> Iterator[Dict[str, Any]]:
+        """Every game archived on the day, in archive order (read sequentially, for reports)."""
+        with self._lock:
+            self._load()
+            end = self._ends.get(day, 0)
+        if not end:
+            return
+        with open(self._path(_SEGMENT, day), 'rb') as segment:
+            with gzip.open(_Limited(segment, end), 'rt', encoding='utf-8') as lines:
+                for line in lines:
+                    yield json.loads(line)
+
+
+class _Limited:
+    """Read-only view of the first `size` bytes of a file (skips a torn tail)."""
+
+    def __init__(self, raw, size: int):
+        self.raw = raw
+        self.remaining = size
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.raw.read(size)
+        self.remaining -= len(data)
+        return data
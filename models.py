@@ -3,12 +3,20 @@ SQLAlchemy ORM models for the LaLaGame application.
 These models can be shared across multiple applications accessing the same database.
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import create_engine, event, inspect, text, DDL, Boolean, Column, Integer, String, Text, DateTime, ForeignKey, LargeBinary, BigInteger, Index, UniqueConstraint
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, scoped_session, relationship
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.sql import func
+from sqlalchemy.sql.expression import FunctionElement
 from datetime import datetime
+import hashlib
 import os
+import threading
+import time
+from typing import Dict, Optional
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -16,6 +24,21 @@ load_dotenv()
 
 Base = declarative_base()
 
+class change_time(FunctionElement):
+    """
+    Current time for the updated_at columns, with microseconds where the database keeps them.
+    """
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(change_time)
+def _compile_change_time(element, compiler, **kw):
+    return 'CURRENT_TIMESTAMP'
+
+@compiles(change_time, 'mysql')
+def _compile_change_time_mysql(element, compiler, **kw):
+    return 'CURRENT_TIMESTAMP(6)'
+
 class Question(Base):
     __tablename__ = 'questions'
     
@@ -24,44 +47,128 @@ class Question(Base):
     question_text = Column(Text, nullable=False)
     answer = Column(Text, nullable=False)
     theme = Column(String(255), nullable=False)
+    question_hash = Column(String(64))  # question_text_hash(): unique key of the seeded questions
+    # Last change of the row; with COUNT(*) and MAX(id) it stamps the version of the questions table
+    updated_at = Column(DateTime, server_default=func.current_timestamp(), onupdate=change_time())
+    
+    __table_args__ = (
+        UniqueConstraint('question_hash', name='uq_questions_question_hash'),
+    )
     
     def __repr__(self):
         return f"<Question(id={self.id}, round_num={self.round_num}, theme='{self.theme}')>"
 
+# MySQL itself keeps updated_at current on every UPDATE, including edits made outside the application
+_QUESTIONS_UPDATED_AT_MYSQL = 'TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)'
+event.listen(Question.__table__, 'after_create', DDL(
+    f'ALTER TABLE questions MODIFY updated_at {_QUESTIONS_UPDATED_AT_MYSQL}').execute_if(dialect='mysql'))
+
+def question_text_hash(round_num, question_text):
+    """
+    Key of a question within the questions table: a TEXT column cannot be a unique key in MySQL,
+    so questions are upserted by the hash of their round and text.
+    """
+    return hashlib.sha256(f'{round_num}:{question_text}'.encode('utf-8')).hexdigest()
+
+class GameSession(Base):
+    __tablename__ = 'sessions'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(String(255), unique=True, nullable=False)  # external id sent by the client
+    created_at = Column(DateTime, default=func.now())
+    last_seen = Column(Integer, nullable=False, default=lambda: int(time.time()))  # unix seconds of the last activity
+    
+    __table_args__ = (
+        Index('idx_sessions_last_seen', 'last_seen'),
+    )
+    
+    def __repr__(self):
+        return f"<GameSession(id={self.id}, session_id='{self.session_id}', last_seen={self.last_seen})>"
+
+def _session_key(**options):
+    """Reference to the owning session; the row is deleted together with the session."""
+    return Column(Integer, ForeignKey('sessions.id', ondelete='CASCADE'), nullable=False, **options)
+
 class GameState(Base):
     __tablename__ = 'game_states'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    session_id = Column(String(255), unique=True, nullable=False)
+    session_key = _session_key(unique=True)
     current_round = Column(Integer, default=1)
     current_cell = Column(String(50))
     score = Column(Integer, default=0)
     revealed_cells = Column(Text)  # JSON string of revealed cells
     board_state = Column(Text)     # JSON string of the entire board state
+    cell_questions = Column(LargeBinary)  # packed question id per cell (row-major)
+    version = Column(Integer, nullable=False, default=0, server_default='0')  # versioned saves so far
     created_at = Column(DateTime, default=func.now())
     
     def __repr__(self):
-        return f"<GameState(session_id='{self.session_id}', round={self.current_round})>"
+        return f"<GameState(session_key={self.session_key}, round={self.current_round})>"
 
 class OpenedCell(Base):
     __tablename__ = 'opened_cells'
+    __table_args__ = (
+        UniqueConstraint('session_key', 'round_num', 'row_num', 'col_num', name='idx_opened_cells_cell'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    session_id = Column(String(255), nullable=False)
+    session_key = _session_key()
     round_num = Column(Integer, nullable=False)
     row_num = Column(Integer, nullable=False)
     col_num = Column(Integer, nullable=False)
     cell_value = Column(Text, nullable=False)
+    seq = Column(Integer)  # order of opening within the session round
     created_at = Column(DateTime, default=func.now())
     
     def __repr__(self):
-        return f"<OpenedCell(session_id='{self.session_id}', round={self.round_num}, pos=({self.row_num},{self.col_num}))>"
+        return f"<OpenedCell(session_key={self.session_key}, round={self.round_num}, pos=({self.row_num},{self.col_num}))>"
+
+Index('idx_opened_cells_last', OpenedCell.session_key, OpenedCell.round_num, OpenedCell.seq.desc())
+
+class SessionSequence(Base):
+    __tablename__ = 'session_sequences'
+    
+    session_key = _session_key(primary_key=True)
+    last_seq = Column(Integer, nullable=False, default=0)  # monotonic event counter of the session
+    players_seq = Column(Integer, nullable=False, default=0, server_default='0')  # last change of the players
+    reset_seq = Column(Integer, nullable=False, default=0, server_default='0')    # last board reset
+    state_seq = Column(Integer, nullable=False, default=0, server_default='0')    # last saved game state or layout
+    log_start = Column(Integer, nullable=False, default=0, server_default='0')    # every cell change after it is logged
+    
+    def __repr__(self):
+        return f"<SessionSequence(session_key={self.session_key}, last_seq={self.last_seq})>"
+
+class SessionChange(Base):
+    __tablename__ = 'session_changes'
+    
+    session_key = _session_key(primary_key=True)
+    seq = Column(Integer, primary_key=True, autoincrement=False)  # number from the session's event counter
+    opened = Column(Boolean, nullable=False)  # the cell was opened (or closed)
+    round_num = Column(Integer, nullable=False)
+    row_num = Column(Integer, nullable=False)
+    col_num = Column(Integer, nullable=False)
+    cell_value = Column(Text)
+    
+    def __repr__(self):
+        return f"<SessionChange(session_key={self.session_key}, seq={self.seq}, pos=({self.row_num},{self.col_num}))>"
+
+class OpenedBitmap(Base):
+    __tablename__ = 'opened_bitmaps'
+    
+    session_key = _session_key(primary_key=True)
+    round_num = Column(Integer, primary_key=True)
+    bits_lo = Column(BigInteger, nullable=False, default=0)  # cells 0..62
+    bits_hi = Column(BigInteger, nullable=False, default=0)  # cells 63..125
+    
+    def __repr__(self):
+        return f"<OpenedBitmap(session_key={self.session_key}, round={self.round_num})>"
 
 class Score(Base):
     __tablename__ = 'scores'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    session_id = Column(String(255))
+    session_key = _session_key()
     round_num = Column(Integer)
     player_name = Column(String(255))
     score = Column(Integer)
@@ -70,11 +177,13 @@ class Score(Base):
     def __repr__(self):
         return f"<Score(player_name='{self.player_name}', score={self.score})>"
 
+Index('idx_scores_session', Score.session_key)
+
 class Player(Base):
     __tablename__ = 'players'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    session_id = Column(String(255))
+    session_key = _session_key()
     player_name = Column(String(255))
     score = Column(Integer, default=0)
     position = Column(Integer)
@@ -83,6 +192,52 @@ class Player(Base):
     def __repr__(self):
         return f"<Player(name='{self.player_name}', score={self.score})>"
 
+Index('idx_players_session', Player.session_key, Player.position)
+
+class QuestionBag(Base):
+    __tablename__ = 'question_bags'
+    
+    session_key = _session_key(primary_key=True)
+    round_num = Column(Integer, primary_key=True)
+    question_order = Column(LargeBinary, nullable=False)  # packed permutation of question ids
+    position = Column(Integer, nullable=False, default=0)
+    size = Column(Integer, nullable=False)
+    
+    def __repr__(self):
+        return f"<QuestionBag(session_key={self.session_key}, round={self.round_num}, position={self.position}/{self.size})>"
+
+class UndoLogEntry(Base):
+    __tablename__ = 'undo_log'
+    
+    session_key = _session_key(primary_key=True)
+    position = Column(Integer, primary_key=True, autoincrement=False)  # step number in the session history
+    round_num = Column(Integer, nullable=False)
+    row_num = Column(Integer, nullable=False)
+    col_num = Column(Integer, nullable=False)
+    cell_value = Column(Text)
+    
+    def __repr__(self):
+        return f"<UndoLogEntry(session_key={self.session_key}, position={self.position}, pos=({self.row_num},{self.col_num}))>"
+
+class UndoCursor(Base):
+    __tablename__ = 'undo_cursors'
+    
+    session_key = _session_key(primary_key=True)
+    position = Column(Integer, nullable=False, default=0)  # entries 1..position are applied
+    head = Column(Integer, nullable=False, default=0)      # entries position+1..head can be redone
+    
+    def __repr__(self):
+        return f"<UndoCursor(session_key={self.session_key}, position={self.position}/{self.head})>"
+
+class Metadata(Base):
+    __tablename__ = 'metadata'
+    
+    key = Column(String(255), primary_key=True)
+    value = Column(Text)  # e.g. questions_hash of the seeded questions
+    
+    def __repr__(self):
+        return f"<Metadata(key='{self.key}')>"
+
 def get_database_url():
     """
     Generate database URL from environment variables.
@@ -121,36 +276,244 @@ def get_database_url():
     
     return base_url
 
-def get_engine():
+# One engine (and so one connection pool) per database URL for the whole process
+_engines: Dict[str, Engine] = {}
+_pool_events: Dict[Engine, Dict[str, int]] = {}
+_engines_lock = threading.Lock()
+
+# Sessions of the default engine: one per thread (per request), ended by remove_session()
+session_factory = sessionmaker()
+db_session = scoped_session(session_factory)
+
+def _create_engine(database_url):
     """
     Create SQLAlchemy engine with connection pooling and other optimizations.
     """
-    database_url = get_database_url()
+    options = {}
+    if not database_url.startswith('sqlite'):
+        # SQLite uses its own per-thread/file pools without these settings
+        options = {
+            'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+            'max_overflow': 20,
+            'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 3600)),  # Recycle connections after 1 hour
+        }
     
     # Engine configuration with pooling and other optimizations
     engine = create_engine(
         database_url,
-        pool_size=int(os.getenv('DB_POOL_SIZE', 10)),
-        max_overflow=20,
         pool_pre_ping=True,  # Verify connections before use
-        pool_recycle=int(os.getenv('DB_POOL_RECYCLE', 3600)),  # Recycle connections after 1 hour
-        echo=False  # Set to True for SQL debugging
+        echo=False,  # Set to True for SQL debugging
+        **options
     )
     
+    # Count new connections and checkouts, so pool reuse can be observed
+    counters = _pool_events[engine] = {'connects': 0, 'checkouts': 0}
+    
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        counters['connects'] += 1
+        if engine.dialect.name == 'sqlite':
+            # SQLite enforces foreign keys (ON DELETE CASCADE of the session tables) only when asked
+            dbapi_connection.execute('PRAGMA foreign_keys = ON')
+    
+    @event.listens_for(engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        counters['checkouts'] += 1
+    
     return engine
 
+def get_engine(database_url: Optional[str] = None) -> Engine:
+    """
+    Return the process-wide engine of the database URL (by default from the environment),
+    creating it on first use.
+    """
+    database_url = database_url or get_database_url()
+    engine = _engines.get(database_url)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(database_url)
+            if engine is None:
+                engine = _engines[database_url] = _create_engine(database_url)
+    return engine
+
+def pool_stats(engine: Optional[Engine] = None) -> dict:
+    """
+    Connection pool counters of an engine (by default the shared one).
+    """
+    engine = engine or get_engine()
+    pool = engine.pool
+    stats = dict(_pool_events.get(engine, {}))
+    if isinstance(pool, QueuePool):
+        stats.update({'size': pool.size(), 'checked_in': pool.checkedin(), 'checked_out': pool.checkedout(),
+                      'overflow': pool.overflow()})
+    else:
+        stats['status'] = pool.status()
+    return stats
+
 def get_session():
     """
-    Get a new database session.
+    Get the database session of the current thread from the scoped registry.
+    session.close() ends its transaction; remove_session() discards it at the end of a request.
     """
-    engine = get_engine()
-    Session = sessionmaker(bind=engine)
-    return Session()
+    if session_factory.kw.get('bind') is None:
+        session_factory.configure(bind=get_engine())
+    return db_session()
+
+def remove_session(exception=None):
+    """
+    Discard the current thread's session (Flask teardown hook), returning its connection to the pool.
+    """
+    db_session.remove()
+
+def dispose_engines():
+    """
+    Close the pooled connections of every engine (process shutdown, tests).
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+
+def session_tables():
+    """Tables keyed by the integer session key."""
+    return [table for table in Base.metadata.sorted_tables if 'session_key' in table.columns]
+
+def _migrate_session_keys(engine: Engine):
+    """
+    Move tables created by older versions, keyed by the text session_id, onto
+    integer session keys: they are renamed aside, recreated by create_all() and
+    refilled with one sessions row per distinct session_id.
+    """
+    inspector = inspect(engine)
+    existing = set(inspector.get_table_names())
+    legacy = {table.name: {column['name'] for column in inspector.get_columns(table.name)}
+              for table in session_tables() if table.name in existing}
+    legacy = {name: columns for name, columns in legacy.items() if 'session_id' in columns}
+    if not legacy:
+        return
+    
+    ignore = 'OR IGNORE' if engine.dialect.name == 'sqlite' else 'IGNORE'
+    with engine.begin() as connection:
+        for name in legacy:
+            if engine.dialect.name == 'sqlite':
+                # SQLite index names are database-wide, the new tables create them again
+                for index in inspector.get_indexes(name):
+                    connection.exec_driver_sql(f'DROP INDEX {index["name"]}')
+            connection.exec_driver_sql(f'ALTER TABLE {name} RENAME TO legacy_{name}')
+        Base.metadata.create_all(connection)
+        
+        connection.exec_driver_sql(
+            f'INSERT {ignore} INTO sessions (session_id, last_seen) SELECT session_id, {int(time.time())} FROM (' +
+            ' UNION '.join(f'SELECT session_id FROM legacy_{name} WHERE session_id IS NOT NULL' for name in legacy) +
+            ') legacy_sessions')
+        for table in session_tables():
+            if table.name not in legacy:
+                continue
+            columns = [column.name for column in table.columns if column.name in legacy[table.name]]
+            # Rows are copied in insertion order, so the earliest of duplicated cells is kept
+            order = ' ORDER BY l.id' if 'id' in legacy[table.name] else ''
+            connection.exec_driver_sql(
+                f'INSERT {ignore} INTO {table.name} (session_key, {", ".join(columns)}) '
+                f'SELECT s.id, {", ".join(f"l.{column}" for column in columns)} FROM legacy_{table.name} l '
+                f'JOIN sessions s ON s.session_id = l.session_id{order}')
+            connection.exec_driver_sql(f'DROP TABLE legacy_{table.name}')
+        connection.exec_driver_sql('UPDATE opened_cells SET seq = id WHERE seq IS NULL')
+
+def _migrate_session_activity(engine: Engine):
+    """
+    Add the last activity time to a sessions table created by the previous version;
+    its sessions count as active at the time of the migration.
+    """
+    inspector = inspect(engine)
+    if 'sessions' not in inspector.get_table_names():
+        return
+    if 'last_seen' in {column['name'] for column in inspector.get_columns('sessions')}:
+        return
+    with engine.begin() as connection:
+        connection.exec_driver_sql('ALTER TABLE sessions ADD COLUMN last_seen INTEGER')
+        connection.exec_driver_sql(f'UPDATE sessions SET last_seen = {int(time.time())}')
+        for index in GameSession.__table__.indexes:
+            index.create(connection)
+
+def _migrate_state_version(engine: Engine):
+    """Add the save version to a game_states table created by the previous version."""
+    inspector = inspect(engine)
+    if 'game_states' not in inspector.get_table_names():
+        return
+    if 'version' in {column['name'] for column in inspector.get_columns('game_states')}:
+        return
+    with engine.begin() as connection:
+        connection.exec_driver_sql('ALTER TABLE game_states ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+
+def _migrate_change_markers(engine: Engine):
+    """
+    Add the players, reset and game state change numbers and the change log start to a
+    session_sequences table of a previous version; numbers given out before the
+    change log existed are not in it.
+    """
+    inspector = inspect(engine)
+    if 'session_sequences' not in inspector.get_table_names():
+        return
+    existing = {column['name'] for column in inspector.get_columns('session_sequences')}
+    with engine.begin() as connection:
+        for column in ('players_seq', 'reset_seq', 'state_seq', 'log_start'):
+            if column not in existing:
+                connection.exec_driver_sql(
+                    f'ALTER TABLE session_sequences ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0')
+        if 'log_start' not in existing:
+            connection.exec_driver_sql('UPDATE session_sequences SET log_start = last_seq')
+
+def _migrate_question_hash(engine: Engine):
+    """
+    Add the unique question hash to a questions table created by an older version;
+    duplicated questions are removed first, keeping the earliest copy (and its id).
+    """
+    inspector = inspect(engine)
+    if 'questions' not in inspector.get_table_names():
+        return
+    if 'question_hash' in {column['name'] for column in inspector.get_columns('questions')}:
+        return
+    with engine.begin() as connection:
+        connection.exec_driver_sql('ALTER TABLE questions ADD COLUMN question_hash VARCHAR(64)')
+        hashes, duplicates = {}, []  # digest -> id of its earliest copy
+        for id_, round_num, question_text in connection.exec_driver_sql(
+                'SELECT id, round_num, question_text FROM questions ORDER BY id'):
+            digest = question_text_hash(round_num, question_text)
+            if digest in hashes:
+                duplicates.append(id_)
+            else:
+                hashes[digest] = id_
+        if duplicates:
+            connection.execute(text('DELETE FROM questions WHERE id = :id'), [{'id': id_} for id_ in duplicates])
+        if hashes:
+            connection.execute(text('UPDATE questions SET question_hash = :hash WHERE id = :id'),
+                               [{'id': id_, 'hash': digest} for digest, id_ in hashes.items()])
+        connection.exec_driver_sql(
+            'CREATE UNIQUE INDEX uq_questions_question_hash ON questions (question_hash)')
+
+def _migrate_question_updated_at(engine: Engine):
+    """Add the last change time to a questions table created by an older version."""
+    inspector = inspect(engine)
+    if 'questions' not in inspector.get_table_names():
+        return
+    if 'updated_at' in {column['name'] for column in inspector.get_columns('questions')}:
+        return
+    with engine.begin() as connection:
+        if engine.dialect.name == 'mysql':
+            connection.exec_driver_sql(f'ALTER TABLE questions ADD COLUMN updated_at {_QUESTIONS_UPDATED_AT_MYSQL}')
+        else:
+            connection.exec_driver_sql('ALTER TABLE questions ADD COLUMN updated_at DATETIME')
+            connection.exec_driver_sql('UPDATE questions SET updated_at = CURRENT_TIMESTAMP')
 
-def init_database():
+def init_database(engine: Optional[Engine] = None):
     """
-    Initialize the database tables.
+    Initialize the database tables, migrating tables of older versions.
     This should be called once during application startup.
     """
-    engine = get_engine()
-    Base.metadata.create_all(engine)
\ No newline at end of file
+    engine = engine or get_engine()
+    _migrate_session_keys(engine)
+    _migrate_session_activity(engine)
+    _migrate_state_version(engine)
+    _migrate_change_markers(engine)
+    _migrate_question_hash(engine)
+    _migrate_question_updated_at(engine)
+    Base.metadata.create_all(engine)
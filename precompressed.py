@@ -0,0 +1,67 @@
+"""
+Precompressed static responses.
+
+A payload that never changes between requests (the game configuration, static assets)
+is serialized once, compressed once per supported encoding and served with
+a content-hash ETag, so repeat requests cost no serialization or compression.
+Brotli is used when the optional `brotli` package is installed.
+"""
+
+import gzip
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+
+class PrecompressedPayload:
+    """A serialized body with its gzip/brotli variants and strong ETags."""
+
+    __slots__ = ('data', 'version', 'variants', 'mimetype', 'cache_control')
+
+    def __init__(self, body: bytes, data: Any = None, mimetype: str = 'application/json',
+                 cache_control: str = 'public, max-age=86400'):
+        self.data = data
+        self.version = hashlib.sha256(body).hexdigest()[:16]
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        # encoding -> (body, etag); the identity variant is always present
+        self.variants: Dict[Optional[str], tuple] = {None: (body, self.version)}
+        self.variants['gzip'] = (gzip.compress(body, compresslevel=9, mtime=0), f'{self.version}-gz')
+        if brotli is not None:
+            self.variants['br'] = (brotli.compress(body), f'{self.version}-br')
+
+    @classmethod
+    def from_json(cls, data: Any, **kwargs) -> 'PrecompressedPayload':
+        """Serialize data as compact UTF-8 JSON."""
+        body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return cls(body, data=data, **kwargs)
+
+    def _encoding_for(self, request) -> Optional[str]:
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and request.accept_encodings[encoding] > 0:
+                return encoding
+        return None
+
+    def response(self, request) -> Response:
+        """Return the best variant for the request, or 304 if the client has the current version."""
+        encoding = self._encoding_for(request)
+        body, etag = self.variants[encoding]
+
+        # Every variant has the same content, so any of their ETags is current
+        if any(request.if_none_match.contains(tag) for _, tag in self.variants.values()):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype=self.mimetype)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = self.cache_control
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
@@ -0,0 +1,158 @@
+"""
+Process-local question bank.
+
+Loads the questions table once into compact per-round arrays so that
+gameplay reads (random question, answer lookup by id) never touch the database.
+The bank is shared by the SQLite and MySQL versions of the application;
+each of them supplies its own loader callables.
+"""
+
+import random
+import struct
+import threading
+import time
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Any
+
+QuestionRow = Tuple[int, int, str, str, str]  # (id, round_num, question_text, answer, theme)
+
+# Shuffle bags store a permutation of question ids as packed little-endian int32
+_BAG_ITEM = struct.Struct('<i')
+
+
+def _as_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class RoundQuestions:
+    """Parallel arrays with the questions of a single round."""
+
+    __slots__ = ('ids', 'texts', 'answers', 'themes')
+
+    def __init__(self):
+        self.ids = array('l')
+        self.texts: List[str] = []
+        self.answers: List[str] = []
+        self.themes: List[str] = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, question_id: int, text: str, answer: str, theme: str) -> None:
+        self.ids.append(question_id)
+        self.texts.append(text)
+        self.answers.append(answer)
+        self.themes.append(theme)
+
+
+class QuestionBank:
+    """
+    In-memory cache of all questions grouped by round.
+
+    loader returns every question as (id, round_num, question_text, answer, theme).
+    version_loader (optional) returns a cheap stamp of the questions table;
+    it is polled at most once per refresh_interval seconds and a changed stamp
+    triggers a reload. invalidate() forces a reload on the next read.
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[QuestionRow]],
+                 version_loader: Optional[Callable[[], Any]] = None,
+                 refresh_interval: float = 30.0):
+        self._loader = loader
+        self._version_loader = version_loader
+        self._refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        # (round_num -> RoundQuestions, id -> (round_num, index)), swapped atomically on reload
+        self._snapshot: Tuple[Dict[int, RoundQuestions], Dict[int, Tuple[int, int]]] = ({}, {})
+        self._loaded = False
+        self._version = None
+        self._checked_at = 0.0
+
+    def invalidate(self) -> None:
+        """Drop the cached questions; the next read reloads them."""
+        with self._lock:
+            self._loaded = False
+
+    def _load(self) -> None:
+        rounds: Dict[int, RoundQuestions] = {}
+        by_id: Dict[int, Tuple[int, int]] = {}
+        version = self._version_loader() if self._version_loader else None
+        for question_id, round_num, text, answer, theme in self._loader():
+            bucket = rounds.setdefault(round_num, RoundQuestions())
+            by_id[question_id] = (round_num, len(bucket))
+            bucket.append(question_id, text, answer, theme)
+        self._snapshot = (rounds, by_id)
+        self._version = version
+        self._checked_at = time.monotonic()
+        self._loaded = True
+
+    def _ensure_loaded(self):
+        if self._loaded and (not self._version_loader
+                             or time.monotonic() - self._checked_at < self._refresh_interval):
+            return self._snapshot
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            elif self._version_loader and time.monotonic() - self._checked_at >= self._refresh_interval:
+                self._checked_at = time.monotonic()
+                if self._version_loader() != self._version:
+                    self._load()
+        return self._snapshot
+
+    @staticmethod
+    def _question(rounds, round_num: int, index: int) -> Dict[str, Any]:
+        bucket = rounds[round_num]
+        return {
+            'id': bucket.ids[index],
+            'round_num': round_num,
+            'question_text': bucket.texts[index],
+            'answer': bucket.answers[index],
+            'theme': bucket.themes[index]
+        }
+
+    def random_question(self, round_num: int) -> Optional[Dict[str, Any]]:
+        """Return a random question of the round, or None if the round is empty."""
+        rounds, _ = self._ensure_loaded()
+        round_num = _as_int(round_num)
+        bucket = rounds.get(round_num)
+        if not bucket:
+            return None
+        return self._question(rounds, round_num, random.randrange(len(bucket)))
+
+    def get(self, question_id) -> Optional[Dict[str, Any]]:
+        """Return a question by id, or None if it does not exist."""
+        rounds, by_id = self._ensure_loaded()
+        location = by_id.get(_as_int(question_id))
+        if location is None:
+            return None
+        return self._question(rounds, *location)
+
+    def round_ids(self, round_num: int) -> List[int]:
+        """Return the ids of all questions of the round."""
+        rounds, _ = self._ensure_loaded()
+        bucket = rounds.get(_as_int(round_num))
+        return list(bucket.ids) if bucket else []
+
+    def shuffled_ids(self, round_num: int) -> List[int]:
+        """Return the ids of the round's questions in random order (a new shuffle bag)."""
+        question_ids = self.round_ids(round_num)
+        random.shuffle(question_ids)
+        return question_ids
+
+    def all_questions(self) -> List[Dict[str, Any]]:
+        """Return every question ordered by id."""
+        rounds, by_id = self._ensure_loaded()
+        return [self._question(rounds, *by_id[question_id]) for question_id in sorted(by_id)]
+
+
+def pack_bag(question_ids: List[int]) -> bytes:
+    """Pack a permutation of question ids into a compact blob."""
+    return struct.pack(f'<{len(question_ids)}i', *question_ids)
+
+
+def bag_item(blob: bytes, index: int) -> int:
+    """Return the question id at the given position of a packed bag."""
+    return _BAG_ITEM.unpack_from(blob, index * _BAG_ITEM.size)[0]
@@ -1,68 +1,65 @@
 #!/usr/bin/env python3
 """
 Unified launcher for LaLaGame application
-Automatically chooses between SQLite (default) and MySQL (when configured) versions
+Picks the storage backend: --storage or LALA_STORAGE (sqlite, mysql, memory, orm);
+without either, MySQL is used when configured and SQLite otherwise.
+The memory backend keeps its journal and snapshots in --data-dir (LALA_MEMORY_DIR),
+and the orm backend connects to LALA_ORM_URL (by default the MySQL of the DB_* variables)
 """
 
+import argparse
 import os
 import sys
 from dotenv import load_dotenv
 
+
+def choose_backend(requested=None):
+    """Return the backend to launch: the requested one, or MySQL if its environment is configured"""
+    if requested:
+        return requested
+    mysql_vars = ['DB_HOST', 'DB_NAME', 'DB_USER', 'DB_PASSWORD']
+    return 'mysql' if all(os.getenv(var) for var in mysql_vars) else 'sqlite'
+
+
 def main():
-    """Main function to launch the appropriate version of the application"""
+    """Main function to launch the application on the chosen storage backend"""
     # Try to load environment variables
     load_dotenv()
-    
-    # Check if MySQL environment variables are configured
-    mysql_vars = ['DB_HOST', 'DB_NAME', 'DB_USER', 'DB_PASSWORD']
-    mysql_configured = all(os.getenv(var) for var in mysql_vars)
-    
-    if mysql_configured:
-        print("MySQL configuration detected. Launching MySQL version...")
-        try:
-            from app_mysql import app, init_db
-            print("Initializing database...")
-            init_db()
-            print("Starting server...")
-            app.run(
-                host=os.getenv('FLASK_HOST', '0.0.0.0'),
-                port=int(os.getenv('FLASK_PORT', 5555)),
-                debug=os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
-            )
-        except ImportError as e:
-            print(f"Error importing MySQL version: {e}")
-            print("Falling back to SQLite version...")
-            # Continue to SQLite version
-            mysql_configured = False
-        except Exception as e:
-            # Check if it's specifically a MySQL connection error
-            error_msg = str(e).lower()
-            if "can't connect to mysql" in error_msg or "connection refused" in error_msg or "2003" in error_msg:
-                print(f"MySQL server not available: {e}")
-                print("Falling back to SQLite version...")
-                mysql_configured = False
-            else:
-                print(f"Error starting MySQL version: {e}")
-                sys.exit(1)
-    
-    if not mysql_configured:
-        print("Launching SQLite version (default)...")
-        try:
-            from app import app, init_db
-            print("Initializing database...")
-            init_db()
-            print("Starting server...")
-            app.run(
-                host='0.0.0.0',
-                port=5555,
-                debug=False  # More secure for production
-            )
-        except ImportError as e:
-            print(f"Error importing SQLite version: {e}")
-            sys.exit(1)
-        except Exception as e:
-            print(f"Error starting SQLite version: {e}")
+
+    from storage import BACKENDS, StorageError, create_storage
+    parser = argparse.ArgumentParser(description='LaLaGame server')
+    parser.add_argument('--storage', choices=BACKENDS, default=os.getenv('LALA_STORAGE') or None,
+                        help='storage backend (default: mysql when DB_* variables are set, otherwise sqlite)')
+    parser.add_argument('--data-dir', default=os.getenv('LALA_MEMORY_DIR', 'memory_store'),
+                        help='journal and snapshot directory of the memory backend')
+    args = parser.parse_args()
+    backend = choose_backend(args.storage)
+
+    from app import app, init_db, use_storage, install_reload_signal
+    try:
+        print(f"Launching with {backend} storage...")
+        options = {'path': args.data_dir} if backend == 'memory' else {}
+        use_storage(create_storage(backend, **options))
+        print("Initializing database...")
+        init_db()
+    except (ImportError, OSError, StorageError) as e:
+        if backend != 'mysql':
+            print(f"Error initializing {backend} storage: {e}")
             sys.exit(1)
+        print(f"MySQL storage not available: {e}")
+        print("Falling back to SQLite storage...")
+        use_storage(create_storage('sqlite')).close()
+        init_db()
+
+    if install_reload_signal():
+        print(f"Send SIGHUP (kill -HUP {os.getpid()}) to reload config.py")
+    print("Starting server...")
+    app.run(
+        host=os.getenv('FLASK_HOST', '0.0.0.0'),
+        port=int(os.getenv('FLASK_PORT', 5555)),
+        debug=os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
+    )
+
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
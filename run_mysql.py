@@ -33,7 +33,9 @@ def main():
     
     try:
         # Импортируем и запускаем приложение
-        from app_mysql import app, init_db
+        from app import app, init_db, use_storage
+        from storage import create_storage
+        use_storage(create_storage('mysql'))
         
         print("Инициализация базы данных...")
         init_db()
@@ -0,0 +1,145 @@
+"""
+Expiry of abandoned sessions.
+
+Every request marks its session as seen; the marks are kept in memory and
+written to the storage in one statement per run. A background thread deletes
+the sessions idle for longer than the TTL in small batches, pausing between
+them so the writes of live games are not held up, optionally moving each game
+into the GameArchive first. On a longer schedule the backend returns the
+freed space to the database (incremental vacuum on SQLite, OPTIMIZE TABLE on
+MySQL).
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from game_archive import GameArchive, archive_record
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# Sessions without activity for this long are deleted (0 disables the janitor)
+SESSION_TTL = float(os.getenv('SESSION_TTL_HOURS', 72)) * 3600
+JANITOR_INTERVAL = float(os.getenv('JANITOR_INTERVAL_S', 300))
+BATCH_SIZE = int(os.getenv('JANITOR_BATCH', 100))
+BATCH_PAUSE = float(os.getenv('JANITOR_BATCH_PAUSE_MS', 50)) / 1000
+VACUUM_INTERVAL = float(os.getenv('VACUUM_INTERVAL_HOURS', 24)) * 3600
+# Expired games are archived only when the archive directory is configured explicitly
+ARCHIVE_EXPIRED = bool(os.getenv('SESSION_ARCHIVE_DIR'))
+
+
+class SessionJanitor:
+    """
+    Deletes the sessions idle for longer than ttl seconds, batch_size at a time.
+
+    storage returns the storage to clean (the app can switch it at runtime);
+    games are moved into archive first when one is given; forget is called
+    with every deleted session_id, so caches drop it as well.
+    """
+
+    def __init__(self, storage: Callable[[], Storage], ttl: float = SESSION_TTL, interval: float = JANITOR_INTERVAL,
+                 batch_size: int = BATCH_SIZE, pause: float = BATCH_PAUSE, archive: Optional[GameArchive] = None,
+                 vacuum_interval: float = VACUUM_INTERVAL, forget: Callable[[str], None] = lambda session_id: None):
+        self._storage = storage
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.archive = archive
+        self.vacuum_interval = vacuum_interval
+        self._forget = forget
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()  # one run at a time
+        self._seen = set()  # sessions active since their activity was last written
+        self._last_vacuum = time.time()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {'runs': 0, 'batches': 0, 'expired': 0, 'rows_reclaimed': 0, 'archived': 0, 'vacuums': 0,
+                      'last_vacuum': {}}
+
+    def touch(self, session_id: Optional[str]) -> None:
+        """Mark the session as active now."""
+        if not session_id or not self.ttl:
+            return
+        with self._lock:
+            self._seen.add(session_id)
+        self._ensure_started()
+
+    def flush_seen(self, now: Optional[float] = None) -> int:
+        """Write the activity marked since the last flush; returns the number of sessions."""
+        with self._lock:
+            seen, self._seen = self._seen, set()
+        if not seen:
+            return 0
+        try:
+            self._storage().touch_sessions(sorted(seen), int(time.time() if now is None else now))
+        except Exception:
+            with self._lock:
+                self._seen |= seen
+            raise
+        return len(seen)
+
+    def run_once(self, now: Optional[float] = None) -> Dict[str, int]:
+        """Write the activity, expire the idle sessions batch by batch and vacuum when due."""
+        now = time.time() if now is None else now
+        report = {'expired': 0, 'rows_reclaimed': 0, 'archived': 0}
+        with self._run_lock:
+            storage = self._storage()
+            self.flush_seen(now)
+            while True:
+                idle = storage.idle_sessions(int(now - self.ttl), self.batch_size)
+                with self._lock:
+                    # Sessions that came back after the flush are kept
+                    batch = [session_id for session_id in idle if session_id not in self._seen]
+                if not batch:
+                    break
+                if self.archive is not None:
+                    report['archived'] += self.archive.append(
+                        [record for record in (archive_record(storage, session_id) for session_id in batch) if record],
+                        now)
+                report['rows_reclaimed'] += storage.session_rows(batch)
+                report['expired'] += storage.delete_sessions(batch)
+                for session_id in batch:
+                    self._forget(session_id)
+                self.stats['batches'] += 1
+                if len(idle) < self.batch_size or self._stop.wait(self.pause):
+                    break
+
+            if self.vacuum_interval and now - self._last_vacuum >= self.vacuum_interval:
+                self.stats['last_vacuum'] = storage.vacuum()
+                self.stats['vacuums'] += 1
+                self._last_vacuum = now
+
+            self.stats['runs'] += 1
+            for name, count in report.items():
+                self.stats[name] += count
+        if report['expired']:
+            logger.info(f"Expired {report['expired']} idle sessions, {report['rows_reclaimed']} rows reclaimed")
+        return report
+
+    def stop(self) -> None:
+        """Stop the background thread and write the pending activity."""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+            self._stop.clear()
+        self.flush_seen()
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='session-janitor', daemon=True)
+                self._thread.start()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Session janitor run failed")
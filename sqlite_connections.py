@@ -0,0 +1,150 @@
+"""
+Managed SQLite connections for the SQLite version of the application.
+
+Every thread keeps one open connection per database file and reuses it across
+requests instead of reconnecting each time. Connections run in WAL mode with
+tuned pragmas. close() only releases the connection (rolling back unfinished
+work); the Flask teardown hook releases whatever a request left open.
+
+Write transactions are started explicitly with BEGIN IMMEDIATE (the same
+statements that the sqlite3 module would wrap in an implicit BEGIN), so the
+time spent waiting for the writer lock can be measured and exposed in stats().
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_KB', 16384))
+MMAP_SIZE = int(os.getenv('SQLITE_MMAP_BYTES', 64 * 1024 * 1024))
+
+_WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+_LOCKING_BEGINS = ('BEGIN IMMEDIATE', 'BEGIN EXCLUSIVE')
+
+
+def _statement_kind(sql: str) -> str:
+    return ' '.join(sql.lstrip().split(None, 2)[:2]).upper()
+
+
+class ManagedCursor(sqlite3.Cursor):
+    """Cursor that opens write transactions itself and times the writer lock wait."""
+
+    def _before(self, sql: str) -> None:
+        if not self.connection.in_transaction and _statement_kind(sql).split(' ', 1)[0] in _WRITE_STATEMENTS:
+            self.connection.begin_immediate()
+
+    def execute(self, sql, parameters=()):
+        if _statement_kind(sql).startswith(_LOCKING_BEGINS):
+            return self.connection.timed(super().execute, sql, parameters)
+        self._before(sql)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._before(sql)
+        return super().executemany(sql, seq_of_parameters)
+
+
+class ManagedConnection(sqlite3.Connection):
+    """Connection owned by a thread; close() releases it instead of closing."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.registry: Optional['SQLiteConnections'] = None
+        self.users = 0  # nested get() calls of the owning thread
+
+    def cursor(self, factory=ManagedCursor):
+        return super().cursor(factory)
+
+    # The shortcut methods create plain cursors internally, route them through ManagedCursor
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def timed(self, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.registry.record_lock_wait(time.perf_counter() - started)
+
+    def begin_immediate(self) -> None:
+        self.timed(sqlite3.Cursor(self).execute, 'BEGIN IMMEDIATE')
+
+    def close(self) -> None:
+        """Release the connection; the last user rolls back unfinished work."""
+        self.users = max(0, self.users - 1)
+        if self.users == 0 and self.in_transaction:
+            self.rollback()
+
+    def discard(self) -> None:
+        """Really close the connection."""
+        sqlite3.Connection.close(self)
+
+
+class SQLiteConnections:
+    """Thread-local registry of managed connections with usage counters."""
+
+    def __init__(self, row_factory=None):
+        self.row_factory = row_factory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {'opened': 0, 'reused': 0, 'write_transactions': 0, 'lock_wait_seconds': 0.0}
+
+    def _connect(self, database: str) -> ManagedConnection:
+        conn = sqlite3.connect(database, factory=ManagedConnection,
+                               timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        conn.registry = self
+        conn.row_factory = self.row_factory
+        # Only takes effect in a new, empty database; older files are converted by Storage.init_schema()
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        conn.execute('PRAGMA foreign_keys = ON')  # ON DELETE CASCADE of the session tables
+        return conn
+
+    def get(self, database: str) -> ManagedConnection:
+        """Return this thread's connection to the database, opening it on first use."""
+        conns: Dict[str, ManagedConnection] = self._local.__dict__.setdefault('conns', {})
+        conn = conns.get(database)
+        if conn is None:
+            conn = conns[database] = self._connect(database)
+            self._count('opened')
+        else:
+            self._count('reused')
+        conn.users += 1
+        return conn
+
+    def release(self) -> None:
+        """Release every connection of this thread (rolling back unfinished work)."""
+        for conn in getattr(self._local, 'conns', {}).values():
+            conn.users = 0
+            if conn.in_transaction:
+                conn.rollback()
+
+    def close_all(self, database: Optional[str] = None) -> None:
+        """Close this thread's connections (to one database, or all of them)."""
+        conns = getattr(self._local, 'conns', {})
+        for path in [path for path in conns if database is None or path == database]:
+            conns.pop(path).discard()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def record_lock_wait(self, seconds: float) -> None:
+        with self._lock:
+            self._stats['write_transactions'] += 1
+            self._stats['lock_wait_seconds'] += seconds
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._stats)
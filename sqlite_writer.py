@@ -0,0 +1,143 @@
+"""
+Single-writer queue with group commit for the SQLite version of the application.
+
+Write operations are callables taking a cursor (and their arguments). They are executed by one
+writer thread that owns the write connection; operations queued within a few
+milliseconds of each other share one transaction (one commit, one WAL sync).
+Each operation runs inside its own savepoint, so a failing operation is rolled
+back alone and its exception is delivered to its caller only.
+Callers wait on a Future for their own result; reads keep using the
+per-thread connections, which are not blocked by the writer in WAL mode.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+GROUP_COMMIT_DELAY = float(os.getenv('SQLITE_GROUP_COMMIT_MS', 2)) / 1000
+MAX_BATCH = int(os.getenv('SQLITE_GROUP_COMMIT_BATCH', 64))
+
+Operation = Callable[..., Any]  # operation(cursor, *args)
+
+_STOP = object()
+
+
+class WriteQueue:
+    """
+    Queue of write operations executed and committed in groups by one thread.
+
+    connect returns the write connection (called by the writer thread before
+    every batch, so it may hand out a cached per-thread connection);
+    on_exit is called by the writer thread when it stops.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection],
+                 on_exit: Optional[Callable[[], None]] = None,
+                 delay: float = GROUP_COMMIT_DELAY, max_batch: int = MAX_BATCH):
+        self._connect = connect
+        self._on_exit = on_exit
+        self.delay = delay
+        self.max_batch = max_batch
+        self._queue: 'queue.Queue' = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.stats = {'operations': 0, 'commits': 0}
+
+    def submit(self, operation: Operation, *args) -> Future:
+        """Queue operation(cursor, *args); the future resolves after its group is committed."""
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((operation, args, future))
+        return future
+
+    def run(self, operation: Operation, *args) -> Any:
+        """Queue a write operation and wait for its result (re-raises its exception)."""
+        return self.submit(operation, *args).result()
+
+    def stop(self) -> None:
+        """Finish the queued operations and stop the writer thread."""
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='sqlite-writer', daemon=True)
+                self._thread.start()
+
+    def _collect(self, first) -> Tuple[List[tuple], bool]:
+        """Gather the operations that arrive within the group commit window."""
+        batch, stopping = [first], False
+        deadline = time.monotonic() + self.delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+        return batch, stopping
+
+    def _loop(self) -> None:
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _STOP:
+                    return
+                batch, stopping = self._collect(item)
+                self._commit(batch)
+                if stopping:
+                    return
+        finally:
+            if self._on_exit:
+                self._on_exit()
+
+    def _commit(self, batch: List[tuple]) -> None:
+        batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        results = []
+        conn = None
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            for operation, args, future in batch:
+                cursor.execute('SAVEPOINT write_op')
+                try:
+                    results.append((future, operation(cursor, *args), None))
+                    cursor.execute('RELEASE write_op')
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO write_op')
+                    cursor.execute('RELEASE write_op')
+                    results.append((future, None, e))
+            conn.commit()
+        except Exception as e:
+            # The group could not be committed: every operation of it failed
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            if conn is not None:
+                conn.close()
+
+        self.stats['operations'] += len(batch)
+        self.stats['commits'] += 1
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
@@ -0,0 +1,1159 @@
+// Import game constants from config via API
+let SYMBOLS = [];
+const ROWS = 8;
+const COLS = 10;
+const TOTAL_CELLS = ROWS * COLS; // 100 cells
+const NUM_QUESTIONS = 80; // Numbers representing questions
+let NUM_SYMBOLS = 0; // Will be set after loading config
+
+// Game state
+let board = [];
+let sessionId = localStorage.getItem('sessionId') || generateSessionId();
+let gameBoard = document.getElementById('gameBoard');
+let colLabels = document.getElementById('colLabels');
+let rowLabels = document.getElementById('rowLabels');
+
+let currentQuestionId = null;
+let cellQuestions = []; // Question id assigned to each cell (row-major), filled by saveBoardLayout
+let questionTexts = {}; // Prefetched question texts of the round by question id
+
+// Undo/redo history is kept on the server as cell-level deltas,
+// the client only tracks whether the buttons are enabled
+let canUndo = false;
+let canRedo = false;
+
+// Version of the saved game state this page last read or wrote; the server
+// rejects a save made over a version another tab has already replaced
+let stateVersion = 0;
+
+// Change number of the session this page has applied; other screens' changes
+// after it are pulled from /api/changes every SYNC_INTERVAL_MS
+let changeSeq = 0;
+const SYNC_INTERVAL_MS = 5000;
+
+// Remove the board snapshots stored by the former client-side history
+function clearLegacyStateHistory() {
+    localStorage.removeItem(`stateHistory_${sessionId}`);
+    localStorage.removeItem(`currentStateIndex_${sessionId}`);
+}
+
+// Update the undo/redo availability from a server response
+function setHistoryFlags(data) {
+    canUndo = Boolean(data && data.can_undo);
+    canRedo = Boolean(data && data.can_redo);
+    updateHistoryButtons();
+}
+
+// Load the undo/redo availability of the session
+async function loadHistoryFlags() {
+    try {
+        const response = await fetch(`/api/history?session_id=${sessionId}`);
+        if (response.ok) {
+            setHistoryFlags(await response.json());
+        }
+    } catch (error) {
+        console.error('Error loading undo history:', error);
+    }
+}
+
+// Apply the cells changed by an undo/redo step to the board
+function applyChangedCells(changedCells) {
+    for (const changedCell of changedCells) {
+        const row = changedCell.row;
+        const col = changedCell.col;
+        if (!board[row] || !board[row][col]) {
+            continue;
+        }
+        
+        board[row][col].isRevealed = changedCell.is_revealed;
+        
+        const cellElement = document.querySelector(`.cell[data-row="${row}"][data-col="${col}"]`);
+        if (cellElement) {
+            if (changedCell.is_revealed) {
+                cellElement.textContent = board[row][col].value;
+                cellElement.classList.add('revealed');
+                cellElement.classList.add('number-cell');
+            } else {
+                cellElement.textContent = '';
+                cellElement.classList.remove('revealed', 'number-cell');
+            }
+        }
+    }
+}
+
+// Apply one undo or redo step on the server and show the changed cells
+async function applyHistoryStep(endpoint) {
+    try {
+        const response = await fetch(endpoint, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                session_id: sessionId
+            })
+        });
+        
+        const result = await response.json();
+        if (!response.ok) {
+            console.error('Error applying history step:', result);
+            return false;
+        }
+        
+        applyChangedCells(result.changed_cells || []);
+        setHistoryFlags(result);
+        return result.status === 'success';
+    } catch (error) {
+        console.error('Error communicating with server during undo/redo:', error);
+        return false;
+    }
+}
+
+// Undo the last action
+async function undoAction() {
+    return applyHistoryStep('/api/undo');
+}
+
+// Redo the next action
+async function redoAction() {
+    return applyHistoryStep('/api/redo');
+}
+
+// Update the enabled/disabled state of undo/redo buttons
+function updateHistoryButtons() {
+    const undoBtn = document.getElementById('undoBtn');
+    const redoBtn = document.getElementById('redoBtn');
+    
+    if (undoBtn) {
+        undoBtn.disabled = !canUndo;
+    }
+    
+    if (redoBtn) {
+        redoBtn.disabled = !canRedo;
+    }
+}
+
+// Сохраняем session ID в localStorage
+localStorage.setItem('sessionId', sessionId);
+
+// Initialize the game
+initGame();
+setInterval(syncChanges, SYNC_INTERVAL_MS);
+
+// Add event listener for Reset button - now shows confirmation dialog
+document.getElementById('resetBtn').addEventListener('click', function() {
+    document.getElementById('confirmationModal').style.display = 'flex';
+});
+
+// Add event listener for Undo button
+document.getElementById('undoBtn').addEventListener('click', async function() {
+    await undoAction(); // Execute undo action which includes saving state
+});
+
+// Add event listener for Redo button
+document.getElementById('redoBtn').addEventListener('click', async function() {
+    await redoAction(); // Execute redo action which includes saving state
+});
+
+// Add event listener for Confirm Reset button
+document.getElementById('confirmReset').addEventListener('click', function() {
+    document.getElementById('confirmationModal').style.display = 'none';
+    startNewGame();
+});
+
+// Add event listener for Cancel Reset button
+document.getElementById('cancelReset').addEventListener('click', function() {
+    document.getElementById('confirmationModal').style.display = 'none';
+});
+
+// Close modal if clicked outside the content
+document.getElementById('confirmationModal').addEventListener('click', function(event) {
+    if (event.target === this) {
+        this.style.display = 'none';
+    }
+});
+
+function applyConfig(configData) {
+    SYMBOLS = configData.symbols;
+    NUM_SYMBOLS = SYMBOLS.length;
+
+    // Apply body styles from config
+    document.body.style.background = configData.body_style.background;
+}
+
+async function loadConfig() {
+    try {
+        const response = await fetch('/api/config');
+        applyConfig(await response.json());
+    } catch (error) {
+        console.error('Error loading configuration:', error);
+        // Use default values if config loading fails
+        SYMBOLS = ['★', '★','★', '★','★','★','★','★','★','★'];
+        NUM_SYMBOLS = SYMBOLS.length;
+    }
+}
+
+// Load everything the page needs in one request. Sections the client already
+// has (same version) are omitted by the server and taken from localStorage
+async function loadBootstrap() {
+    const cacheKey = `bootstrapCache_${sessionId}`;
+    let cache = {};
+    try {
+        cache = JSON.parse(localStorage.getItem(cacheKey)) || {};
+    } catch (e) {
+        cache = {};
+    }
+    const cachedSections = cache.sections || {};
+    const knownVersions = Object.entries(cache.versions || {})
+        .filter(([name]) => name in cachedSections)
+        .map(([name, version]) => `${name}:${version}`)
+        .join(',');
+
+    const response = await fetch(`/api/bootstrap?session_id=${sessionId}&round_num=1&versions=${encodeURIComponent(knownVersions)}`);
+    if (!response.ok) {
+        throw new Error(`Bootstrap request failed: ${response.status}`);
+    }
+    const data = await response.json();
+    changeSeq = data.seq || 0;
+
+    const sections = {};
+    for (const name of Object.keys(data.versions)) {
+        sections[name] = name in data ? data[name] : cachedSections[name];
+    }
+    try {
+        localStorage.setItem(cacheKey, JSON.stringify({ versions: data.versions, sections: sections }));
+    } catch (e) {
+        console.error('Error caching bootstrap data:', e);
+    }
+    return sections;
+}
+
+function generateSessionId() {
+    return 'session_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9);
+}
+
+async function initGame() {
+    // The undo history now lives on the server
+    clearLegacyStateHistory();
+
+    let data = null;
+    try {
+        data = await loadBootstrap();
+    } catch (error) {
+        console.error('Error initializing game:', error);
+    }
+
+    if (!data) {
+        // If everything fails, create a fresh board
+        await loadConfig();
+        await createFreshBoard();
+        await saveBoardLayout();
+        await loadRevealedCells();
+        return;
+    }
+
+    applyConfig(data.config);
+    stateVersion = data.state ? data.state.version : 0;
+
+    // Create the game board - only from saved layout, never fresh on init unless there's no saved state
+    if (data.board && data.board.layout) {
+        await createBoardFromLayout(data.board.layout);
+        if (data.board.cell_questions.length > 0) {
+            cellQuestions = data.board.cell_questions;
+            await prefetchRoundQuestions();
+        } else {
+            // Sessions saved before cells got their questions
+            await saveBoardLayout();
+        }
+    } else {
+        // If no saved state exists, create a fresh board and save its layout
+        // This will only happen the very first time a session is created
+        await createFreshBoard();
+        await saveBoardLayout();
+    }
+
+    // Restore the revealed cells and the undo/redo buttons
+    showOpenedCells(data.opened_cells);
+    setHistoryFlags(data.history);
+}
+
+
+
+
+
+// Fisher-Yates shuffle algorithm
+function shuffleArray(array) {
+    for (let i = array.length - 1; i > 0; i--) {
+        const j = Math.floor(Math.random() * (i + 1));
+        [array[i], array[j]] = [array[j], array[i]];
+    }
+}
+
+// Variables to track highlighted row/column and selected cell
+let highlightedRow = null;
+let highlightedCol = null;
+let selectedCell = null; // Track the currently selected cell
+
+// Handle cell click
+function handleCellClick(row, col) {
+    if (board[row][col].isRevealed) return;
+
+    // If this is the same cell that was previously selected, toggle to open it
+    if (selectedCell && selectedCell.row === row && selectedCell.col === col) {
+        // Second click on the same cell - open it
+        removeHighlight();
+        hideCoordinates(row, col);
+        openCell(row, col);
+        selectedCell = null; // Clear selection
+    } else {
+        // First click on a new cell - highlight and show coordinates
+        // Remove previous selection and highlighting
+        if (selectedCell) {
+            removeHighlight();
+            hideCoordinates(selectedCell.row, selectedCell.col);
+        }
+        
+        // Set the new selected cell
+        selectedCell = { row: row, col: col };
+        
+        // Highlight the row and column
+        highlightRowCol(row, col);
+        
+        // Show coordinates on the cell
+        showCoordinates(row, col);
+    }
+}
+
+// Highlight row and column
+function highlightRowCol(row, col) {
+    // Remove previous highlights
+    removeHighlight();
+    
+    // Store current highlighted row and column
+    highlightedRow = row;
+    highlightedCol = col;
+    
+    // Highlight the entire row
+    for (let j = 0; j < COLS; j++) {
+        const cell = document.querySelector(`.cell[data-row="${row}"][data-col="${j}"]`);
+        if (cell && !cell.classList.contains('revealed')) {
+            cell.style.backgroundColor = 'rgba(255, 255, 0, 0.5)';
+        }
+    }
+    
+    // Highlight the entire column
+    for (let i = 0; i < ROWS; i++) {
+        const cell = document.querySelector(`.cell[data-row="${i}"][data-col="${col}"]`);
+        if (cell && !cell.classList.contains('revealed')) {
+            cell.style.backgroundColor = 'rgba(255, 255, 0, 0.5)';
+        }
+    }
+}
+
+// Remove row/column highlighting
+function removeHighlight() {
+    if (highlightedRow !== null && highlightedCol !== null) {
+        // Remove row highlight
+        for (let j = 0; j < COLS; j++) {
+            const cell = document.querySelector(`.cell[data-row="${highlightedRow}"][data-col="${j}"]`);
+            if (cell && !cell.classList.contains('revealed')) {
+                cell.style.backgroundColor = '';
+            }
+        }
+        
+        // Remove column highlight
+        for (let i = 0; i < ROWS; i++) {
+            const cell = document.querySelector(`.cell[data-row="${i}"][data-col="${highlightedCol}"]`);
+            if (cell && !cell.classList.contains('revealed')) {
+                cell.style.backgroundColor = '';
+            }
+        }
+        
+        highlightedRow = null;
+        highlightedCol = null;
+    }
+}
+
+// Show coordinates on the cell
+function showCoordinates(row, col) {
+    const cellElement = document.querySelector(`.cell[data-row="${row}"][data-col="${col}"]`);
+    if (cellElement) {
+        // Calculate the column letter (A-J)
+        const colLetter = String.fromCharCode(65 + col);
+        // Calculate the row number (1-8)
+        const rowNum = row + 1;
+        
+        // Store original content to restore later
+        cellElement.dataset.originalContent = cellElement.textContent;
+        
+        // Display coordinates
+        cellElement.textContent = `${colLetter}${rowNum}`;
+        cellElement.style.color = 'white';
+        cellElement.style.fontWeight = 'bold';
+    }
+}
+
+// Hide coordinates and restore original content
+function hideCoordinates(row, col) {
+    const cellElement = document.querySelector(`.cell[data-row="${row}"][data-col="${col}"]`);
+    if (cellElement) {
+        // Restore original content if it was stored
+        if (cellElement.dataset.originalContent !== undefined) {
+            cellElement.textContent = cellElement.dataset.originalContent;
+            delete cellElement.dataset.originalContent;
+        } else {
+            cellElement.textContent = '';
+        }
+        cellElement.style.color = '';
+        cellElement.style.fontWeight = '';
+    }
+}
+
+// Highlight row and column on hover (only when no cell is selected)
+function highlightRowColOnHover(row, col) {
+    // Remove previous hover highlights
+    removeHighlightOnHover();
+    
+    // Highlight the entire row
+    for (let j = 0; j < COLS; j++) {
+        const cell = document.querySelector(`.cell[data-row="${row}"][data-col="${j}"]`);
+        if (cell && !cell.classList.contains('revealed')) {
+            cell.style.backgroundColor = 'rgba(200, 200, 200, 0.3)';
+        }
+    }
+    
+    // Highlight the entire column
+    for (let i = 0; i < ROWS; i++) {
+        const cell = document.querySelector(`.cell[data-row="${i}"][data-col="${col}"]`);
+        if (cell && !cell.classList.contains('revealed')) {
+            cell.style.backgroundColor = 'rgba(200, 200, 200, 0.3)';
+        }
+    }
+    
+    // Highlight the column header
+    const colHeader = document.querySelector(`.col-label:nth-child(${col + 1})`);
+    if (colHeader) {
+        colHeader.style.backgroundColor = 'rgba(200, 200, 200, 0.3)';
+    }
+    
+    // Highlight the row header
+    const rowHeader = document.querySelector(`.row-label:nth-child(${row + 1})`);
+    if (rowHeader) {
+        rowHeader.style.backgroundColor = 'rgba(200, 200, 200, 0.3)';
+    }
+}
+
+// Remove row/column highlighting on hover
+function removeHighlightOnHover() {
+    // Remove highlights from all cells
+    const allCells = document.querySelectorAll('.cell');
+    allCells.forEach(cell => {
+        // Only remove hover highlights (light gray), don't remove selected highlights (yellow)
+        if (!cell.classList.contains('revealed')) {
+            // Check if the background color is the hover highlight color
+            const computedBg = window.getComputedStyle(cell).backgroundColor;
+            if (computedBg.includes('rgb(200, 200, 200)') || computedBg.includes('rgba(200, 200, 200, 0.3)')) {
+                cell.style.backgroundColor = '';
+            }
+        }
+    });
+    
+    // Remove highlights from column headers
+    const colHeaders = document.querySelectorAll('.col-label');
+    colHeaders.forEach(header => {
+        const computedBg = window.getComputedStyle(header).backgroundColor;
+        if (computedBg.includes('rgb(200, 200, 200)') || computedBg.includes('rgba(200, 200, 200, 0.3)')) {
+            header.style.backgroundColor = '';
+        }
+    });
+    
+    // Remove highlights from row headers
+    const rowHeaders = document.querySelectorAll('.row-label');
+    rowHeaders.forEach(header => {
+        const computedBg = window.getComputedStyle(header).backgroundColor;
+        if (computedBg.includes('rgb(200, 200, 200)') || computedBg.includes('rgba(200, 200, 200, 0.3)')) {
+            header.style.backgroundColor = '';
+        }
+    });
+}
+
+// Open a specific cell
+async function openCell(row, col) {
+    const cellElement = document.querySelector(`.cell[data-row="${row}"][data-col="${col}"]`);
+    const cellData = board[row][col];
+
+    // Check if cell is already revealed to prevent duplicates
+    if (cellData.isRevealed) {
+        return; // Cell already opened, do nothing
+    }
+
+    // Mark the cell as opened in the database
+    try {
+        const response = await fetch('/api/mark_cell_opened', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                session_id: sessionId,
+                round_num: 1, // Always use round 1 since we removed rounds
+                row: row,
+                col: col,
+                cell_value: cellData.value  // Use the value from the board state
+            })
+        });
+
+        if (!response.ok) {
+            const errorData = await response.json();
+            if (errorData.error === 'Cell already opened') {
+                // Cell was already marked as opened in the database
+                cellData.isRevealed = true;
+                cellElement.textContent = cellData.value;
+                cellElement.classList.add('revealed');
+                // Add number-cell class since all cells now contain numbers
+                cellElement.classList.add('number-cell');
+                return;
+            }
+        } else {
+            // The server recorded the opening in the undo history
+            setHistoryFlags(await response.json());
+        }
+    } catch (error) {
+        console.error('Error marking cell as opened:', error);
+        return; // Don't proceed if there's an error
+    }
+
+    cellElement.textContent = cellData.value;
+    cellElement.classList.add('revealed');
+    // Add number-cell class since all cells now contain numbers
+    cellElement.classList.add('number-cell');
+
+    cellData.isRevealed = true;
+
+    // All cells contain numbers (1-80) which represent questions
+    await askQuestion(row, col);
+
+    // Save game state
+    await saveGameState();
+}
+
+async function askQuestion(row, col) {
+    try {
+        // The question was assigned to the cell when the board was created
+        const questionId = cellQuestions[row * COLS + col];
+        let data = null;
+
+        if (questionId && questionTexts[questionId]) {
+            data = { question_id: questionId, question_text: questionTexts[questionId] };
+        } else {
+            const response = await fetch(`/api/get_cell_question?session_id=${sessionId}&row=${row}&col=${col}`);
+            data = await response.json();
+        }
+
+        if (data.question_id) {
+            currentQuestionId = data.question_id;
+
+
+            // Automatically add points after showing the question
+            setTimeout(async () => {
+            }, 3000); // Show question for 3 seconds before adding points
+        }
+    } catch (error) {
+        console.error('Error getting question:', error);
+    }
+}
+
+
+async function startNewGame() {
+    // Remove any existing highlights
+    removeHighlight();
+    
+    // Clear selected cell
+    selectedCell = null;
+    
+    // Create a fresh board with closed cells and new distribution of numbers and symbols
+    await createFreshBoard();
+
+    // Save the new board layout to the database; if another tab changed the game
+    // meanwhile, its board is shown instead and this new game is dropped
+    if (!await saveBoardLayout()) {
+        return;
+    }
+
+    // Save the new game state
+    await saveGameState();
+
+    // Clear all opened cells from the database for this session
+    try {
+        await fetch('/api/clear_opened_cells', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                session_id: sessionId,
+                round_num: 1
+            })
+        });
+    } catch (error) {
+        console.error('Error clearing opened cells:', error);
+    }
+    
+    // Clearing the opened cells also started a new undo history
+    setHistoryFlags(null);
+}
+
+async function createFreshBoard() {
+    // Clear existing elements
+    gameBoard.innerHTML = '';
+    colLabels.innerHTML = '';
+    rowLabels.innerHTML = '';
+    board = [];
+
+    // Create column labels (A-J)
+    for (let j = 0; j < COLS; j++) {
+        const letter = String.fromCharCode(65 + j); // A=65, B=66, ..., J=74
+        const label = document.createElement('div');
+        label.className = 'col-label';
+        label.textContent = letter;
+        colLabels.appendChild(label);
+    }
+
+    // Create row labels (1-10)
+    for (let i = 0; i < ROWS; i++) {
+        const label = document.createElement('div');
+        label.className = 'row-label';
+        label.textContent = i + 1;
+        rowLabels.appendChild(label);
+    }
+
+    // Create array of values for the board
+    let values = [];
+
+    // Add numbers (questions) - all 80 cells will have numbers
+    for (let i = 1; i <= NUM_QUESTIONS; i++) {
+        values.push(i.toString());
+    }
+
+    // No special symbols - all cells have numbers
+    // Shuffle the values array
+    shuffleArray(values);
+
+    // Fill the board
+    for (let i = 0; i < ROWS; i++) {
+        board[i] = [];
+        for (let j = 0; j < COLS; j++) {
+            const cellValue = values.pop();
+
+            board[i][j] = {
+                value: cellValue,
+                isRevealed: false  // All cells start closed initially
+            };
+
+            const cell = document.createElement('div');
+            cell.className = 'cell';
+            // All cells start closed (empty)
+            cell.textContent = '';
+            cell.dataset.row = i;
+            cell.dataset.col = j;
+
+            cell.addEventListener('click', () => {
+                handleCellClick(i, j);
+            });
+            
+            // Add mouseover event to highlight row and column
+            cell.addEventListener('mouseover', () => {
+                if (!cell.classList.contains('revealed')) {
+                    highlightRowColOnHover(i, j);
+                }
+            });
+            
+            // Add mouseout event to remove highlight
+            cell.addEventListener('mouseout', () => {
+                removeHighlightOnHover();
+            });
+
+            gameBoard.appendChild(cell);
+        }
+    }
+}
+
+// Create board from a saved layout
+async function createBoardFromLayout(layout) {
+    // Clear existing elements
+    gameBoard.innerHTML = '';
+    colLabels.innerHTML = '';
+    rowLabels.innerHTML = '';
+    board = [];
+
+    // Create column labels (A-J)
+    for (let j = 0; j < COLS; j++) {
+        const letter = String.fromCharCode(65 + j); // A=65, B=66, ..., J=74
+        const label = document.createElement('div');
+        label.className = 'col-label';
+        label.textContent = letter;
+        colLabels.appendChild(label);
+    }
+
+    // Create row labels (1-10)
+    for (let i = 0; i < ROWS; i++) {
+        const label = document.createElement('div');
+        label.className = 'row-label';
+        label.textContent = i + 1;
+        rowLabels.appendChild(label);
+    }
+
+    // Create the board from the layout - all cells start closed initially
+    for (let i = 0; i < ROWS; i++) {
+        board[i] = [];
+        for (let j = 0; j < COLS; j++) {
+            const cellValue = layout[i][j];
+            board[i][j] = {
+                value: cellValue,
+                isRevealed: false  // All cells start closed initially, revealed state will be loaded separately
+            };
+
+            const cell = document.createElement('div');
+            cell.className = 'cell';
+            // All cells start closed (empty)
+            cell.textContent = '';
+            cell.dataset.row = i;
+            cell.dataset.col = j;
+
+            cell.addEventListener('click', () => {
+                handleCellClick(i, j);
+            });
+            
+            // Add mouseover event to highlight row and column
+            cell.addEventListener('mouseover', () => {
+                if (!cell.classList.contains('revealed')) {
+                    highlightRowColOnHover(i, j);
+                }
+            });
+            
+            // Add mouseout event to remove highlight
+            cell.addEventListener('mouseout', () => {
+                removeHighlightOnHover();
+            });
+
+            gameBoard.appendChild(cell);
+        }
+    }
+}
+
+// Values of the current board (the layout without the opened state)
+function currentLayout() {
+    const layout = [];
+    for (let i = 0; i < ROWS; i++) {
+        layout[i] = [];
+        for (let j = 0; j < COLS; j++) {
+            layout[i][j] = board[i][j].value;
+        }
+    }
+    return layout;
+}
+
+// Save the current board layout to the database over the version this page read;
+// returns false if it was not saved
+async function saveBoardLayout() {
+    const layout = currentLayout();
+
+    try {
+        const response = await fetch('/api/save_board_layout', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                session_id: sessionId,
+                round_num: 1,
+                board_layout: layout,
+                version: stateVersion
+            })
+        });
+        const data = await response.json();
+        if (response.status === 409) {
+            await showServerState(data);
+            return false;
+        }
+        if (response.ok) {
+            stateVersion = data.version;
+            cellQuestions = data.cell_questions || [];
+            await prefetchRoundQuestions();
+            return true;
+        }
+    } catch (error) {
+        console.error('Error saving board layout:', error);
+    }
+    return false;
+}
+
+// Load the texts of the round's questions in one batch so opening a cell needs no request
+async function prefetchRoundQuestions() {
+    if (Object.keys(questionTexts).length > 0) {
+        return;
+    }
+    try {
+        const response = await fetch('/api/get_round_questions?round_num=1');
+        if (response.ok) {
+            const data = await response.json();
+            for (const question of data.questions) {
+                questionTexts[question.question_id] = question.question_text;
+            }
+        }
+    } catch (error) {
+        console.error('Error prefetching questions:', error);
+    }
+}
+
+// Mark the given opened cells as revealed on the board
+function showOpenedCells(openedCells) {
+    for (const openedCell of openedCells) {
+        const row = openedCell.row;
+        const col = openedCell.col;
+        const value = openedCell.value;
+
+        // Update the board state to mark this cell as revealed
+        if (board[row] && board[row][col]) {
+            board[row][col].isRevealed = true;
+            board[row][col].value = value;
+        }
+
+        // Update the visual representation
+        const cellElement = document.querySelector(`.cell[data-row="${row}"][data-col="${col}"]`);
+        if (cellElement) {
+            cellElement.textContent = value;
+            cellElement.classList.add('revealed');
+
+            // Add specific class for number or symbol cells
+            cellElement.classList.add('number-cell');
+        }
+    }
+}
+
+// Pull the changes made on other screens: only the cells and players changed
+// after changeSeq, or a compact snapshot when this page is too far behind or
+// the board or game state was saved since
+async function syncChanges() {
+    if (document.hidden) {
+        return;
+    }
+    try {
+        const response = await fetch(`/api/changes?session_id=${sessionId}&since=${changeSeq}&round_num=1`);
+        if (!response.ok) {
+            return;
+        }
+        const data = await response.json();
+        if (data.snapshot) {
+            await applySnapshot(data);
+        } else {
+            for (const changedCell of data.cells) {
+                if (changedCell.is_revealed && board[changedCell.row] && board[changedCell.row][changedCell.col]) {
+                    board[changedCell.row][changedCell.col].value = changedCell.value;
+                }
+            }
+            applyChangedCells(data.cells);
+            if (data.players) {
+                showPlayers(data.players);
+            }
+        }
+        changeSeq = data.seq;
+    } catch (error) {
+        console.error('Error syncing changes:', error);
+    }
+}
+
+// Replace the board, opened cells and players with a snapshot from /api/changes
+async function applySnapshot(data) {
+    const layout = board.map(row => row.map(cell => cell.value));
+    if (data.layout && JSON.stringify(data.layout) !== JSON.stringify(layout)) {
+        // The board was reset or replaced on another screen
+        await createBoardFromLayout(data.layout);
+        cellQuestions = data.cell_questions;
+    }
+    // The next save builds on the state this snapshot shows
+    stateVersion = data.version;
+    const opened = new Set(data.opened_cells.map(([row, col]) => `${row},${col}`));
+    const closed = [];
+    board.forEach((cells, row) => cells.forEach((cell, col) => {
+        if (cell.isRevealed && !opened.has(`${row},${col}`)) {
+            closed.push({ row: row, col: col, is_revealed: false });
+        }
+    }));
+    applyChangedCells(closed);
+    showOpenedCells(data.opened_cells.map(([row, col, value]) => ({ row: row, col: col, value: value })));
+    showPlayers(data.players);
+}
+
+// Load revealed cells from the database
+async function loadRevealedCells() {
+    try {
+        const response = await fetch(`/api/get_opened_cells?session_id=${sessionId}&round_num=1`);
+
+        if (response.ok) {
+            const data = await response.json();
+            if (data.opened_cells) {
+                showOpenedCells(data.opened_cells);
+            }
+        }
+    } catch (error) {
+        console.error('Error loading revealed cells:', error);
+    }
+    
+    // Restore the undo/redo button states of the session
+    await loadHistoryFlags();
+}
+
+// Board layout of a saved game state as JSON: board_state holds it either as
+// the array or as the JSON string of it
+function layoutJson(boardState) {
+    if (!boardState) {
+        return null;
+    }
+    return typeof boardState === 'string' ? boardState : JSON.stringify(boardState);
+}
+
+async function saveGameState() {
+    // Extract the board layout (just the values)
+    const layoutState = JSON.stringify(currentLayout());
+
+    try {
+        // Save general game state with board layout
+        const response = await fetch('/api/save_state', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                session_id: sessionId,
+                current_round: 1, // Always use round 1 since we removed rounds
+                current_cell: null,
+                score: 0, // Removed score tracking
+                board_state: layoutState,  // Include the board layout in the game state
+                version: stateVersion
+            })
+        });
+        const data = await response.json();
+        if (response.status === 409) {
+            await showServerState(data);
+        } else if (response.ok) {
+            stateVersion = data.version;
+        }
+    } catch (error) {
+        console.error('Error saving game state:', error);
+    }
+}
+
+// Another tab saved first (a 409 answer with its state): show its board instead of
+// this page's and build the next save on its version, without resubmitting over it
+async function showServerState(data) {
+    console.warn('Game state was changed elsewhere, showing it instead');
+    stateVersion = data.version;
+    if (layoutJson(data.board_state) !== JSON.stringify(currentLayout())) {
+        changeSeq = 0;  // an unknown change number gets the whole board in a snapshot
+        await syncChanges();
+    }
+}
+
+// Player management functions
+async function loadPlayers() {
+    try {
+        const response = await fetch(`/api/get_players?session_id=${sessionId}`);
+        const data = await response.json();
+
+        if (data.players && data.players.length > 0) {
+            // Load existing players
+            data.players.forEach((player, index) => {
+                addPlayerToTable(player.player_name, player.score, true);
+            });
+        } else {
+            // Create default players if none exist
+            await resetPlayers();
+        }
+    } catch (error) {
+        console.error('Error loading players:', error);
+    }
+}
+
+
+
+
+
+// Show the players stored on the server, unless the table already matches
+// or a player is being edited here
+function showPlayers(players) {
+    const tableBody = document.getElementById('playersTableBody');
+    if (tableBody.contains(document.activeElement)) {
+        return;
+    }
+    const shown = Array.from(tableBody.querySelectorAll('.player-row')).map(row => [
+        row.getAttribute('data-player-name'), Number(row.querySelector('.player-score').textContent)]);
+    if (JSON.stringify(shown) === JSON.stringify(players.map(player => [player.player_name, player.score]))) {
+        return;
+    }
+    tableBody.innerHTML = '';
+    players.forEach(player => addPlayerToTable(player.player_name, player.score, true));
+}
+
+async function removePlayer(playerName) {
+    // Check if there are at least 2 players remaining
+    const playerRows = document.querySelectorAll('#playersTableBody tr');
+    if (playerRows.length <= 2) {
+        alert('Должно быть как минимум 2 игрока');
+        return;
+    }
+
+    // Ask for confirmation before removing the player
+    const confirmed = confirm(`Вы уверены, что хотите удалить игрока "${playerName}"?`);
+    if (!confirmed) {
+        return; // User cancelled the deletion
+    }
+
+    try {
+        const response = await fetch('/api/remove_player', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                session_id: sessionId,
+                player_name: playerName
+            })
+        });
+
+        if (response.ok) {
+            // Remove the row from the table
+            const row = document.querySelector(`.player-row[data-player-name="${playerName}"]`);
+            if (row) {
+                row.remove();
+            }
+        }
+    } catch (error) {
+        console.error('Error removing player:', error);
+    }
+}
+
+async function updatePlayerScore(playerName, newScore) {
+    try {
+        const response = await fetch('/api/update_player', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                session_id: sessionId,
+                player_name: playerName,
+                score: newScore
+            })
+        });
+
+        if (response.ok) {
+            // Update the score in the table
+            const scoreElement = document.querySelector(`.player-row[data-player-name="${playerName}"] .player-score`);
+            if (scoreElement) {
+                scoreElement.textContent = newScore;
+            }
+        }
+    } catch (error) {
+        console.error('Error updating player score:', error);
+    }
+}
+
+function addPlayerToTable(playerName, score, isFromDatabase) {
+    const tableBody = document.getElementById('playersTableBody');
+    const playerCount = tableBody.children.length;
+
+    // Check if we already have this player in the table
+    if (document.querySelector(`.player-row[data-player-name="${playerName}"]`)) {
+        return; // Player already exists
+    }
+
+    const row = document.createElement('tr');
+    row.className = 'player-row';
+    row.setAttribute('data-player-name', playerName);
+
+    row.innerHTML = `
+        <td><input type="text" class="player-input" value="${playerName}" placeholder="Игрок/Команда"></td>
+        <td class="player-score">${score}</td>
+        <td class="score-controls">
+            <button class="score-btn minus-btn">-</button>
+            <button class="score-btn plus-btn">+</button>
+            <button class="remove-player-btn">X</button>
+        </td>
+    `;
+
+    tableBody.appendChild(row);
+
+    // Add event listeners
+    const playerInput = row.querySelector('.player-input');
+    const minusBtn = row.querySelector('.minus-btn');
+    const plusBtn = row.querySelector('.plus-btn');
+    const removeBtn = row.querySelector('.remove-player-btn');
+    const scoreElement = row.querySelector('.player-score');
+
+    // Update player name when input changes
+    playerInput.addEventListener('change', async function() {
+        const oldName = row.getAttribute('data-player-name');
+        const newName = this.value || `Игрок ${playerCount + 1}`;
+
+        // Update the data attribute
+        row.setAttribute('data-player-name', newName);
+
+        // Update in database
+        try {
+            await fetch('/api/update_player', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    session_id: sessionId,
+                    player_name: oldName,
+                    new_player_name: newName,
+                    score: parseInt(scoreElement.textContent) || 0
+                })
+            });
+        } catch (error) {
+            console.error('Error updating player name:', error);
+        }
+    });
+
+    // Decrease score
+    minusBtn.addEventListener('click', function() {
+        let currentScore = parseInt(scoreElement.textContent) || 0;
+        currentScore--;
+        scoreElement.textContent = currentScore;
+        updatePlayerScore(playerName, currentScore);
+    });
+
+    // Increase score
+    plusBtn.addEventListener('click', function() {
+        let currentScore = parseInt(scoreElement.textContent) || 0;
+        currentScore++;
+        scoreElement.textContent = currentScore;
+        updatePlayerScore(playerName, currentScore);
+    });
+
+    // Remove player
+    removeBtn.addEventListener('click', function() {
+        const playerName = row.getAttribute('data-player-name');
+        removePlayer(playerName);
+    });
+
+    // Disable remove button if this is one of the last 2 players
+    updateRemoveButtons();
+}
+
+function updateRemoveButtons() {
+    const playerRows = document.querySelectorAll('#playersTableBody tr');
+    const removeButtons = document.querySelectorAll('.remove-player-btn');
+
+    removeButtons.forEach((btn, index) => {
+        btn.disabled = playerRows.length <= 2;
+    });
+}
+
+// Initialize player table
+document.getElementById('addPlayerBtn').addEventListener('click', function() {
+    addPlayer();
+});
@@ -0,0 +1,36 @@
+"""
+Storage backends of the application.
+
+The Flask app talks to a Storage only; the backend is picked with
+create_storage() (run.py selects it from the command line or LALA_STORAGE):
+
+    sqlite  - SQLite file in WAL mode (default)
+    mysql   - MySQL through the db_config connection pool
+    memory  - process-local structures; durable through a journal and
+              snapshots when given a path
+    orm     - SQLAlchemy models on the shared engine (MySQL by default,
+              any SQLAlchemy URL through LALA_ORM_URL)
+"""
+
+from storage.base import (Storage, StorageError, STATE_COLUMNS, VERSIONED_STATE_COLUMNS, GAME_STATE_COLUMNS,
+                          STATE_DEFAULTS, history_flags, questions_hash)
+
+BACKENDS = ('sqlite', 'mysql', 'memory', 'orm')
+
+
+def create_storage(kind: str = 'sqlite', **options) -> Storage:
+    """Create a storage backend by name; options go to the backend's constructor."""
+    if kind == 'sqlite':
+        from storage.sqlite import SQLiteStorage
+        return SQLiteStorage(**options)
+    if kind == 'mysql':
+        # Imported on demand: the MySQL driver and pool are only needed by this backend
+        from storage.mysql import MySQLStorage
+        return MySQLStorage(**options)
+    if kind == 'memory':
+        from storage.memory import MemoryStorage
+        return MemoryStorage(**options)
+    if kind == 'orm':
+        from storage.orm import ORMStorage
+        return ORMStorage(**options)
+    raise ValueError(f"Unknown storage backend '{kind}', expected one of {', '.join(BACKENDS)}")
@@ -0,0 +1,312 @@
+"""
+Storage interface shared by every backend.
+
+A Storage groups one repository per table or aggregate. Every repository
+method is a single transaction of its backend, so an endpoint never has to
+manage connections, cursors or SQL dialects itself.
+"""
+
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from board import decode_opened_cells, parse_board_layout
+from config import HISTORY_LIMIT, CHANGE_LOG_LIMIT
+
+# game_states columns written by save_state (save_board_layout adds cell_questions)
+STATE_COLUMNS = ('current_round', 'current_cell', 'score', 'revealed_cells', 'board_state')
+# version counts the versioned saves of the state (0: never saved with a version)
+VERSIONED_STATE_COLUMNS = STATE_COLUMNS + ('version',)
+GAME_STATE_COLUMNS = STATE_COLUMNS + ('cell_questions', 'version')
+# Schema defaults of the game_states columns
+STATE_DEFAULTS = {'current_round': 1, 'score': 0, 'version': 0}
+# Tables of the SQL backends keyed by the session: they reference sessions.id and are deleted with the session
+SESSION_TABLES = ('game_states', 'opened_cells', 'session_sequences', 'opened_bitmaps', 'scores', 'players',
+                  'question_bags', 'undo_log', 'undo_cursors', 'session_changes')
+
+Values = Dict[str, Any]  # column -> value
+HistoryFlags = Dict[str, bool]
+ChangedCell = Dict[str, Any]  # round_num, row, col, value, is_revealed
+CellChange = Tuple[bool, int, int, int, Any]  # opened, round_num, row, col, value
+
+
+class StorageError(Exception):
+    """A backend operation failed (the driver error is chained as __cause__)."""
+
+
+def questions_hash(questions) -> str:
+    """Content hash of a list of questions (used to skip repeated seeding)."""
+    payload = json.dumps(questions, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SessionKeys:
+    """
+    Integer keys of the external session ids, cached per thread. Storage.release()
+    empties the thread's cache at the end of every request, so a request resolves
+    each session once and never keeps a key past the request.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _keys(self) -> Dict[str, int]:
+        return self._local.__dict__.setdefault('keys', {})
+
+    def get(self, session_id: str) -> Optional[int]:
+        return self._keys().get(session_id)
+
+    def put(self, session_id: str, key: int) -> None:
+        self._keys()[session_id] = key
+
+    def forget(self, session_ids: Iterable[str]) -> None:
+        keys = self._keys()
+        for session_id in session_ids:
+            keys.pop(session_id, None)
+
+    def clear(self) -> None:
+        self._keys().clear()
+
+
+def history_flags(position: int, head: int) -> HistoryFlags:
+    """Undo/redo availability for a position of the session's undo cursor."""
+    return {
+        'can_undo': position > max(0, head - HISTORY_LIMIT),
+        'can_redo': position < head
+    }
+
+
+def changes_reachable(since: int, last_seq: int, *snapshot_seqs: int) -> bool:
+    """
+    True if every change after since can be sent as a delta: the change log keeps at
+    least the last CHANGE_LOG_LIMIT numbers and is complete only after its start,
+    while board resets and saved game states are sent as a snapshot. snapshot_seqs
+    are those numbers (reset_seq, state_seq, log_start).
+    """
+    return max(1, last_seq - CHANGE_LOG_LIMIT, *snapshot_seqs) <= since <= last_seq
+
+
+def change_log_cutoff(last_seq: int, log_start: int) -> Optional[int]:
+    """
+    New start of a change log that covers the numbers after log_start up to last_seq,
+    or None while it spans at most twice CHANGE_LOG_LIMIT. The log is then cut to
+    the last CHANGE_LOG_LIMIT numbers, however many of the skipped numbers were
+    logged (players and board changes take numbers without log entries).
+    """
+    if last_seq - log_start <= 2 * CHANGE_LOG_LIMIT:
+        return None
+    return last_seq - CHANGE_LOG_LIMIT
+
+
+def collect_changes(last_seq: int, cell_changes: Iterable[CellChange],
+                    players: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """The changes response: the last change of every cell (oldest first) and the players if they changed."""
+    cells: Dict[Tuple[int, int, int], ChangedCell] = {}
+    for opened, round_num, row, col, value in cell_changes:
+        cells.pop((round_num, row, col), None)
+        cells[round_num, row, col] = {'round_num': round_num, 'row': row, 'col': col, 'value': value,
+                                      'is_revealed': bool(opened)}
+    return {'seq': last_seq, 'cells': list(cells.values()), 'players': players}
+
+
+def opened_cells_from_bitmap(bits_lo: int, bits_hi: int, board_state,
+                             audit_values: Callable[[], Dict[Tuple[int, int], Any]]) -> List[dict]:
+    """
+    Decode a bitmap of opened cells with the board layout; cells the layout
+    cannot resolve take the value recorded in the audit log (read lazily).
+    """
+    opened_cells = decode_opened_cells(bits_lo, bits_hi, parse_board_layout(board_state))
+    if any(cell['value'] is None for cell in opened_cells):
+        values = audit_values()
+        for cell in opened_cells:
+            if cell['value'] is None:
+                cell['value'] = values.get((cell['row'], cell['col']))
+    return opened_cells
+
+
+class QuestionRepository:
+    def all(self) -> List[tuple]:
+        """Every question as (id, round_num, question_text, answer, theme)."""
+        raise NotImplementedError
+
+    def version(self) -> Any:
+        """Cheap stamp that changes when the questions change."""
+        raise NotImplementedError
+
+
+class GameStateRepository:
+    def get(self, session_id: str, columns: Iterable[str] = GAME_STATE_COLUMNS) -> Optional[Values]:
+        """Return the requested columns of the session's game state, or None."""
+        raise NotImplementedError
+
+    def create(self, session_id: str, values: Values) -> Optional[Values]:
+        """Insert the game state unless it exists; returns the existing state (VERSIONED_STATE_COLUMNS) or None."""
+        raise NotImplementedError
+
+    def save(self, session_id: str, values: Values, version: int) -> Tuple[bool, int]:
+        """
+        Write the columns only if the stored version still equals version (0 also
+        creates a missing state), incrementing it. Returns (saved, current version).
+        """
+        raise NotImplementedError
+
+    def upsert_many(self, states: Dict[str, Values]) -> None:
+        """
+        Write the given columns of several sessions, keeping their other columns; every
+        write bumps the version (a new state starts at 1), so a versioned save made over
+        the replaced state is rejected.
+        """
+        raise NotImplementedError
+
+
+class PlayerRepository:
+    def list(self, session_id: str) -> List[Dict[str, Any]]:
+        """Players of the session in position order as {'player_name', 'score'}."""
+        raise NotImplementedError
+
+    def add(self, session_id: str, player_name: str) -> None:
+        """Append a player with score 0."""
+        raise NotImplementedError
+
+    def update(self, session_id: str, player_name: str, score: int, new_player_name: str) -> None:
+        """Set the player's score (and rename it when new_player_name differs)."""
+        raise NotImplementedError
+
+    def remove(self, session_id: str, player_name: str) -> None:
+        """Remove the player and renumber the remaining positions."""
+        raise NotImplementedError
+
+    def reset(self, session_id: str, player_names: List[str]) -> None:
+        """Replace the session's players with the given names."""
+        raise NotImplementedError
+
+
+class BagRepository:
+    def draw(self, session_id: str, round_num: int, shuffle: Callable[[], List[int]]) -> Optional[Tuple[int, int]]:
+        """
+        Draw the next question id of the session's shuffle bag as (question_id, remaining).
+        An exhausted or missing bag is refilled with shuffle(); a round change drops the
+        bags of the other rounds. Returns None if shuffle() returns no questions.
+        """
+        raise NotImplementedError
+
+    def reset(self, session_id: str, round_num: int) -> None:
+        """Drop the round's bag, so the next draw starts a new permutation."""
+        raise NotImplementedError
+
+
+class CellRepository:
+    """Opened cells of a session round together with the session's undo log."""
+
+    def open(self, session_id: str, round_num: int, row: int, col: int, cell_value) -> Optional[HistoryFlags]:
+        """Open the cell and record it in the undo log; None if it was already opened."""
+        raise NotImplementedError
+
+    def load(self, session_id: str, round_num: int, board_state=None) -> List[dict]:
+        """
+        Opened cells of the round as {'row', 'col', 'value'}; values are decoded with
+        board_state when given, otherwise with the stored board layout.
+        """
+        raise NotImplementedError
+
+    def opening_order(self, session_id: str, round_num: int) -> List[Tuple[int, int, int]]:
+        """Opened cells of the round as (seq, row, col) in the order they were opened."""
+        raise NotImplementedError
+
+    def revert(self, session_id: str, round_num: int, steps: int) -> List[Tuple[int, int, int]]:
+        """Close the last `steps` opened cells, returning them newest first as (id, row, col)."""
+        raise NotImplementedError
+
+    def replace(self, session_id: str, round_num: int, submitted: Dict[int, Any]) -> Tuple[List[int], List[int]]:
+        """
+        Make the round's opened cells equal to submitted (cell index -> value), writing
+        only the difference. Returns the opened and the closed cell indexes.
+        """
+        raise NotImplementedError
+
+    def clear(self, session_id: str, round_num: int) -> None:
+        """Close every cell of the round, drop its question bag and the session's undo log."""
+        raise NotImplementedError
+
+    def history(self, session_id: str) -> HistoryFlags:
+        """Undo/redo availability of the session."""
+        raise NotImplementedError
+
+    def undo(self, session_id: str) -> Tuple[Optional[List[ChangedCell]], HistoryFlags]:
+        """Undo the last cell action; changed cells are None if there was nothing to undo."""
+        raise NotImplementedError
+
+    def redo(self, session_id: str) -> Tuple[Optional[List[ChangedCell]], HistoryFlags]:
+        """Redo the last undone cell action; changed cells are None if there was nothing to redo."""
+        raise NotImplementedError
+
+
+class Storage:
+    """
+    A storage backend: repositories plus lifecycle and diagnostics.
+
+    Subclasses set the repository attributes in __init__.
+    """
+
+    name = 'base'
+
+    questions: QuestionRepository
+    game_states: GameStateRepository
+    players: PlayerRepository
+    bags: BagRepository
+    cells: CellRepository
+
+    def init_schema(self) -> None:
+        """Create or migrate the tables and seed the questions."""
+        raise NotImplementedError
+
+    def snapshot(self, session_id: str, round_num: int, board_state=None) -> Dict[str, Any]:
+        """
+        Read everything page load needs from one consistent snapshot:
+        {'game_state': Values or None, 'players', 'opened_cells', 'history', 'seq'}
+        where seq is the session's change number the snapshot includes.
+        """
+        raise NotImplementedError
+
+    def changes(self, session_id: str, since: int) -> Optional[Dict[str, Any]]:
+        """
+        What changed after the change number since: {'seq', 'cells': [ChangedCell],
+        'players': list, or None if unchanged}. None if that is no longer known
+        (see changes_reachable()); the client then needs a snapshot.
+        """
+        raise NotImplementedError
+
+    def touch_sessions(self, session_ids: Iterable[str], seen_at: int) -> None:
+        """Record activity of the sessions at seen_at (unix seconds)."""
+        raise NotImplementedError
+
+    def idle_sessions(self, seen_before: int, limit: int) -> List[str]:
+        """Up to limit sessions last active before seen_before, least recently active first."""
+        raise NotImplementedError
+
+    def session_rows(self, session_ids: Iterable[str]) -> int:
+        """Number of rows stored for the sessions (what deleting them reclaims)."""
+        raise NotImplementedError
+
+    def delete_sessions(self, session_ids: Iterable[str]) -> int:
+        """Delete the sessions with everything stored for them; returns how many existed."""
+        raise NotImplementedError
+
+    def vacuum(self) -> Dict[str, Any]:
+        """Return the space of deleted rows to the database and refresh its statistics."""
+        return {}
+
+    def release(self) -> None:
+        """Return the resources this thread took for the current request."""
+
+    def ping(self) -> bool:
+        """True if the backend can serve requests."""
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Backend counters exposed by /api/db_stats."""
+        return {}
+
+    def close(self) -> None:
+        """Release the backend's connections and threads (it may be used again afterwards)."""
@@ -0,0 +1,641 @@
+"""
+In-memory storage backend.
+
+Everything lives in Python structures owned by the process and guarded by
+one lock: a __slots__ session object per session_id, one array-backed board
+per session round and the question permutations as int arrays, so reads and
+writes never leave the process.
+
+Without a path nothing is persisted (tests, benchmarks). With a path every
+change is an operation appended to a journal, and the whole state is
+periodically written as a snapshot that replaces the journal; on start the
+snapshot is loaded and the journal replayed. Operations are deterministic
+(a shuffled bag is journaled as its permutation), so a replay rebuilds
+exactly the state the process had.
+"""
+
+import heapq
+import logging
+import os
+import pickle
+import threading
+import time
+from array import array
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from board import cell_index, BITMAP_WORD_BITS
+from config import ROWS, COLS, HISTORY_LIMIT
+from storage.base import (Storage, QuestionRepository, GameStateRepository, PlayerRepository, BagRepository,
+                          CellRepository, GAME_STATE_COLUMNS, VERSIONED_STATE_COLUMNS, STATE_DEFAULTS, history_flags,
+                          CellChange, opened_cells_from_bitmap, questions_hash, changes_reachable, change_log_cutoff,
+                          collect_changes)
+
+logger = logging.getLogger(__name__)
+
+CELLS = ROWS * COLS
+# Journal records written before the state is compacted into a snapshot
+SNAPSHOT_EVERY = int(os.getenv('MEMORY_SNAPSHOT_EVERY', 10000))
+# fsync every journal record (survives power loss, not only a crashed process)
+JOURNAL_FSYNC = os.getenv('MEMORY_JOURNAL_FSYNC', 'false').lower() == 'true'
+
+_SNAPSHOT_FILE = 'snapshot.pickle'
+_JOURNAL_FILE = 'journal.pickle'
+
+
+class _Round:
+    """Opened cells of a session round: a bitmap plus per-cell arrays."""
+
+    __slots__ = ('bits', 'seqs', 'values')
+
+    def __init__(self):
+        self.bits = 0  # bit i set = cell i opened
+        self.seqs = array('q', bytes(8 * CELLS))  # cell index -> opening sequence number
+        self.values: List[Any] = [None] * CELLS  # cell index -> value recorded when opened
+
+    def opened(self) -> List[int]:
+        return [index for index in range(CELLS) if self.bits >> index & 1]
+
+    def open(self, index: int, seq: int, value) -> None:
+        self.bits |= 1 << index
+        self.seqs[index] = seq
+        self.values[index] = value
+
+    def close(self, index: int) -> None:
+        self.bits &= ~(1 << index)
+        self.seqs[index] = 0
+        self.values[index] = None
+
+
+class _Session:
+    """Everything stored for one session_id."""
+
+    __slots__ = ('game_state', 'players', 'bags', 'rounds', 'last_seq', 'undo_log', 'position', 'head', 'last_seen',
+                 'changes', 'players_seq', 'reset_seq', 'state_seq', 'log_start')
+
+    def __init__(self):
+        self.last_seen = int(time.time())  # unix seconds of the last recorded activity
+        self.game_state: Optional[Dict[str, Any]] = None
+        self.players: List[list] = []  # [player_name, score] in position order
+        self.bags: Dict[int, list] = {}  # round_num -> [array of question ids, position]
+        self.rounds: Dict[int, _Round] = {}
+        self.last_seq = 0  # monotonic counter of the session's changes
+        self.undo_log: Dict[int, tuple] = {}  # position -> (round_num, row, col, value)
+        self.position = 0  # entries 1..position are applied
+        self.head = 0  # entries position+1..head can be redone
+        self.changes = deque()  # (seq,) + CellChange, oldest first
+        self.players_seq = 0  # number of the last change of the players
+        self.reset_seq = 0  # number of the last board reset
+        self.state_seq = 0  # number of the last saved game state or board layout
+        self.log_start = 0  # changes holds every cell change after this number
+
+    def round(self, round_num: int) -> _Round:
+        cells = self.rounds.get(round_num)
+        if cells is None:
+            cells = self.rounds[round_num] = _Round()
+        return cells
+
+    def log_cells(self, changes: List[CellChange]) -> int:
+        """Number the cell changes and append them to the change log; returns the last number."""
+        for change in changes:
+            self.last_seq += 1
+            self.changes.append((self.last_seq,) + tuple(change))
+        cutoff = change_log_cutoff(self.last_seq, self.log_start)
+        if cutoff is not None:
+            self.log_start = cutoff
+            while self.changes and self.changes[0][0] <= cutoff:
+                self.changes.popleft()
+        return self.last_seq
+
+    def mark_change(self, attribute: str) -> None:
+        """Give a change kept without a log entry (players, board reset, game state) the next number."""
+        self.last_seq += 1
+        setattr(self, attribute, self.last_seq)
+
+
+# Operations: the only code that changes the state. Each takes the storage
+# first and the journaled arguments after it, and runs with the lock held.
+
+def _set_questions(storage: 'MemoryStorage', rows: List[tuple], version: str) -> None:
+    storage.question_rows = rows
+    storage.questions_version = version
+
+
+def _create_state(storage: 'MemoryStorage', session_id: str, values: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    session = storage.session(session_id)
+    if session.game_state is not None:
+        return {column: session.game_state.get(column, STATE_DEFAULTS.get(column))
+                for column in VERSIONED_STATE_COLUMNS}
+    session.game_state = dict(values)
+    session.mark_change('state_seq')
+    return None
+
+
+def _save_state(storage: 'MemoryStorage', session_id: str, values: Dict[str, Any],
+                version: int) -> Tuple[bool, int]:
+    session = storage.sessions.get(session_id)
+    game_state = session.game_state if session is not None else None
+    current = game_state.get('version', 0) if game_state is not None else 0
+    if current != version:
+        return False, current
+    if game_state is None:
+        game_state = storage.session(session_id).game_state = {}
+    game_state.update(values, version=version + 1)
+    storage.sessions[session_id].mark_change('state_seq')
+    return True, version + 1
+
+
+def _upsert_states(storage: 'MemoryStorage', states: Dict[str, Dict[str, Any]]) -> None:
+    for session_id, values in states.items():
+        session = storage.session(session_id)
+        if session.game_state is None:
+            session.game_state = {}
+        session.game_state.update(values, version=session.game_state.get('version', 0) + 1)
+        session.mark_change('state_seq')
+
+
+def _add_player(storage: 'MemoryStorage', session_id: str, player_name: str) -> None:
+    session = storage.session(session_id)
+    session.players.append([player_name, 0])
+    session.mark_change('players_seq')
+
+
+def _update_player(storage: 'MemoryStorage', session_id: str, player_name: str, score: int,
+                   new_player_name: str) -> None:
+    session = storage.session(session_id)
+    for player in session.players:
+        if player[0] == player_name:
+            player[0], player[1] = new_player_name, score
+            session.mark_change('players_seq')
+
+
+def _remove_player(storage: 'MemoryStorage', session_id: str, player_name: str) -> None:
+    session = storage.session(session_id)
+    # Positions are list indexes, so the remaining players are renumbered implicitly
+    session.players = [player for player in session.players if player[0] != player_name]
+    session.mark_change('players_seq')
+
+
+def _reset_players(storage: 'MemoryStorage', session_id: str, player_names: List[str]) -> None:
+    session = storage.session(session_id)
+    session.players = [[name, 0] for name in player_names]
+    session.mark_change('players_seq')
+
+
+def _fill_bag(storage: 'MemoryStorage', session_id: str, round_num: int, question_ids: List[int]) -> None:
+    # A round change resets the bags of the session's other rounds
+    storage.session(session_id).bags = {round_num: [array('l', question_ids), 0]}
+
+
+def _next_from_bag(storage: 'MemoryStorage', session_id: str, round_num: int) -> Optional[Tuple[int, int]]:
+    bag = storage.session(session_id).bags.get(round_num)
+    if not bag or bag[1] >= len(bag[0]):
+        return None
+    question_ids, position = bag
+    bag[1] += 1
+    return question_ids[position], len(question_ids) - position - 1
+
+
+def _reset_bag(storage: 'MemoryStorage', session_id: str, round_num: int) -> None:
+    storage.session(session_id).bags.pop(round_num, None)
+
+
+def _open_cell(session: _Session, round_num: int, row: int, col: int, cell_value) -> bool:
+    """Set the cell's bit and record its value; False if the cell was already opened."""
+    index = cell_index(row, col)
+    cells = session.round(round_num)
+    if cells.bits >> index & 1:
+        return False
+    cells.open(index, session.log_cells([(True, round_num, row, col, cell_value)]), cell_value)
+    return True
+
+
+def _open(storage: 'MemoryStorage', session_id: str, round_num: int, row: int, col: int,
+          cell_value) -> Optional[Dict[str, bool]]:
+    session = storage.session(session_id)
+    if not _open_cell(session, round_num, row, col, cell_value):
+        return None
+
+    # Append to the undo log, dropping the redo branch and steps older than HISTORY_LIMIT
+    position = session.position + 1
+    for stale in range(position, session.head + 1):
+        session.undo_log.pop(stale, None)
+    session.undo_log.pop(position - HISTORY_LIMIT, None)
+    session.undo_log[position] = (round_num, row, col, cell_value)
+    session.position = session.head = position
+    return history_flags(position, position)
+
+
+def _revert(storage: 'MemoryStorage', session_id: str, round_num: int, steps: int) -> List[Tuple[int, int, int]]:
+    session = storage.session(session_id)
+    cells = session.rounds.get(round_num)
+    if not cells:
+        return []
+    # The true last actions, newest first; the sequence number doubles as the row id
+    last = sorted(((cells.seqs[index], index) for index in cells.opened()), reverse=True)[:steps]
+    for _, index in last:
+        cells.close(index)
+    if last:
+        session.log_cells([(False, round_num) + divmod(index, COLS) + (None,) for _, index in last])
+    return [(seq,) + divmod(index, COLS) for seq, index in last]
+
+
+def _replace(storage: 'MemoryStorage', session_id: str, round_num: int,
+             submitted: Dict[int, Any]) -> Tuple[List[int], List[int]]:
+    session = storage.session(session_id)
+    cells = session.round(round_num)
+    to_open = [index for index in submitted if not cells.bits >> index & 1]
+    to_close = [index for index in cells.opened() if index not in submitted]
+    for index in to_close:
+        cells.close(index)
+    if to_close:
+        session.log_cells([(False, round_num) + divmod(index, COLS) + (None,) for index in to_close])
+    for index in to_open:
+        cells.open(index, session.log_cells([(True, round_num) + divmod(index, COLS) + (submitted[index],)]),
+                   submitted[index])
+    return to_open, to_close
+
+
+def _clear(storage: 'MemoryStorage', session_id: str, round_num: int) -> None:
+    session = storage.session(session_id)
+    session.rounds.pop(round_num, None)
+    session.bags.pop(round_num, None)
+    session.undo_log.clear()
+    session.position = session.head = 0
+    # Clients that have not seen the reset resync from a snapshot
+    session.mark_change('reset_seq')
+
+
+def _undo(storage: 'MemoryStorage', session_id: str):
+    session = storage.session(session_id)
+    if not history_flags(session.position, session.head)['can_undo']:
+        return None, history_flags(session.position, session.head)
+
+    entry = session.undo_log.get(session.position)
+    session.position -= 1
+    changed_cells = []
+    if entry:
+        round_num, row, col, cell_value = entry
+        cells = session.rounds.get(round_num)
+        if cells:
+            cells.close(cell_index(row, col))
+        session.log_cells([(False, round_num, row, col, None)])
+        changed_cells.append({'round_num': round_num, 'row': row, 'col': col, 'value': cell_value,
+                              'is_revealed': False})
+    return changed_cells, history_flags(session.position, session.head)
+
+
+def _redo(storage: 'MemoryStorage', session_id: str):
+    session = storage.session(session_id)
+    if not history_flags(session.position, session.head)['can_redo']:
+        return None, history_flags(session.position, session.head)
+
+    session.position += 1
+    entry = session.undo_log.get(session.position)
+    changed_cells = []
+    if entry:
+        round_num, row, col, cell_value = entry
+        _open_cell(session, round_num, row, col, cell_value)
+        changed_cells.append({'round_num': round_num, 'row': row, 'col': col, 'value': cell_value,
+                              'is_revealed': True})
+    return changed_cells, history_flags(session.position, session.head)
+
+
+def _touch_sessions(storage: 'MemoryStorage', session_ids: List[str], seen_at: int) -> None:
+    for session_id in session_ids:
+        session = storage.sessions.get(session_id)
+        if session is not None:
+            session.last_seen = seen_at
+
+
+def _delete_sessions(storage: 'MemoryStorage', session_ids: List[str]) -> int:
+    return sum(storage.sessions.pop(session_id, None) is not None for session_id in session_ids)
+
+
+_OPERATIONS: Dict[str, Callable] = {function.__name__.lstrip('_'): function for function in (
+    _set_questions, _create_state, _save_state, _upsert_states, _add_player, _update_player, _remove_player,
+    _reset_players, _fill_bag, _next_from_bag, _reset_bag, _open, _revert, _replace, _clear, _undo, _redo,
+    _touch_sessions, _delete_sessions)}
+
+
+class _Repository:
+    def __init__(self, storage: 'MemoryStorage'):
+        self.storage = storage
+        self.lock = storage.lock
+        self.apply = storage.apply
+
+
+class MemoryQuestions(_Repository, QuestionRepository):
+    def all(self) -> List[tuple]:
+        with self.lock:
+            return list(self.storage.question_rows)
+
+    def version(self) -> Optional[str]:
+        return self.storage.questions_version
+
+
+class MemoryGameStates(_Repository, GameStateRepository):
+    def get(self, session_id: str, columns: Iterable[str] = GAME_STATE_COLUMNS) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            session = self.storage.sessions.get(session_id)
+            if session is None or session.game_state is None:
+                return None
+            return {column: session.game_state.get(column, STATE_DEFAULTS.get(column)) for column in columns}
+
+    def create(self, session_id: str, values: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return self.apply('create_state', session_id, values)
+
+    def save(self, session_id: str, values: Dict[str, Any], version: int) -> Tuple[bool, int]:
+        return self.apply('save_state', session_id, values, version)
+
+    def upsert_many(self, states: Dict[str, Dict[str, Any]]) -> None:
+        self.apply('upsert_states', states)
+
+
+class MemoryPlayers(_Repository, PlayerRepository):
+    def list(self, session_id: str) -> List[Dict[str, Any]]:
+        with self.lock:
+            session = self.storage.sessions.get(session_id)
+            return [{'player_name': name, 'score': score} for name, score in (session.players if session else ())]
+
+    def add(self, session_id: str, player_name: str) -> None:
+        self.apply('add_player', session_id, player_name)
+
+    def update(self, session_id: str, player_name: str, score: int, new_player_name: str) -> None:
+        self.apply('update_player', session_id, player_name, score, new_player_name)
+
+    def remove(self, session_id: str, player_name: str) -> None:
+        self.apply('remove_player', session_id, player_name)
+
+    def reset(self, session_id: str, player_names: List[str]) -> None:
+        self.apply('reset_players', session_id, list(player_names))
+
+
+class MemoryBags(_Repository, BagRepository):
+    def draw(self, session_id: str, round_num: int, shuffle: Callable[[], List[int]]) -> Optional[Tuple[int, int]]:
+        with self.lock:
+            drawn = self.apply('next_from_bag', session_id, round_num)
+            if drawn:
+                return drawn
+
+            # No bag yet or it is exhausted - start a new permutation (journaled as is)
+            question_ids = shuffle()
+            if not question_ids:
+                return None
+            self.apply('fill_bag', session_id, round_num, list(question_ids))
+            return self.apply('next_from_bag', session_id, round_num)
+
+    def reset(self, session_id: str, round_num: int) -> None:
+        self.apply('reset_bag', session_id, round_num)
+
+
+class MemoryCells(_Repository, CellRepository):
+    def open(self, session_id: str, round_num: int, row: int, col: int, cell_value) -> Optional[Dict[str, bool]]:
+        return self.apply('open', session_id, round_num, row, col, cell_value)
+
+    def load(self, session_id: str, round_num: int, board_state=None) -> List[dict]:
+        with self.lock:
+            return self.storage.load_opened_cells(session_id, round_num, board_state)
+
+    def opening_order(self, session_id: str, round_num: int) -> List[Tuple[int, int, int]]:
+        with self.lock:
+            session = self.storage.sessions.get(session_id)
+            cells = session.rounds.get(round_num) if session else None
+            if cells is None:
+                return []
+            return sorted((cells.seqs[index],) + divmod(index, COLS) for index in cells.opened())
+
+    def revert(self, session_id: str, round_num: int, steps: int) -> List[Tuple[int, int, int]]:
+        return self.apply('revert', session_id, round_num, steps)
+
+    def replace(self, session_id: str, round_num: int, submitted: Dict[int, Any]) -> Tuple[List[int], List[int]]:
+        return self.apply('replace', session_id, round_num, dict(submitted))
+
+    def clear(self, session_id: str, round_num: int) -> None:
+        self.apply('clear', session_id, round_num)
+
+    def history(self, session_id: str) -> Dict[str, bool]:
+        with self.lock:
+            session = self.storage.sessions.get(session_id)
+            return history_flags(session.position, session.head) if session else history_flags(0, 0)
+
+    def undo(self, session_id: str):
+        return self.apply('undo', session_id)
+
+    def redo(self, session_id: str):
+        return self.apply('redo', session_id)
+
+
+class MemoryStorage(Storage):
+    """
+    Process-local structures; with a path, durable through a journal and snapshots
+    in that directory, otherwise lost when the process exits.
+    """
+
+    name = 'memory'
+
+    def __init__(self, path: Optional[str] = None, snapshot_every: int = SNAPSHOT_EVERY,
+                 fsync: bool = JOURNAL_FSYNC):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.lock = threading.RLock()
+        self.sessions: Dict[str, _Session] = {}
+        self.question_rows: List[tuple] = []  # (id, round_num, question_text, answer, theme)
+        self.questions_version: Optional[str] = None
+        self.questions = MemoryQuestions(self)
+        self.game_states = MemoryGameStates(self)
+        self.players = MemoryPlayers(self)
+        self.bags = MemoryBags(self)
+        self.cells = MemoryCells(self)
+        self._journal = None
+        self._journaled = 0  # records in the journal since the last snapshot
+        self._stats = {'replayed': 0, 'snapshots': 0}
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self._recover()
+
+    def session(self, session_id: str) -> _Session:
+        """The session's record, created on first write (call with the lock held)."""
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = _Session()
+        return session
+
+    def apply(self, operation: str, *args):
+        """Run an operation on the state and append it to the journal."""
+        with self.lock:
+            result = _OPERATIONS[operation](self, *args)
+            if self.path:
+                self._append((operation, args))
+            return result
+
+    def _append(self, record: tuple) -> None:
+        if self._journal is None:
+            self._journal = open(os.path.join(self.path, _JOURNAL_FILE), 'ab')
+        pickle.dump(record, self._journal, pickle.HIGHEST_PROTOCOL)
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self._journaled += 1
+        if self._journaled >= self.snapshot_every:
+            self.snapshot_to_disk()
+
+    def _recover(self) -> None:
+        """Load the last snapshot and replay the journal written after it."""
+        snapshot_path = os.path.join(self.path, _SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'rb') as snapshot:
+                self.sessions, self.question_rows, self.questions_version = pickle.load(snapshot)
+            # Snapshots of older versions have no activity time: their sessions count as active now
+            for session in self.sessions.values():
+                if not hasattr(session, 'last_seen'):
+                    session.last_seen = int(time.time())
+                # ... nor a change log: clients of such sessions resync from a snapshot
+                if not hasattr(session, 'changes'):
+                    session.changes = deque()
+                    session.players_seq = session.reset_seq = 0
+                if not hasattr(session, 'log_start'):
+                    session.log_start = session.last_seq
+                if not hasattr(session, 'state_seq'):
+                    session.state_seq = 0
+
+        journal_path = os.path.join(self.path, _JOURNAL_FILE)
+        if not os.path.exists(journal_path):
+            return
+        valid_size = 0
+        with open(journal_path, 'rb') as journal:
+            while True:
+                try:
+                    operation, args = pickle.load(journal)
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError, TypeError) as e:
+                    # A record torn by a crash ends the journal; it is cut off below
+                    logger.warning(f"Memory journal truncated after {self._journaled} records: {e}")
+                    break
+                _OPERATIONS[operation](self, *args)
+                self._journaled += 1
+                valid_size = journal.tell()
+        if valid_size < os.path.getsize(journal_path):
+            os.truncate(journal_path, valid_size)
+        self._stats['replayed'] = self._journaled
+
+    def snapshot_to_disk(self) -> None:
+        """Write the whole state to the snapshot file and start an empty journal."""
+        if not self.path:
+            return
+        with self.lock:
+            snapshot_path = os.path.join(self.path, _SNAPSHOT_FILE)
+            with open(snapshot_path + '.tmp', 'wb') as snapshot:
+                pickle.dump((self.sessions, self.question_rows, self.questions_version), snapshot,
+                            pickle.HIGHEST_PROTOCOL)
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+            # The snapshot replaces the old one atomically; only then is the journal emptied
+            os.replace(snapshot_path + '.tmp', snapshot_path)
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            open(os.path.join(self.path, _JOURNAL_FILE), 'wb').close()
+            self._journaled = 0
+            self._stats['snapshots'] += 1
+
+    def init_schema(self) -> None:
+        from config import get_questions
+        questions = get_questions()
+        digest = questions_hash(questions)
+        with self.lock:
+            if digest == self.questions_version:
+                return
+            # Same upsert semantics as the SQL backends: ids of known questions are kept
+            rows = {(row[1], row[2]): row for row in self.question_rows}
+            next_id = max((row[0] for row in self.question_rows), default=0) + 1
+            for round_num, text, answer, theme in questions:
+                existing = rows.get((round_num, text))
+                if existing:
+                    rows[(round_num, text)] = (existing[0], round_num, text, answer, theme)
+                else:
+                    rows[(round_num, text)] = (next_id, round_num, text, answer, theme)
+                    next_id += 1
+            self.apply('set_questions', sorted(rows.values()), digest)
+
+    def load_opened_cells(self, session_id: str, round_num: int, board_state=None) -> List[dict]:
+        """Opened cells of the round (call with the lock held)."""
+        session = self.sessions.get(session_id)
+        cells = session.rounds.get(round_num) if session else None
+        if not cells or not cells.bits:
+            return []
+        if board_state is None and session.game_state:
+            board_state = session.game_state.get('board_state')
+        # One int holds the whole board; split it like the SQL bits_lo/bits_hi columns
+        low_mask = (1 << BITMAP_WORD_BITS) - 1
+        return opened_cells_from_bitmap(
+            cells.bits & low_mask, cells.bits >> BITMAP_WORD_BITS, board_state,
+            lambda: {divmod(index, COLS): cells.values[index] for index in cells.opened()})
+
+    def snapshot(self, session_id: str, round_num: int, board_state=None) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'game_state': self.game_states.get(session_id),
+                'players': self.players.list(session_id),
+                'opened_cells': self.load_opened_cells(session_id, round_num, board_state),
+                'history': self.cells.history(session_id),
+                'seq': self.sessions[session_id].last_seq if session_id in self.sessions else 0
+            }
+
+    def changes(self, session_id: str, since: int) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None or not changes_reachable(since, session.last_seq, session.reset_seq,
+                                                        session.state_seq, session.log_start):
+                return None
+            return collect_changes(session.last_seq, [change[1:] for change in session.changes if change[0] > since],
+                                   self.players.list(session_id) if session.players_seq > since else None)
+
+    def touch_sessions(self, session_ids: Iterable[str], seen_at: int) -> None:
+        self.apply('touch_sessions', list(session_ids), seen_at)
+
+    def idle_sessions(self, seen_before: int, limit: int) -> List[str]:
+        with self.lock:
+            idle = [(session.last_seen, session_id) for session_id, session in self.sessions.items()
+                    if session.last_seen < seen_before]
+        return [session_id for _, session_id in heapq.nsmallest(limit, idle)]
+
+    def session_rows(self, session_ids: Iterable[str]) -> int:
+        # Counted like the SQL rows: the session, its state, players, bags, round bitmaps, opened cells, undo log,
+        # change log
+        rows = 0
+        with self.lock:
+            for session_id in session_ids:
+                session = self.sessions.get(session_id)
+                if session is None:
+                    continue
+                rows += (1 + (session.game_state is not None) + len(session.players) + len(session.bags)
+                         + sum(1 + bin(cells.bits).count('1') for cells in session.rounds.values())
+                         + len(session.undo_log) + len(session.changes))
+        return rows
+
+    def delete_sessions(self, session_ids: Iterable[str]) -> int:
+        return self.apply('delete_sessions', list(session_ids))
+
+    def vacuum(self) -> Dict[str, Any]:
+        # Deleted sessions leave the files only when the journal is compacted into a snapshot
+        if not self.path:
+            return {}
+        self.snapshot_to_disk()
+        return {'snapshot': True}
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {'sessions': len(self.sessions), 'durable': bool(self.path), 'journaled': self._journaled,
+                    **self._stats}
+
+    def close(self) -> None:
+        # Compact on shutdown so the next start only loads the snapshot
+        if self.path and self._journaled:
+            self.snapshot_to_disk()
+        with self.lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
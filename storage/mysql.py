@@ -0,0 +1,788 @@
+"""
+MySQL storage backend.
+
+Connections come from the db_config pool in autocommit mode. Writes are
+single statements where possible (ON DUPLICATE KEY UPDATE upserts,
+LAST_INSERT_ID(expr) returned in the OK packet, window-function
+renumbering), multi-row inserts go through executemany, which the
+connector sends as one multi-row statement, and multi-row deletes are one
+IN list. Only writes that must change several tables together run in an
+explicit transaction. round_trips counts the statements sent. Session tables
+are keyed by the integer id of the sessions row, looked up once per request.
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import mysql.connector
+
+from board import cell_index, cell_bit, cells_bitmap, bitmap_cells, BITMAP_WORD_BITS
+from config import COLS, HISTORY_LIMIT
+from db_config import get_db_connection, get_db_transaction, test_connection, pool_stats
+from question_bank import pack_bag, bag_item
+from storage.base import (Storage, StorageError, QuestionRepository, GameStateRepository, PlayerRepository,
+                          BagRepository, CellRepository, GAME_STATE_COLUMNS, VERSIONED_STATE_COLUMNS, SESSION_TABLES,
+                          history_flags, SessionKeys, opened_cells_from_bitmap, questions_hash, changes_reachable,
+                          change_log_cutoff, collect_changes)
+
+logger = logging.getLogger(__name__)
+
+
+class _Cursor:
+    """Cursor wrapper counting the statements sent to the server (round trips)."""
+
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, operation, params=()):
+        self._counter.add(1)
+        return self._cursor.execute(operation, params)
+
+    def executemany(self, operation, seq_params):
+        seq_params = list(seq_params)
+        # The connector sends an INSERT as one multi-row statement, anything else row by row
+        self._counter.add(1 if operation.lstrip().upper().startswith('INSERT') else len(seq_params))
+        return self._cursor.executemany(operation, seq_params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _RoundTrips:
+    """Number of statements (including START TRANSACTION and COMMIT) sent by the backend."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, count: int) -> None:
+        with self._lock:
+            self.count += count
+
+
+round_trips = _RoundTrips()
+
+
+@contextmanager
+def _reading():
+    """Cursor of a pooled connection in autocommit mode (each statement stands alone)."""
+    try:
+        with get_db_connection() as conn:
+            yield conn, _Cursor(conn.cursor(), round_trips)
+    except mysql.connector.Error as e:
+        raise StorageError(str(e)) from e
+
+
+@contextmanager
+def _statement():
+    """Cursor for writes of one statement: autocommit makes each one atomic without START/COMMIT."""
+    with _reading() as (conn, cursor):
+        yield cursor
+
+
+@contextmanager
+def _transaction():
+    """Cursor of a pooled connection inside a transaction (committed on exit)."""
+    try:
+        with get_db_transaction() as conn:
+            round_trips.add(2)  # START TRANSACTION and COMMIT
+            yield _Cursor(conn.cursor(), round_trips)
+    except mysql.connector.Error as e:
+        raise StorageError(str(e)) from e
+
+
+# Integer keys of the sessions met by the current request (emptied by MySQLStorage.release())
+session_keys = SessionKeys()
+
+
+def _session_key(session_id, create=False):
+    """The session's integer key, looked up once per request; None for an unknown session unless create"""
+    key = session_keys.get(session_id)
+    if key is None:
+        with _reading() as (conn, cursor):
+            cursor.execute('SELECT id FROM sessions WHERE session_id = %s', (session_id,))
+            row = cursor.fetchone()
+            if row is not None:
+                key = row[0]
+            elif create:
+                # LAST_INSERT_ID(id) returns the existing key when the session was created concurrently
+                cursor.execute('''
+                    INSERT INTO sessions (session_id, last_seen) VALUES (%s, UNIX_TIMESTAMP())
+                    ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)
+                ''', (session_id,))
+                key = cursor.lastrowid
+            else:
+                return None
+        session_keys.put(session_id, key)
+    return key
+
+
+# --- schema -----------------------------------------------------------------
+
+def _migrate_schema(cursor):
+    """Fill the tables added by later versions from the rows of older databases"""
+    # Seed the per-session event counters once
+    cursor.execute('SELECT 1 FROM session_sequences LIMIT 1')
+    if cursor.fetchone() is None:
+        cursor.execute('''
+            INSERT IGNORE INTO session_sequences (session_key, last_seq, log_start)
+            SELECT session_key, IFNULL(MAX(seq), 0), IFNULL(MAX(seq), 0) FROM opened_cells GROUP BY session_key
+        ''')
+
+    # One-time backfill of the opened cells bitmaps from the per-cell rows
+    cursor.execute('SELECT 1 FROM opened_bitmaps LIMIT 1')
+    if cursor.fetchone() is None:
+        cursor.execute(f'''
+            INSERT IGNORE INTO opened_bitmaps (session_key, round_num, bits_lo, bits_hi)
+            SELECT session_key, round_num,
+                   BIT_OR(IF(row_num * {COLS} + col_num < {BITMAP_WORD_BITS}, 1 << (row_num * {COLS} + col_num), 0)),
+                   BIT_OR(IF(row_num * {COLS} + col_num >= {BITMAP_WORD_BITS}, 1 << (row_num * {COLS} + col_num - {BITMAP_WORD_BITS}), 0))
+            FROM opened_cells
+            WHERE row_num >= 0 AND col_num >= 0 AND col_num < {COLS}
+            GROUP BY session_key, round_num
+        ''')
+
+
+def _seed_questions(cursor):
+    """Upsert config.QUESTIONS by their unique question_hash, only if their content hash changed"""
+    from config import get_questions
+    from models import question_text_hash
+
+    questions = get_questions()
+    digest = questions_hash(questions)
+    # The stamp row exists before it is locked, so concurrent first starts seed one after another
+    cursor.execute("INSERT IGNORE INTO metadata (`key`, value) VALUES ('questions_hash', '')")
+    cursor.execute("SELECT value FROM metadata WHERE `key` = 'questions_hash' FOR UPDATE")
+    if cursor.fetchone()[0] == digest:
+        return
+    cursor.executemany('''
+        INSERT INTO questions (round_num, question_text, answer, theme, question_hash) VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE answer = VALUES(answer), theme = VALUES(theme)
+    ''', [tuple(question) + (question_text_hash(question[0], question[1]),) for question in questions])
+    cursor.execute("UPDATE metadata SET value = %s WHERE `key` = 'questions_hash'", (digest,))
+    logger.info(f"Seeded {len(questions)} questions")
+
+
+# --- operations inside a transaction ------------------------------------------
+
+def _next_seq(cursor, session_key, count=1):
+    """Allocate count numbers from the session's monotonic counter and return the last one"""
+    cursor.execute('''
+        INSERT INTO session_sequences (session_key, last_seq) VALUES (%s, LAST_INSERT_ID(%s))
+        ON DUPLICATE KEY UPDATE last_seq = LAST_INSERT_ID(last_seq + VALUES(last_seq))
+    ''', (session_key, count))
+    # LAST_INSERT_ID(expr) comes back in the OK packet, no SELECT LAST_INSERT_ID() round trip
+    return cursor.lastrowid
+
+
+def _log_cells(cursor, session_key, changes, last_seq):
+    """Write cell changes to the change log under the numbers ending at last_seq, pruning it when too long"""
+    # executemany sends the rows as one multi-row INSERT
+    cursor.executemany('''
+        INSERT INTO session_changes (session_key, seq, opened, round_num, row_num, col_num, cell_value)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ''', [(session_key, seq) + tuple(change) for seq, change in enumerate(changes, last_seq - len(changes) + 1)])
+    cursor.execute('SELECT log_start FROM session_sequences WHERE session_key = %s', (session_key,))
+    cutoff = change_log_cutoff(last_seq, cursor.fetchone()[0])
+    if cutoff is not None:
+        cursor.execute('DELETE FROM session_changes WHERE session_key = %s AND seq <= %s', (session_key, cutoff))
+        cursor.execute('UPDATE session_sequences SET log_start = %s WHERE session_key = %s', (cutoff, session_key))
+
+
+def _mark_change(cursor, session_key, column):
+    """Give a change kept without a log entry (players, board reset, game state) the session's next number"""
+    # Assignments apply left to right: column takes the incremented last_seq
+    cursor.execute(f'''
+        INSERT INTO session_sequences (session_key, last_seq, {column}) VALUES (%s, 1, 1)
+        ON DUPLICATE KEY UPDATE last_seq = last_seq + 1, {column} = last_seq
+    ''', (session_key,))
+
+
+def _clear_cell_bits(cursor, session_key, round_num, indices):
+    """Clear the bits of the cells in the session round's bitmap"""
+    bits_lo, bits_hi = cells_bitmap(indices)
+    cursor.execute('''
+        UPDATE opened_bitmaps SET bits_lo = bits_lo & ~%s, bits_hi = bits_hi & ~%s
+        WHERE session_key = %s AND round_num = %s
+    ''', (bits_lo, bits_hi, session_key, round_num))
+
+
+def _open_cell(cursor, session_key, round_num, row, col, cell_value):
+    """Set the cell's bit and write its audit row; False if the cell was already opened"""
+    # The duplicate check and the write are one statement,
+    # MySQL reports 0 affected rows when the bit was already set
+    bits_lo, bits_hi = cell_bit(cell_index(row, col))
+    cursor.execute('''
+        INSERT INTO opened_bitmaps (session_key, round_num, bits_lo, bits_hi) VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE bits_lo = bits_lo | VALUES(bits_lo), bits_hi = bits_hi | VALUES(bits_hi)
+    ''', (session_key, round_num, bits_lo, bits_hi))
+    if cursor.rowcount == 0:
+        return False
+
+    # Keep the per-cell audit log; the unique cell index makes a racing duplicate a no-op
+    seq = _next_seq(cursor, session_key)
+    cursor.execute('''
+        INSERT IGNORE INTO opened_cells (session_key, round_num, row_num, col_num, cell_value, seq)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    ''', (session_key, round_num, row, col, cell_value, seq))
+    _log_cells(cursor, session_key, [(True, round_num, row, col, cell_value)], seq)
+    return True
+
+
+def _close_cell(cursor, session_key, round_num, row, col):
+    """Delete the cell's audit row and clear its bit"""
+    cursor.execute('''
+        DELETE FROM opened_cells WHERE session_key = %s AND round_num = %s AND row_num = %s AND col_num = %s
+    ''', (session_key, round_num, row, col))
+    _clear_cell_bits(cursor, session_key, round_num, [cell_index(row, col)])
+    _log_cells(cursor, session_key, [(False, round_num, row, col, None)], _next_seq(cursor, session_key))
+
+
+def _history_cursor(cursor, session_key):
+    """Return the (position, head) of the session's undo cursor"""
+    cursor.execute('SELECT position, head FROM undo_cursors WHERE session_key = %s', (session_key,))
+    state = cursor.fetchone()
+    return tuple(state) if state else (0, 0)
+
+
+def _record_history(cursor, session_key, round_num, row, col, cell_value):
+    """Append a cell opening to the undo log, dropping the redo branch and steps older than HISTORY_LIMIT"""
+    cursor.execute('''
+        INSERT INTO undo_cursors (session_key, position, head) VALUES (%s, LAST_INSERT_ID(1), 1)
+        ON DUPLICATE KEY UPDATE position = LAST_INSERT_ID(position + 1), head = position
+    ''', (session_key,))
+    position = cursor.lastrowid
+
+    cursor.execute('DELETE FROM undo_log WHERE session_key = %s AND (position >= %s OR position <= %s)',
+                   (session_key, position, position - HISTORY_LIMIT))
+    cursor.execute('''
+        INSERT INTO undo_log (session_key, position, round_num, row_num, col_num, cell_value)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    ''', (session_key, position, round_num, row, col, cell_value))
+    return history_flags(position, position)
+
+
+def _draw_from_bag(cursor, session_key, round_num, shuffle):
+    """
+    Draw the next question from the session's shuffle bag without repeats.
+    Returns (question_id, remaining) or None if the round has no questions
+    """
+    # The UPDATE claims the next position atomically and returns it through LAST_INSERT_ID
+    cursor.execute('''
+        UPDATE question_bags SET position = LAST_INSERT_ID(position + 1)
+        WHERE session_key = %s AND round_num = %s AND position < size
+    ''', (session_key, round_num))
+    if cursor.rowcount:
+        position = cursor.lastrowid
+        cursor.execute('SELECT question_order, size FROM question_bags WHERE session_key = %s AND round_num = %s',
+                       (session_key, round_num))
+        question_order, size = cursor.fetchone()
+        return bag_item(question_order, position - 1), size - position
+
+    # No bag yet or it is exhausted - start a new permutation
+    question_ids = shuffle()
+    if not question_ids:
+        return None
+    # A round change resets the bags of the session's other rounds
+    cursor.execute('DELETE FROM question_bags WHERE session_key = %s AND round_num != %s', (session_key, round_num))
+    cursor.execute('''
+        INSERT INTO question_bags (session_key, round_num, question_order, position, size)
+        VALUES (%s, %s, %s, 1, %s)
+        ON DUPLICATE KEY UPDATE question_order = VALUES(question_order), position = 1, size = VALUES(size)
+    ''', (session_key, round_num, pack_bag(question_ids), len(question_ids)))
+    return question_ids[0], len(question_ids) - 1
+
+
+def _load_opened_cells(cursor, session_key, round_num, board_state=None):
+    """Read the round's opened cells from the bitmap and the board layout"""
+    # One small row: the bitmap plus the board layout to decode cell values
+    cursor.execute('''
+        SELECT b.bits_lo, b.bits_hi, g.board_state FROM opened_bitmaps b
+        LEFT JOIN game_states g ON g.session_key = b.session_key
+        WHERE b.session_key = %s AND b.round_num = %s
+    ''', (session_key, round_num))
+    bitmap = cursor.fetchone()
+    if not bitmap:
+        return []
+
+    def audit_values():
+        # No saved layout - fall back to the values recorded in the audit log
+        cursor.execute('''
+            SELECT row_num, col_num, cell_value FROM opened_cells
+            WHERE session_key = %s AND round_num = %s
+        ''', (session_key, round_num))
+        return {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+
+    return opened_cells_from_bitmap(bitmap[0], bitmap[1], bitmap[2] if board_state is None else board_state,
+                                    audit_values)
+
+
+# --- repositories -------------------------------------------------------------
+
+class MySQLQuestions(QuestionRepository):
+    def all(self) -> List[tuple]:
+        with _reading() as (conn, cursor):
+            cursor.execute('SELECT id, round_num, question_text, answer, theme FROM questions')
+            return cursor.fetchall()
+
+    def version(self):
+        # Cheap stamp of the questions table: deletes change the count, inserts the last id,
+        # edits the last change time (kept by ON UPDATE CURRENT_TIMESTAMP)
+        with _reading() as (conn, cursor):
+            cursor.execute('SELECT COUNT(*), MAX(id), MAX(updated_at) FROM questions')
+            return cursor.fetchone()
+
+
+class MySQLGameStates(GameStateRepository):
+    def get(self, session_id: str, columns: Iterable[str] = GAME_STATE_COLUMNS) -> Optional[Dict[str, Any]]:
+        columns = tuple(columns)
+        key = _session_key(session_id)
+        if key is None:
+            return None
+        with _reading() as (conn, cursor):
+            cursor.execute(f'SELECT {", ".join(columns)} FROM game_states WHERE session_key = %s', (key,))
+            row = cursor.fetchone()
+            return dict(zip(columns, row)) if row else None
+
+    def create(self, session_id: str, values: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        columns = tuple(values)
+        key = _session_key(session_id, create=True)
+        with _statement() as cursor:
+            # New sessions are one statement; the unique session_key turns a repeat into a no-op
+            cursor.execute(f'''
+                INSERT IGNORE INTO game_states (session_key, {", ".join(columns)}) VALUES (%s{", %s" * len(columns)})
+            ''', (key,) + tuple(values.values()))
+            if cursor.rowcount:
+                _mark_change(cursor, key, 'state_seq')
+                return None
+            cursor.execute(f'SELECT {", ".join(VERSIONED_STATE_COLUMNS)} FROM game_states WHERE session_key = %s',
+                           (key,))
+            return dict(zip(VERSIONED_STATE_COLUMNS, cursor.fetchone()))
+
+    def save(self, session_id: str, values: Dict[str, Any], version: int) -> Tuple[bool, int]:
+        columns = tuple(values)
+        key = _session_key(session_id, create=not version)
+        if key is None:
+            return False, 0
+        with _statement() as cursor:
+            # The compare-and-set is the UPDATE itself, atomic without a transaction
+            cursor.execute(f'''
+                UPDATE game_states SET {", ".join(f"{column} = %s" for column in columns)}, version = version + 1
+                WHERE session_key = %s AND version = %s
+            ''', tuple(values.values()) + (key, version))
+            if cursor.rowcount:
+                _mark_change(cursor, key, 'state_seq')
+                return True, version + 1
+            if not version:
+                cursor.execute(f'''
+                    INSERT IGNORE INTO game_states (session_key, {", ".join(columns)}, version)
+                    VALUES (%s{", %s" * len(columns)}, 1)
+                ''', (key,) + tuple(values.values()))
+                if cursor.rowcount:
+                    _mark_change(cursor, key, 'state_seq')
+                    return True, 1
+            cursor.execute('SELECT version FROM game_states WHERE session_key = %s', (key,))
+            row = cursor.fetchone()
+            return False, row[0] if row else 0
+
+    def upsert_many(self, states: Dict[str, Dict[str, Any]]) -> None:
+        groups: Dict[tuple, list] = {}
+        for session_id, values in states.items():
+            columns = tuple(sorted(values))
+            groups.setdefault(columns, []).append((session_id,) + tuple(values[column] for column in columns))
+        with _statement() as cursor:
+            # Flushed off the request threads: the statements resolve the session keys themselves.
+            # executemany sends each group as one multi-row INSERT; each upsert is idempotent,
+            # so a failed flush is simply retried
+            cursor.executemany('INSERT IGNORE INTO sessions (session_id, last_seen) VALUES (%s, UNIX_TIMESTAMP())',
+                               [(session_id,) for session_id in states])
+            for columns, rows in groups.items():
+                cursor.executemany(f'''
+                    INSERT INTO game_states (session_key, {', '.join(columns)}, version)
+                    VALUES ((SELECT id FROM sessions WHERE session_id = %s){', %s' * len(columns)}, 1)
+                    ON DUPLICATE KEY UPDATE {', '.join(f'{column} = VALUES({column})' for column in columns)},
+                                            version = version + 1
+                ''', rows)
+            # Other screens reload the board and state of these sessions (as in _mark_change)
+            cursor.executemany('''
+                INSERT INTO session_sequences (session_key, last_seq, state_seq)
+                VALUES ((SELECT id FROM sessions WHERE session_id = %s), 1, 1)
+                ON DUPLICATE KEY UPDATE last_seq = last_seq + 1, state_seq = last_seq
+            ''', [(session_id,) for session_id in states])
+
+
+class MySQLPlayers(PlayerRepository):
+    def list(self, session_id: str) -> List[Dict[str, Any]]:
+        key = _session_key(session_id)
+        if key is None:
+            return []
+        with _reading() as (conn, cursor):
+            cursor.execute('SELECT player_name, score FROM players WHERE session_key = %s ORDER BY position', (key,))
+            return [{'player_name': row[0], 'score': row[1]} for row in cursor.fetchall()]
+
+    def add(self, session_id: str, player_name: str) -> None:
+        key = _session_key(session_id, create=True)
+        with _statement() as cursor:
+            # The position is computed by the insert itself
+            cursor.execute('''
+                INSERT INTO players (session_key, player_name, score, position)
+                SELECT %s, %s, 0, COALESCE(MAX(position), 0) + 1 FROM players WHERE session_key = %s
+            ''', (key, player_name, key))
+            _mark_change(cursor, key, 'players_seq')
+
+    def update(self, session_id: str, player_name: str, score: int, new_player_name: str) -> None:
+        key = _session_key(session_id)
+        if key is None:
+            return
+        with _statement() as cursor:
+            cursor.execute('UPDATE players SET score = %s, player_name = %s WHERE session_key = %s AND player_name = %s',
+                           (score, new_player_name, key, player_name))
+            if cursor.rowcount:
+                _mark_change(cursor, key, 'players_seq')
+
+    def remove(self, session_id: str, player_name: str) -> None:
+        key = _session_key(session_id)
+        if key is None:
+            return
+        # Autocommit statements: the renumbering only closes gaps, so it is safe to repeat;
+        # the change is marked last, so a delta reader never sees the mark before the change
+        with _statement() as cursor:
+            cursor.execute('DELETE FROM players WHERE session_key = %s AND player_name = %s', (key, player_name))
+
+            # Reorder positions after deletion in one statement, writing only the players that move
+            cursor.execute('''
+                UPDATE players p
+                JOIN (SELECT id, ROW_NUMBER() OVER (ORDER BY position, id) AS new_position
+                      FROM players WHERE session_key = %s) ranked ON ranked.id = p.id
+                SET p.position = ranked.new_position
+                WHERE NOT (p.position <=> ranked.new_position)
+            ''', (key,))
+            _mark_change(cursor, key, 'players_seq')
+
+    def reset(self, session_id: str, player_names: List[str]) -> None:
+        key = _session_key(session_id, create=True)
+        with _transaction() as cursor:
+            cursor.execute('DELETE FROM players WHERE session_key = %s', (key,))
+            cursor.executemany('INSERT INTO players (session_key, player_name, score, position) VALUES (%s, %s, 0, %s)',
+                               [(key, name, position) for position, name in enumerate(player_names, 1)])
+            _mark_change(cursor, key, 'players_seq')
+
+
+class MySQLBags(BagRepository):
+    def draw(self, session_id: str, round_num: int, shuffle: Callable[[], List[int]]) -> Optional[Tuple[int, int]]:
+        key = _session_key(session_id, create=True)
+        # Every statement of the draw is atomic on its own
+        with _statement() as cursor:
+            return _draw_from_bag(cursor, key, round_num, shuffle)
+
+    def reset(self, session_id: str, round_num: int) -> None:
+        key = _session_key(session_id)
+        if key is None:
+            return
+        with _statement() as cursor:
+            cursor.execute('DELETE FROM question_bags WHERE session_key = %s AND round_num = %s', (key, round_num))
+
+
+class MySQLCells(CellRepository):
+    def open(self, session_id: str, round_num: int, row: int, col: int, cell_value) -> Optional[Dict[str, bool]]:
+        key = _session_key(session_id, create=True)
+        with _transaction() as cursor:
+            if not _open_cell(cursor, key, round_num, row, col, cell_value):
+                return None
+            return _record_history(cursor, key, round_num, row, col, cell_value)
+
+    def load(self, session_id: str, round_num: int, board_state=None) -> List[dict]:
+        key = _session_key(session_id)
+        if key is None:
+            return []
+        with _reading() as (conn, cursor):
+            return _load_opened_cells(cursor, key, round_num, board_state)
+
+    def opening_order(self, session_id: str, round_num: int) -> List[Tuple[int, int, int]]:
+        key = _session_key(session_id)
+        if key is None:
+            return []
+        with _reading() as (conn, cursor):
+            cursor.execute('''
+                SELECT seq, row_num, col_num FROM opened_cells WHERE session_key = %s AND round_num = %s ORDER BY seq
+            ''', (key, round_num))
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def revert(self, session_id: str, round_num: int, steps: int) -> List[Tuple[int, int, int]]:
+        key = _session_key(session_id)
+        if key is None:
+            return []
+        with _transaction() as cursor:
+            # Index seek on (session_key, round_num, seq DESC): the true last actions, newest first
+            cursor.execute('''
+                SELECT id, row_num, col_num FROM opened_cells
+                WHERE session_key = %s AND round_num = %s
+                ORDER BY seq DESC
+                LIMIT %s
+                FOR UPDATE
+            ''', (key, round_num, steps))
+            last_cells = [tuple(cell) for cell in cursor.fetchall()]
+
+            if last_cells:
+                # One DELETE for all the cells (executemany would send one per row)
+                cursor.execute(f'DELETE FROM opened_cells WHERE id IN ({", ".join(["%s"] * len(last_cells))})',
+                               [cell[0] for cell in last_cells])
+                _clear_cell_bits(cursor, key, round_num,
+                                 [index for index in (cell_index(cell[1], cell[2]) for cell in last_cells)
+                                  if index is not None])
+                _log_cells(cursor, key, [(False, round_num, row, col, None) for _, row, col in last_cells],
+                           _next_seq(cursor, key, len(last_cells)))
+            return last_cells
+
+    def replace(self, session_id: str, round_num: int, submitted: Dict[int, Any]) -> Tuple[List[int], List[int]]:
+        key = _session_key(session_id, create=True)
+        with _transaction() as cursor:
+            # Lock the bitmap row, so the diff and its writes are one transaction
+            cursor.execute('''
+                SELECT bits_lo, bits_hi FROM opened_bitmaps WHERE session_key = %s AND round_num = %s FOR UPDATE
+            ''', (key, round_num))
+            bitmap = cursor.fetchone()
+            stored = set(bitmap_cells(*bitmap)) if bitmap else set()
+
+            to_open = [index for index in submitted if index not in stored]
+            to_close = sorted(stored.difference(submitted))
+
+            if to_close:
+                # One DELETE for all the closed cells (executemany would send one per row)
+                cursor.execute(f'''
+                    DELETE FROM opened_cells WHERE session_key = %s AND round_num = %s
+                    AND (row_num, col_num) IN ({", ".join(["(%s, %s)"] * len(to_close))})
+                ''', (key, round_num) + sum((divmod(index, COLS) for index in to_close), ()))
+
+            if to_open or to_close:
+                # Closed cells take the first numbers, opened cells the rest (also their opening order)
+                last_seq = _next_seq(cursor, key, len(to_close) + len(to_open))
+                if to_open:
+                    cursor.executemany('''
+                        INSERT IGNORE INTO opened_cells (session_key, round_num, row_num, col_num, cell_value, seq)
+                        VALUES (%s, %s, %s, %s, %s, %s)
+                    ''', [(key, round_num) + divmod(index, COLS) + (submitted[index], seq)
+                          for seq, index in enumerate(to_open, last_seq - len(to_open) + 1)])
+                _log_cells(cursor, key,
+                           [(False, round_num) + divmod(index, COLS) + (None,) for index in to_close] +
+                           [(True, round_num) + divmod(index, COLS) + (submitted[index],) for index in to_open],
+                           last_seq)
+
+            if to_open or to_close or bitmap is None:
+                cursor.execute('''
+                    INSERT INTO opened_bitmaps (session_key, round_num, bits_lo, bits_hi) VALUES (%s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE bits_lo = VALUES(bits_lo), bits_hi = VALUES(bits_hi)
+                ''', (key, round_num) + cells_bitmap(submitted))
+            return to_open, to_close
+
+    def clear(self, session_id: str, round_num: int) -> None:
+        key = _session_key(session_id)
+        if key is None:
+            return
+        with _transaction() as cursor:
+            # Delete all opened cells for this session and round
+            cursor.execute('DELETE FROM opened_cells WHERE session_key = %s AND round_num = %s', (key, round_num))
+            cursor.execute('DELETE FROM opened_bitmaps WHERE session_key = %s AND round_num = %s', (key, round_num))
+
+            # Reset the question shuffle bag so the new game starts from a fresh permutation
+            cursor.execute('DELETE FROM question_bags WHERE session_key = %s AND round_num = %s', (key, round_num))
+
+            # A new game starts a new undo/redo history
+            cursor.execute('DELETE FROM undo_log WHERE session_key = %s', (key,))
+            cursor.execute('DELETE FROM undo_cursors WHERE session_key = %s', (key,))
+
+            # Clients that have not seen the reset resync from a snapshot
+            _mark_change(cursor, key, 'reset_seq')
+
+    def history(self, session_id: str) -> Dict[str, bool]:
+        key = _session_key(session_id)
+        if key is None:
+            return history_flags(0, 0)
+        with _reading() as (conn, cursor):
+            return history_flags(*_history_cursor(cursor, key))
+
+    def _step(self, session_id: str, direction: int):
+        """Move the undo cursor by one step back (-1) or forward (+1) and apply the entry"""
+        key = _session_key(session_id)
+        if key is None:
+            return None, history_flags(0, 0)
+        with _transaction() as cursor:
+            # One locking read of the cursor together with the entry it points at;
+            # the lock serializes concurrent undos of the same session
+            cursor.execute('''
+                SELECT c.position, c.head, l.round_num, l.row_num, l.col_num, l.cell_value
+                FROM undo_cursors c
+                LEFT JOIN undo_log l ON l.session_key = c.session_key AND l.position = c.position + %s
+                WHERE c.session_key = %s FOR UPDATE
+            ''', (0 if direction < 0 else 1, key))
+            row = cursor.fetchone()
+            position, head = (row[0], row[1]) if row else (0, 0)
+            if not history_flags(position, head)['can_undo' if direction < 0 else 'can_redo']:
+                return None, history_flags(position, head)
+
+            cursor.execute('UPDATE undo_cursors SET position = position + %s WHERE session_key = %s',
+                           (direction, key))
+            changed_cells = []
+            if row[2] is not None:
+                round_num, row_num, col_num, cell_value = row[2:]
+                if direction < 0:
+                    _close_cell(cursor, key, round_num, row_num, col_num)
+                else:
+                    _open_cell(cursor, key, round_num, row_num, col_num, cell_value)
+                changed_cells.append({'round_num': round_num, 'row': row_num, 'col': col_num, 'value': cell_value,
+                                      'is_revealed': direction > 0})
+            return changed_cells, history_flags(position + direction, head)
+
+    def undo(self, session_id: str):
+        return self._step(session_id, -1)
+
+    def redo(self, session_id: str):
+        return self._step(session_id, +1)
+
+
+class MySQLStorage(Storage):
+    """MySQL (InnoDB) through the db_config connection pool."""
+
+    name = 'mysql'
+
+    def __init__(self):
+        self.questions = MySQLQuestions()
+        self.game_states = MySQLGameStates()
+        self.players = MySQLPlayers()
+        self.bags = MySQLBags()
+        self.cells = MySQLCells()
+
+    def init_schema(self) -> None:
+        from models import init_database
+        try:
+            # Initialize the SQLAlchemy models (moving text-keyed tables onto session keys)
+            init_database()
+            with _transaction() as cursor:
+                _migrate_schema(cursor)
+            with _transaction() as cursor:
+                _seed_questions(cursor)
+        except StorageError:
+            raise
+        except Exception as e:
+            raise StorageError(f'Database initialization error: {e}') from e
+        logger.info("Database initialized successfully")
+
+    def snapshot(self, session_id: str, round_num: int, board_state=None) -> Dict[str, Any]:
+        key = _session_key(session_id)
+        if key is None:
+            return {'game_state': None, 'players': [], 'opened_cells': [], 'history': history_flags(0, 0), 'seq': 0}
+        with _reading() as (conn, cursor):
+            # One read-only transaction, so all sections come from the same snapshot
+            conn.start_transaction(consistent_snapshot=True, readonly=True)
+
+            cursor.execute('SELECT last_seq FROM session_sequences WHERE session_key = %s', (key,))
+            seq = cursor.fetchone()
+
+            cursor.execute(f'SELECT {", ".join(GAME_STATE_COLUMNS)} FROM game_states WHERE session_key = %s', (key,))
+            game_state = cursor.fetchone()
+
+            cursor.execute('SELECT player_name, score FROM players WHERE session_key = %s ORDER BY position', (key,))
+            players = [{'player_name': row[0], 'score': row[1]} for row in cursor.fetchall()]
+
+            opened_cells = _load_opened_cells(cursor, key, round_num, board_state)
+            history = history_flags(*_history_cursor(cursor, key))
+
+            conn.commit()
+
+        return {
+            'game_state': dict(zip(GAME_STATE_COLUMNS, game_state)) if game_state else None,
+            'players': players,
+            'opened_cells': opened_cells,
+            'history': history,
+            'seq': seq[0] if seq else 0
+        }
+
+    def changes(self, session_id: str, since: int) -> Optional[Dict[str, Any]]:
+        key = _session_key(session_id)
+        if key is None:
+            return None
+        with _reading() as (conn, cursor):
+            # The counters, the log and the players from one snapshot
+            conn.start_transaction(consistent_snapshot=True, readonly=True)
+            try:
+                cursor.execute('''
+                    SELECT last_seq, players_seq, reset_seq, state_seq, log_start FROM session_sequences
+                    WHERE session_key = %s
+                ''', (key,))
+                last_seq, players_seq, reset_seq, state_seq, log_start = cursor.fetchone() or (0, 0, 0, 0, 0)
+                if not changes_reachable(since, last_seq, reset_seq, state_seq, log_start):
+                    return None
+                cursor.execute('''
+                    SELECT opened, round_num, row_num, col_num, cell_value FROM session_changes
+                    WHERE session_key = %s AND seq > %s ORDER BY seq
+                ''', (key, since))
+                cell_changes = cursor.fetchall()
+                players = None
+                if players_seq > since:
+                    cursor.execute('SELECT player_name, score FROM players WHERE session_key = %s ORDER BY position',
+                                   (key,))
+                    players = [{'player_name': row[0], 'score': row[1]} for row in cursor.fetchall()]
+            finally:
+                conn.commit()
+        return collect_changes(last_seq, cell_changes, players)
+
+    def touch_sessions(self, session_ids: Iterable[str], seen_at: int) -> None:
+        session_ids = list(session_ids)
+        if not session_ids:
+            return
+        with _statement() as cursor:
+            placeholders = ', '.join(['%s'] * len(session_ids))
+            cursor.execute(f'UPDATE sessions SET last_seen = %s WHERE session_id IN ({placeholders})',
+                           [seen_at] + session_ids)
+
+    def idle_sessions(self, seen_before: int, limit: int) -> List[str]:
+        with _reading() as (conn, cursor):
+            cursor.execute('SELECT session_id FROM sessions WHERE last_seen < %s ORDER BY last_seen LIMIT %s',
+                           (seen_before, limit))
+            return [row[0] for row in cursor.fetchall()]
+
+    def session_rows(self, session_ids: Iterable[str]) -> int:
+        session_ids = list(session_ids)
+        if not session_ids:
+            return 0
+        placeholders = ', '.join(['%s'] * len(session_ids))
+        with _reading() as (conn, cursor):
+            cursor.execute(f'''
+                WITH doomed (id) AS (SELECT id FROM sessions WHERE session_id IN ({placeholders}))
+                SELECT (SELECT COUNT(*) FROM doomed) + {' + '.join(
+                    f'(SELECT COUNT(*) FROM {table} WHERE session_key IN (SELECT id FROM doomed))'
+                    for table in SESSION_TABLES)}
+            ''', session_ids)
+            return int(cursor.fetchone()[0])
+
+    def delete_sessions(self, session_ids: Iterable[str]) -> int:
+        session_ids = list(session_ids)
+        session_keys.forget(session_ids)
+        if not session_ids:
+            return 0
+        with _statement() as cursor:
+            # One statement; InnoDB deletes the session tables' rows through ON DELETE CASCADE
+            cursor.execute(f'DELETE FROM sessions WHERE session_id IN ({", ".join(["%s"] * len(session_ids))})',
+                           session_ids)
+            return cursor.rowcount
+
+    def vacuum(self) -> Dict[str, Any]:
+        tables = ('sessions',) + SESSION_TABLES
+        with _reading() as (conn, cursor):
+            # Rebuilds the InnoDB tables, returning the pages of deleted rows to the tablespace
+            cursor.execute(f'OPTIMIZE TABLE {", ".join(tables)}')
+            cursor.fetchall()
+        return {'optimized': list(tables)}
+
+    def release(self) -> None:
+        # Keys are looked up again by the next request
+        session_keys.clear()
+
+    def ping(self) -> bool:
+        return test_connection()
+
+    def stats(self) -> Dict[str, Any]:
+        return {'pool': pool_stats(), 'round_trips': round_trips.count}
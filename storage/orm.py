@@ -0,0 +1,649 @@
+"""
+SQLAlchemy ORM storage backend.
+
+Runs on the models of models.py against any database SQLAlchemy supports
+(MySQL through PyMySQL by default, SQLite for tests). The engine is the
+process-wide one of models.get_engine(); sessions come from a scoped
+registry, one per thread, discarded by release() at the end of every
+request together with the integer session keys the request looked up.
+Single-row changes go through the unit of work with row locks; multi-row
+writes (seeding questions, replacing opened cells) are bulk
+INSERT/UPDATE/DELETE statements.
+"""
+
+import logging
+import os
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select, tuple_, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+
+from board import cell_index, cell_bit, cells_bitmap, bitmap_cells
+from config import COLS, HISTORY_LIMIT
+from models import (Question, GameSession, GameState, OpenedCell, SessionSequence, SessionChange, OpenedBitmap, Player,
+                    QuestionBag, UndoLogEntry, UndoCursor, Metadata, get_database_url, get_engine, init_database,
+                    pool_stats, question_text_hash, session_tables)
+from question_bank import pack_bag, bag_item
+from storage.base import (Storage, StorageError, QuestionRepository, GameStateRepository, PlayerRepository,
+                          BagRepository, CellRepository, GAME_STATE_COLUMNS, VERSIONED_STATE_COLUMNS, history_flags,
+                          CellChange, SessionKeys, opened_cells_from_bitmap, questions_hash, changes_reachable,
+                          change_log_cutoff, collect_changes)
+
+logger = logging.getLogger(__name__)
+
+
+# --- operations inside a session transaction -------------------------------------
+
+def _insert_sessions():
+    """INSERT of sessions rows that skips the ones created concurrently"""
+    return insert(GameSession).prefix_with('IGNORE', dialect='mysql').prefix_with('OR IGNORE', dialect='sqlite')
+
+
+def _next_seq(session: Session, key: int, count: int = 1) -> int:
+    """Allocate count numbers from the session's monotonic counter and return the last one"""
+    sequence = session.get(SessionSequence, key, with_for_update=True)
+    if sequence is None:
+        sequence = SessionSequence(session_key=key, last_seq=0)
+        session.add(sequence)
+    sequence.last_seq += count
+    return sequence.last_seq
+
+
+def _log_cells(session: Session, key: int, changes: List[CellChange], last_seq: int) -> None:
+    """Write cell changes to the change log under the numbers ending at last_seq, pruning it when too long"""
+    session.execute(insert(SessionChange), [
+        {'session_key': key, 'seq': seq, 'opened': opened, 'round_num': round_num, 'row_num': row, 'col_num': col,
+         'cell_value': value}
+        for seq, (opened, round_num, row, col, value) in enumerate(changes, last_seq - len(changes) + 1)])
+    # Locked and loaded by _next_seq
+    sequence = session.get(SessionSequence, key)
+    cutoff = change_log_cutoff(last_seq, sequence.log_start or 0)
+    if cutoff is not None:
+        session.execute(delete(SessionChange).where(SessionChange.session_key == key, SessionChange.seq <= cutoff))
+        sequence.log_start = cutoff
+
+
+def _mark_change(session: Session, key: int, attribute: str) -> None:
+    """Give a change kept without a log entry (players, board reset, game state) the session's next number"""
+    seq = _next_seq(session, key)
+    setattr(session.get(SessionSequence, key), attribute, seq)
+
+
+def _bitmap(session: Session, key: int, round_num: int, create: bool = False) -> Optional[OpenedBitmap]:
+    """The session round's bitmap row, locked for the transaction"""
+    bitmap = session.get(OpenedBitmap, (key, round_num), with_for_update=True)
+    if bitmap is None and create:
+        bitmap = OpenedBitmap(session_key=key, round_num=round_num, bits_lo=0, bits_hi=0)
+        session.add(bitmap)
+    return bitmap
+
+
+def _open_cell(session: Session, key: int, round_num: int, row: int, col: int, cell_value) -> bool:
+    """Set the cell's bit and add its audit row; False if the cell was already opened"""
+    bit_lo, bit_hi = cell_bit(cell_index(row, col))
+    bitmap = _bitmap(session, key, round_num, create=True)
+    if bitmap.bits_lo & bit_lo or bitmap.bits_hi & bit_hi:
+        return False
+    bitmap.bits_lo |= bit_lo
+    bitmap.bits_hi |= bit_hi
+    seq = _next_seq(session, key)
+    session.add(OpenedCell(session_key=key, round_num=round_num, row_num=row, col_num=col,
+                           cell_value=cell_value, seq=seq))
+    _log_cells(session, key, [(True, round_num, row, col, cell_value)], seq)
+    return True
+
+
+def _close_cells(session: Session, key: int, round_num: int, cells: List[Tuple[int, int]]) -> None:
+    """Delete the cells' audit rows and clear their bits"""
+    if not cells:
+        return
+    session.execute(delete(OpenedCell).where(
+        OpenedCell.session_key == key, OpenedCell.round_num == round_num,
+        tuple_(OpenedCell.row_num, OpenedCell.col_num).in_(cells)))
+    bitmap = _bitmap(session, key, round_num)
+    if bitmap is not None:
+        bits_lo, bits_hi = cells_bitmap([cell_index(row, col) for row, col in cells])
+        bitmap.bits_lo &= ~bits_lo
+        bitmap.bits_hi &= ~bits_hi
+    _log_cells(session, key, [(False, round_num, row, col, None) for row, col in cells],
+               _next_seq(session, key, len(cells)))
+
+
+def _undo_cursor(session: Session, key: int, lock: bool = False) -> Optional[UndoCursor]:
+    return session.get(UndoCursor, key, with_for_update=lock)
+
+
+def _history(cursor: Optional[UndoCursor]) -> Tuple[int, int]:
+    return (cursor.position, cursor.head) if cursor else (0, 0)
+
+
+def _record_history(session: Session, key: int, round_num: int, row: int, col: int, cell_value):
+    """Append a cell opening to the undo log, dropping the redo branch and steps older than HISTORY_LIMIT"""
+    cursor = _undo_cursor(session, key, lock=True)
+    if cursor is None:
+        cursor = UndoCursor(session_key=key, position=0, head=0)
+        session.add(cursor)
+    position = cursor.position + 1
+    cursor.position = cursor.head = position
+
+    session.execute(delete(UndoLogEntry).where(
+        UndoLogEntry.session_key == key,
+        (UndoLogEntry.position >= position) | (UndoLogEntry.position <= position - HISTORY_LIMIT)))
+    session.add(UndoLogEntry(session_key=key, position=position, round_num=round_num, row_num=row,
+                             col_num=col, cell_value=cell_value))
+    return history_flags(position, position)
+
+
+def _load_opened_cells(session: Session, key: int, round_num: int, board_state=None) -> list:
+    """Read the round's opened cells from the bitmap and the board layout"""
+    # One small row: the bitmap plus the board layout to decode cell values
+    bitmap = session.execute(
+        select(OpenedBitmap.bits_lo, OpenedBitmap.bits_hi, GameState.board_state)
+        .outerjoin(GameState, GameState.session_key == OpenedBitmap.session_key)
+        .where(OpenedBitmap.session_key == key, OpenedBitmap.round_num == round_num)).first()
+    if not bitmap:
+        return []
+
+    def audit_values():
+        # No saved layout - fall back to the values recorded in the audit log
+        rows = session.execute(select(OpenedCell.row_num, OpenedCell.col_num, OpenedCell.cell_value).where(
+            OpenedCell.session_key == key, OpenedCell.round_num == round_num))
+        return {(row[0], row[1]): row[2] for row in rows}
+
+    return opened_cells_from_bitmap(bitmap[0], bitmap[1], bitmap[2] if board_state is None else board_state,
+                                    audit_values)
+
+
+# --- repositories -------------------------------------------------------------
+
+class _Repository:
+    def __init__(self, storage: 'ORMStorage'):
+        self.storage = storage
+        self.transaction = storage.transaction
+        self.key = storage.session_key
+
+
+class ORMQuestions(_Repository, QuestionRepository):
+    def all(self) -> List[tuple]:
+        with self.transaction() as session:
+            return [tuple(row) for row in session.execute(select(
+                Question.id, Question.round_num, Question.question_text, Question.answer, Question.theme))]
+
+    def version(self) -> tuple:
+        # Same stamp as the MySQL backend: row count, last id and last change time
+        with self.transaction() as session:
+            return tuple(session.execute(select(
+                func.count(), func.max(Question.id), func.max(Question.updated_at))).one())
+
+
+class ORMGameStates(_Repository, GameStateRepository):
+    def get(self, session_id: str, columns: Iterable[str] = GAME_STATE_COLUMNS) -> Optional[Dict[str, Any]]:
+        columns = tuple(columns)
+        with self.transaction() as session:
+            key = self.key(session, session_id)
+            if key is None:
+                return None
+            row = session.execute(select(*(getattr(GameState, column) for column in columns))
+                                  .where(GameState.session_key == key)).first()
+            return dict(zip(columns, row)) if row else None
+
+    def create(self, session_id: str, values: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self.transaction() as session:
+            key = self.key(session, session_id, create=True)
+            state = session.scalar(select(GameState).where(GameState.session_key == key).with_for_update())
+            if state is not None:
+                return {column: getattr(state, column) for column in VERSIONED_STATE_COLUMNS}
+            session.add(GameState(session_key=key, **values))
+            _mark_change(session, key, 'state_seq')
+            return None
+
+    def save(self, session_id: str, values: Dict[str, Any], version: int) -> Tuple[bool, int]:
+        with self.transaction() as session:
+            key = self.key(session, session_id, create=not version)
+            if key is None:
+                return False, 0
+            # Compare-and-set in the UPDATE itself: no lock is held between the client's read and this write
+            saved = session.execute(update(GameState)
+                                    .where(GameState.session_key == key, GameState.version == version)
+                                    .values(**values, version=GameState.version + 1)
+                                    .execution_options(synchronize_session=False))
+            if saved.rowcount:
+                _mark_change(session, key, 'state_seq')
+                return True, version + 1
+            current = session.scalar(select(GameState.version).where(GameState.session_key == key))
+            if current is None and not version:
+                session.add(GameState(session_key=key, **values, version=1))
+                _mark_change(session, key, 'state_seq')
+                return True, 1
+            return False, current or 0
+
+    def upsert_many(self, states: Dict[str, Dict[str, Any]]) -> None:
+        with self.transaction() as session:
+            # Flushed off the request threads: the keys are looked up in bulk, not through the request cache
+            lookup = select(GameSession.session_id, GameSession.id).where(GameSession.session_id.in_(list(states)))
+            keys = dict(session.execute(lookup).all())
+            if len(keys) < len(states):
+                session.execute(_insert_sessions(), [{'session_id': session_id} for session_id in states
+                                                     if session_id not in keys])
+                keys = dict(session.execute(lookup).all())
+            # Locked rows: the versions read here are the ones the writes bump
+            existing = {key: (id_, version) for key, id_, version in session.execute(
+                select(GameState.session_key, GameState.id, GameState.version).where(
+                    GameState.session_key.in_(list(keys.values()))).with_for_update())}
+            # Bulk UPDATE by primary key for known sessions, one bulk INSERT for the new ones
+            updates: Dict[tuple, list] = {}
+            for session_id, values in states.items():
+                if keys[session_id] in existing:
+                    id_, version = existing[keys[session_id]]
+                    updates.setdefault(tuple(sorted(values)), []).append(
+                        {'id': id_, **values, 'version': (version or 0) + 1})
+            for rows in updates.values():
+                session.execute(update(GameState), rows)
+            new_rows = [{'session_key': keys[session_id], **values, 'version': 1}
+                        for session_id, values in states.items() if keys[session_id] not in existing]
+            if new_rows:
+                for rows in _group_by_columns(new_rows):
+                    session.execute(insert(GameState), rows)
+            # Other screens reload the board and state of these sessions
+            for session_id in states:
+                _mark_change(session, keys[session_id], 'state_seq')
+
+
+def _group_by_columns(rows: List[dict]) -> List[List[dict]]:
+    """Split rows into groups with the same keys (one executemany batch each)"""
+    groups: Dict[tuple, list] = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    return list(groups.values())
+
+
+class ORMPlayers(_Repository, PlayerRepository):
+    def list(self, session_id: str) -> List[Dict[str, Any]]:
+        with self.transaction() as session:
+            key = self.key(session, session_id)
+            if key is None:
+                return []
+            rows = session.execute(select(Player.player_name, Player.score)
+                                   .where(Player.session_key == key).order_by(Player.position))
+            return [{'player_name': row[0], 'score': row[1]} for row in rows]
+
+    def add(self, session_id: str, player_name: str) -> None:
+        with self.transaction() as session:
+            key = self.key(session, session_id, create=True)
+            # The position is computed by the insert itself
+            position = (select(func.coalesce(func.max(Player.position), 0) + 1)
+                        .where(Player.session_key == key).scalar_subquery())
+            session.execute(insert(Player).values(session_key=key, player_name=player_name, score=0,
+                                                  position=position))
+            _mark_change(session, key, 'players_seq')
+
+    def update(self, session_id: str, player_name: str, score: int, new_player_name: str) -> None:
+        with self.transaction() as session:
+            key = self.key(session, session_id)
+            if key is None:
+                return
+            updated = session.execute(update(Player).where(Player.session_key == key,
+                                                           Player.player_name == player_name)
+                                      .values(score=score, player_name=new_player_name))
+            if updated.rowcount:
+                _mark_change(session, key, 'players_seq')
+
+    def remove(self, session_id: str, player_name: str) -> None:
+        with self.transaction() as session:
+            key = self.key(session, session_id)
+            if key is None:
+                return
+            session.execute(delete(Player).where(Player.session_key == key, Player.player_name == player_name))
+
+            # Reorder positions after deletion with one bulk UPDATE of the players that move
+            players = session.execute(select(Player.id, Player.position).where(Player.session_key == key)
+                                      .order_by(Player.position, Player.id)).all()
+            moved = [{'id': player_id, 'position': new_position}
+                     for new_position, (player_id, position) in enumerate(players, 1) if position != new_position]
+            if moved:
+                session.execute(update(Player), moved)
+            _mark_change(session, key, 'players_seq')
+
+    def reset(self, session_id: str, player_names: List[str]) -> None:
+        with self.transaction() as session:
+            key = self.key(session, session_id, create=True)
+            session.execute(delete(Player).where(Player.session_key == key))
+            if player_names:
+                session.execute(insert(Player), [
+                    {'session_key': key, 'player_name': name, 'score': 0, 'position': position}
+                    for position, name in enumerate(player_names, 1)])
+            _mark_change(session, key, 'players_seq')
+
+
+class ORMBags(_Repository, BagRepository):
+    def draw(self, session_id: str, round_num: int, shuffle: Callable[[], List[int]]) -> Optional[Tuple[int, int]]:
+        with self.transaction() as session:
+            key = self.key(session, session_id, create=True)
+            bag = session.get(QuestionBag, (key, round_num), with_for_update=True)
+            if bag and bag.position < bag.size:
+                bag.position += 1
+                return bag_item(bag.question_order, bag.position - 1), bag.size - bag.position
+
+            # No bag yet or it is exhausted - start a new permutation
+            question_ids = shuffle()
+            if not question_ids:
+                return None
+            # A round change resets the bags of the session's other rounds
+            session.execute(delete(QuestionBag).where(QuestionBag.session_key == key,
+                                                      QuestionBag.round_num != round_num))
+            if bag is None:
+                bag = QuestionBag(session_key=key, round_num=round_num)
+                session.add(bag)
+            bag.question_order, bag.position, bag.size = pack_bag(question_ids), 1, len(question_ids)
+            return question_ids[0], len(question_ids) - 1
+
+    def reset(self, session_id: str, round_num: int) -> None:
+        with self.transaction() as session:
+            key = self.key(session, session_id)
+            if key is not None:
+                session.execute(delete(QuestionBag).where(QuestionBag.session_key == key,
+                                                          QuestionBag.round_num == round_num))
+
+
+class ORMCells(_Repository, CellRepository):
+    def open(self, session_id: str, round_num: int, row: int, col: int, cell_value) -> Optional[Dict[str, bool]]:
+        with self.transaction() as session:
+            key = self.key(session, session_id, create=True)
+            if not _open_cell(session, key, round_num, row, col, cell_value):
+                return None
+            return _record_history(session, key, round_num, row, col, cell_value)
+
+    def load(self, session_id: str, round_num: int, board_state=None) -> List[dict]:
+        with self.transaction() as session:
+            key = self.key(session, session_id)
+            return [] if key is None else _load_opened_cells(session, key, round_num, board_state)
+
+    def opening_order(self, session_id: str, round_num: int) -> List[Tuple[int, int, int]]:
+        with self.transaction() as session:
+            key = self.key(session, session_id)
+            if key is None:
+                return []
+            return [tuple(row) for row in session.execute(
+                select(OpenedCell.seq, OpenedCell.row_num, OpenedCell.col_num)
+                .where(OpenedCell.session_key == key, OpenedCell.round_num == round_num)
+                .order_by(OpenedCell.seq))]
+
+    def revert(self, session_id: str, round_num: int, steps: int) -> List[Tuple[int, int, int]]:
+        with self.transaction() as session:
+            key = self.key(session, session_id)
+            if key is None:
+                return []
+            # Index seek on (session_key, round_num, seq DESC): the true last actions, newest first
+            last_cells = [tuple(cell) for cell in session.execute(
+                select(OpenedCell.id, OpenedCell.row_num, OpenedCell.col_num)
+                .where(OpenedCell.session_key == key, OpenedCell.round_num == round_num)
+                .order_by(OpenedCell.seq.desc()).limit(steps).with_for_update())]
+            _close_cells(session, key, round_num, [(row, col) for _, row, col in last_cells])
+            return last_cells
+
+    def replace(self, session_id: str, round_num: int, submitted: Dict[int, Any]) -> Tuple[List[int], List[int]]:
+        with self.transaction() as session:
+            key = self.key(session, session_id, create=True)
+            # Lock the bitmap row, so the diff and its writes are one transaction
+            bitmap = _bitmap(session, key, round_num, create=True)
+            stored = set(bitmap_cells(bitmap.bits_lo, bitmap.bits_hi))
+
+            to_open = [index for index in submitted if index not in stored]
+            to_close = sorted(stored.difference(submitted))
+
+            if to_close:
+                session.execute(delete(OpenedCell).where(
+                    OpenedCell.session_key == key, OpenedCell.round_num == round_num,
+                    tuple_(OpenedCell.row_num, OpenedCell.col_num).in_([divmod(index, COLS) for index in to_close])))
+
+            if to_open or to_close:
+                # Closed cells take the first numbers, opened cells the rest (also their opening order)
+                last_seq = _next_seq(session, key, len(to_close) + len(to_open))
+                if to_open:
+                    # One bulk INSERT of the new audit rows with consecutive sequence numbers
+                    session.execute(insert(OpenedCell), [
+                        {'session_key': key, 'round_num': round_num, 'row_num': index // COLS,
+                         'col_num': index % COLS, 'cell_value': submitted[index], 'seq': seq}
+                        for seq, index in enumerate(to_open, last_seq - len(to_open) + 1)])
+                _log_cells(session, key,
+                           [(False, round_num) + divmod(index, COLS) + (None,) for index in to_close] +
+                           [(True, round_num) + divmod(index, COLS) + (submitted[index],) for index in to_open],
+                           last_seq)
+
+            bitmap.bits_lo, bitmap.bits_hi = cells_bitmap(submitted)
+            return to_open, to_close
+
+    def clear(self, session_id: str, round_num: int) -> None:
+        with self.transaction() as session:
+            key = self.key(session, session_id)
+            if key is None:
+                return
+            # Opened cells, the round's question bag and the undo/redo history start over
+            for model in (OpenedCell, OpenedBitmap, QuestionBag):
+                session.execute(delete(model).where(model.session_key == key, model.round_num == round_num))
+            for model in (UndoLogEntry, UndoCursor):
+                session.execute(delete(model).where(model.session_key == key))
+            # Clients that have not seen the reset resync from a snapshot
+            _mark_change(session, key, 'reset_seq')
+
+    def history(self, session_id: str) -> Dict[str, bool]:
+        with self.transaction() as session:
+            key = self.key(session, session_id)
+            return history_flags(*_history(None if key is None else _undo_cursor(session, key)))
+
+    def _step(self, session_id: str, direction: int):
+        """Move the undo cursor by one step back (-1) or forward (+1) and apply the entry"""
+        with self.transaction() as session:
+            key = self.key(session, session_id)
+            # Locking the cursor row serializes concurrent undos of the same session
+            cursor = None if key is None else _undo_cursor(session, key, lock=True)
+            position, head = _history(cursor)
+            if not history_flags(position, head)['can_undo' if direction < 0 else 'can_redo']:
+                return None, history_flags(position, head)
+
+            entry = session.get(UndoLogEntry, (key, position if direction < 0 else position + 1))
+            cursor.position += direction
+            changed_cells = []
+            if entry:
+                if direction < 0:
+                    _close_cells(session, key, entry.round_num, [(entry.row_num, entry.col_num)])
+                else:
+                    _open_cell(session, key, entry.round_num, entry.row_num, entry.col_num, entry.cell_value)
+                changed_cells.append({'round_num': entry.round_num, 'row': entry.row_num, 'col': entry.col_num,
+                                      'value': entry.cell_value, 'is_revealed': direction > 0})
+            return changed_cells, history_flags(cursor.position, head)
+
+    def undo(self, session_id: str):
+        return self._step(session_id, -1)
+
+    def redo(self, session_id: str):
+        return self._step(session_id, +1)
+
+
+class ORMStorage(Storage):
+    """SQLAlchemy models on the shared engine of the database URL."""
+
+    name = 'orm'
+
+    def __init__(self, url: Optional[str] = None):
+        self.engine = get_engine(url or os.getenv('LALA_ORM_URL') or get_database_url())
+        # One session per thread; release() discards it when the request ends
+        self.sessions = scoped_session(sessionmaker(bind=self.engine, expire_on_commit=False))
+        # Integer keys of the sessions met by the current request
+        self.session_keys = SessionKeys()
+        self.questions = ORMQuestions(self)
+        self.game_states = ORMGameStates(self)
+        self.players = ORMPlayers(self)
+        self.bags = ORMBags(self)
+        self.cells = ORMCells(self)
+
+    @contextmanager
+    def transaction(self):
+        """The thread's session inside a transaction (committed on exit, rolled back on error)."""
+        session = self.sessions()
+        try:
+            yield session
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            # A session created by the rolled back transaction must not stay cached
+            self.session_keys.clear()
+            raise StorageError(str(e)) from e
+        except BaseException:
+            session.rollback()
+            self.session_keys.clear()
+            raise
+
+    def session_key(self, session: Session, session_id: str, create: bool = False) -> Optional[int]:
+        """
+        Integer key of the session, looked up once per request; None for an unknown
+        session unless create is set, which inserts it (a concurrent insert is ignored).
+        """
+        key = self.session_keys.get(session_id)
+        if key is None:
+            lookup = select(GameSession.id).where(GameSession.session_id == session_id)
+            key = session.scalar(lookup)
+            if key is None:
+                if not create:
+                    return None
+                session.execute(_insert_sessions().values(session_id=session_id))
+                key = session.scalar(lookup)
+            self.session_keys.put(session_id, key)
+        return key
+
+    def init_schema(self) -> None:
+        from config import get_questions
+        try:
+            init_database(self.engine)
+        except SQLAlchemyError as e:
+            raise StorageError(f'Database initialization error: {e}') from e
+
+        questions = get_questions()
+        digest = questions_hash(questions)
+        with self.transaction() as session:
+            stamp = session.get(Metadata, 'questions_hash', with_for_update=True)
+            if stamp is not None and stamp.value == digest:
+                return
+            # Bulk upsert keyed by (round_num, question_text): ids of known questions are kept
+            existing = {(row.round_num, row.question_text): row for row in session.execute(
+                select(Question.id, Question.round_num, Question.question_text, Question.answer, Question.theme))}
+            new_rows, changed_rows = [], []
+            for round_num, text, answer, theme in questions:
+                row = existing.get((round_num, text))
+                if row is None:
+                    new_rows.append({'round_num': round_num, 'question_text': text, 'answer': answer, 'theme': theme,
+                                     'question_hash': question_text_hash(round_num, text)})
+                elif (row.answer, row.theme) != (answer, theme):
+                    changed_rows.append({'id': row.id, 'answer': answer, 'theme': theme})
+            if new_rows:
+                session.execute(insert(Question), new_rows)
+            if changed_rows:
+                session.execute(update(Question), changed_rows)
+            if stamp is None:
+                session.add(Metadata(key='questions_hash', value=digest))
+            else:
+                stamp.value = digest
+            logger.info(f"Questions seeded: {len(new_rows)} added, {len(changed_rows)} updated")
+
+    def snapshot(self, session_id: str, round_num: int, board_state=None) -> Dict[str, Any]:
+        # One transaction, so all sections come from the same snapshot
+        with self.transaction() as session:
+            key = self.session_key(session, session_id)
+            if key is None:
+                return {'game_state': None, 'players': [], 'opened_cells': [], 'history': history_flags(0, 0),
+                        'seq': 0}
+            game_state = session.execute(select(*(getattr(GameState, column) for column in GAME_STATE_COLUMNS))
+                                         .where(GameState.session_key == key)).first()
+            players = [{'player_name': row[0], 'score': row[1]} for row in session.execute(
+                select(Player.player_name, Player.score).where(Player.session_key == key)
+                .order_by(Player.position))]
+            return {
+                'game_state': dict(zip(GAME_STATE_COLUMNS, game_state)) if game_state else None,
+                'players': players,
+                'opened_cells': _load_opened_cells(session, key, round_num, board_state),
+                'history': history_flags(*_history(_undo_cursor(session, key))),
+                'seq': session.scalar(select(SessionSequence.last_seq).where(SessionSequence.session_key == key)) or 0
+            }
+
+    def changes(self, session_id: str, since: int) -> Optional[Dict[str, Any]]:
+        with self.transaction() as session:
+            key = self.session_key(session, session_id)
+            if key is None:
+                return None
+            counters = session.execute(select(SessionSequence.last_seq, SessionSequence.players_seq,
+                                              SessionSequence.reset_seq, SessionSequence.state_seq,
+                                              SessionSequence.log_start)
+                                       .where(SessionSequence.session_key == key)).first()
+            last_seq, players_seq, reset_seq, state_seq, log_start = counters or (0, 0, 0, 0, 0)
+            if not changes_reachable(since, last_seq, reset_seq, state_seq, log_start):
+                return None
+            cell_changes = session.execute(
+                select(SessionChange.opened, SessionChange.round_num, SessionChange.row_num, SessionChange.col_num,
+                       SessionChange.cell_value)
+                .where(SessionChange.session_key == key, SessionChange.seq > since).order_by(SessionChange.seq))
+            players = None
+            if players_seq > since:
+                players = [{'player_name': row[0], 'score': row[1]} for row in session.execute(
+                    select(Player.player_name, Player.score).where(Player.session_key == key)
+                    .order_by(Player.position))]
+            return collect_changes(last_seq, cell_changes, players)
+
+    def touch_sessions(self, session_ids: Iterable[str], seen_at: int) -> None:
+        with self.transaction() as session:
+            session.execute(update(GameSession).where(GameSession.session_id.in_(list(session_ids)))
+                            .values(last_seen=seen_at).execution_options(synchronize_session=False))
+
+    def idle_sessions(self, seen_before: int, limit: int) -> List[str]:
+        with self.transaction() as session:
+            return list(session.scalars(select(GameSession.session_id).where(GameSession.last_seen < seen_before)
+                                        .order_by(GameSession.last_seen).limit(limit)))
+
+    def session_rows(self, session_ids: Iterable[str]) -> int:
+        keys = select(GameSession.id).where(GameSession.session_id.in_(list(session_ids)))
+        counts = [select(func.count()).select_from(GameSession).where(GameSession.id.in_(keys)).scalar_subquery()]
+        counts += [select(func.count()).select_from(table).where(table.c.session_key.in_(keys)).scalar_subquery()
+                   for table in session_tables()]
+        with self.transaction() as session:
+            return session.scalar(select(sum(counts[1:], counts[0])))
+
+    def delete_sessions(self, session_ids: Iterable[str]) -> int:
+        session_ids = list(session_ids)
+        self.session_keys.forget(session_ids)
+        with self.transaction() as session:
+            # The session tables follow through ON DELETE CASCADE
+            return session.execute(delete(GameSession).where(GameSession.session_id.in_(session_ids))).rowcount
+
+    def vacuum(self) -> Dict[str, Any]:
+        tables = [GameSession.__tablename__] + [table.name for table in session_tables()]
+        try:
+            with self.engine.connect() as connection:
+                if self.engine.dialect.name == 'mysql':
+                    # Rebuilds the InnoDB tables, returning the pages of deleted rows to the tablespace
+                    connection.exec_driver_sql(f'OPTIMIZE TABLE {", ".join(tables)}').fetchall()
+                    return {'optimized': tables}
+                if self.engine.dialect.name == 'sqlite':
+                    connection.exec_driver_sql('PRAGMA optimize')
+        except SQLAlchemyError as e:
+            raise StorageError(str(e)) from e
+        return {}
+
+    def release(self) -> None:
+        # Ends the request's session and returns its connection to the pool
+        self.sessions.remove()
+        self.session_keys.clear()
+
+    def ping(self) -> bool:
+        try:
+            with self.transaction() as session:
+                return session.scalar(select(1)) == 1
+        except StorageError:
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {'pool': pool_stats(self.engine)}
+
+    def close(self) -> None:
+        self.sessions.remove()
+        self.engine.dispose()
@@ -0,0 +1,1153 @@
+"""
+SQLite storage backend.
+
+Reads use the per-thread WAL connections of SQLiteConnections; every write is
+a WriteQueue operation, so concurrent writes are group-committed by a single
+writer thread. Cell state is one bitmap row per session round, checked and
+updated by conditional upserts. Session tables are keyed by the integer id of
+the session's sessions row, resolved once per request.
+"""
+
+import logging
+import sqlite3
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from board import cell_index, cell_bit, cells_bitmap, bitmap_cells
+from config import COLS, HISTORY_LIMIT
+from question_bank import pack_bag, bag_item
+from sqlite_connections import BUSY_TIMEOUT_MS, SQLiteConnections
+from sqlite_writer import WriteQueue
+from storage.base import (Storage, StorageError, QuestionRepository, GameStateRepository, PlayerRepository,
+                          BagRepository, CellRepository, GAME_STATE_COLUMNS, SESSION_TABLES,
+                          VERSIONED_STATE_COLUMNS, CellChange, history_flags, SessionKeys, opened_cells_from_bitmap,
+                          questions_hash, changes_reachable, change_log_cutoff, collect_changes)
+
+logger = logging.getLogger(__name__)
+
+DATABASE = 'database.db'
+
+
+# --- schema -----------------------------------------------------------------
+
+# Current time in unix seconds (sessions.last_seen)
+_NOW = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+
+def _create_schema(cursor: sqlite3.Cursor) -> None:
+    """
+    Создает таблицы и выполняет миграции баз, созданных старыми версиями
+    """
+    legacy_tables = _detach_text_keyed_tables(cursor)
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            round_num INTEGER,
+            question_text TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            theme TEXT NOT NULL
+        )
+    ''')
+
+    # Внешний session_id хранится один раз, дочерние таблицы ссылаются на целочисленный ключ
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_seen INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))  -- unix seconds
+        )
+    ''')
+    _add_session_activity(cursor)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_last_seen ON sessions (last_seen)')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS game_states (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_key INTEGER UNIQUE NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+            current_round INTEGER DEFAULT 1,
+            current_cell TEXT,
+            score INTEGER DEFAULT 0,
+            revealed_cells TEXT,  -- JSON string of revealed cells
+            board_state TEXT,     -- JSON string of the entire board state
+            cell_questions BLOB,  -- packed question id per cell (row-major)
+            version INTEGER NOT NULL DEFAULT 0,  -- incremented by every versioned save
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    if 'version' not in _columns(cursor, 'game_states'):
+        cursor.execute('ALTER TABLE game_states ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS opened_cells (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_key INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+            round_num INTEGER NOT NULL,
+            row_num INTEGER NOT NULL,
+            col_num INTEGER NOT NULL,
+            cell_value TEXT NOT NULL,
+            seq INTEGER,          -- order of opening within the session round
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_opened_cells_cell
+        ON opened_cells (session_key, round_num, row_num, col_num)
+    ''')
+    # Последнее действие сессии находится поиском по индексу, без сортировки строк
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_opened_cells_last
+        ON opened_cells (session_key, round_num, seq DESC)
+    ''')
+
+    # Монотонный счетчик событий сессии: номера не переиспользуются даже после отмены
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS session_sequences (
+            session_key INTEGER PRIMARY KEY REFERENCES sessions (id) ON DELETE CASCADE,
+            last_seq INTEGER NOT NULL DEFAULT 0,
+            players_seq INTEGER NOT NULL DEFAULT 0,  -- number of the last change of the players
+            reset_seq INTEGER NOT NULL DEFAULT 0,    -- number of the last board reset
+            state_seq INTEGER NOT NULL DEFAULT 0,    -- number of the last saved game state or board layout
+            log_start INTEGER NOT NULL DEFAULT 0     -- session_changes holds every cell change after it
+        )
+    ''')
+    for column in ('players_seq', 'reset_seq', 'state_seq', 'log_start'):
+        if column not in _columns(cursor, 'session_sequences'):
+            cursor.execute(f'ALTER TABLE session_sequences ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0')
+            if column == 'log_start':
+                # Номера, выданные до появления журнала, в нем не записаны
+                cursor.execute('UPDATE session_sequences SET log_start = last_seq')
+
+    # Журнал изменений ячеек для дельта-синхронизации: номер из счетчика сессии,
+    # хранится не меньше CHANGE_LOG_LIMIT последних номеров
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS session_changes (
+            session_key INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+            seq INTEGER NOT NULL,
+            opened INTEGER NOT NULL,  -- 1 the cell was opened, 0 closed
+            round_num INTEGER NOT NULL,
+            row_num INTEGER NOT NULL,
+            col_num INTEGER NOT NULL,
+            cell_value TEXT,
+            PRIMARY KEY (session_key, seq)
+        )
+    ''')
+
+    # Битовая карта открытых ячеек: одна строка на (сессия, раунд)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS opened_bitmaps (
+            session_key INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+            round_num INTEGER NOT NULL,
+            bits_lo INTEGER NOT NULL DEFAULT 0,  -- cells 0..62
+            bits_hi INTEGER NOT NULL DEFAULT 0,  -- cells 63..125
+            PRIMARY KEY (session_key, round_num)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scores (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_key INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+            round_num INTEGER,
+            player_name TEXT,
+            score INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_scores_session ON scores (session_key)')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS players (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_key INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+            player_name TEXT,
+            score INTEGER DEFAULT 0,
+            position INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_players_session ON players (session_key, position)')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS question_bags (
+            session_key INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+            round_num INTEGER NOT NULL,
+            question_order BLOB NOT NULL,  -- packed permutation of question ids
+            position INTEGER NOT NULL DEFAULT 0,
+            size INTEGER NOT NULL,
+            PRIMARY KEY (session_key, round_num)
+        )
+    ''')
+
+    # Журнал отмены: одна строка на действие с ячейкой, позиция курсора делит его на undo и redo
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS undo_log (
+            session_key INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            round_num INTEGER NOT NULL,
+            row_num INTEGER NOT NULL,
+            col_num INTEGER NOT NULL,
+            cell_value TEXT,
+            PRIMARY KEY (session_key, position)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS undo_cursors (
+            session_key INTEGER PRIMARY KEY REFERENCES sessions (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL DEFAULT 0,  -- entries 1..position are applied
+            head INTEGER NOT NULL DEFAULT 0       -- entries position+1..head can be redone
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS metadata (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+    _copy_text_keyed_tables(cursor, legacy_tables)
+    _migrate_questions_unique(cursor)
+    _create_questions_rev(cursor)
+    _seed_questions(cursor)
+
+
+def _columns(cursor: sqlite3.Cursor, table: str) -> List[str]:
+    """
+    Возвращает имена столбцов таблицы (пустой список, если таблицы нет)
+    """
+    cursor.execute(f'PRAGMA table_info({table})')
+    return [row[1] for row in cursor.fetchall()]
+
+
+def _add_session_activity(cursor: sqlite3.Cursor) -> None:
+    """
+    Одноразовая миграция: добавляет в sessions время последней активности;
+    существующие сессии считаются активными в момент миграции
+    """
+    if 'last_seen' in _columns(cursor, 'sessions'):
+        return
+    cursor.execute('ALTER TABLE sessions ADD COLUMN last_seen INTEGER')
+    cursor.execute(f'UPDATE sessions SET last_seen = {_NOW}')
+
+
+def _detach_text_keyed_tables(cursor: sqlite3.Cursor) -> List[str]:
+    """
+    Переименовывает таблицы старых версий, где сессия хранится строкой session_id,
+    в legacy_<table>, чтобы на их месте создать таблицы с целочисленным ключом
+    """
+    legacy_tables = []
+    for table in SESSION_TABLES:
+        if 'session_id' not in _columns(cursor, table):
+            continue
+        # Имена индексов в SQLite общие для всей базы, новые таблицы создают их заново
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                       (table,))
+        for (index,) in cursor.fetchall():
+            cursor.execute(f'DROP INDEX {index}')
+        cursor.execute(f'ALTER TABLE {table} RENAME TO legacy_{table}')
+        legacy_tables.append(table)
+    return legacy_tables
+
+
+def _copy_text_keyed_tables(cursor: sqlite3.Cursor, legacy_tables: List[str]) -> None:
+    """
+    Одноразовая миграция: заводит строку sessions на каждый старый session_id и
+    переносит строки legacy-таблиц с целочисленным ключом сессии
+    """
+    if not legacy_tables:
+        return
+    cursor.execute('INSERT OR IGNORE INTO sessions (session_id) ' + ' UNION '.join(
+        f'SELECT session_id FROM legacy_{table} WHERE session_id IS NOT NULL' for table in legacy_tables))
+
+    for table in legacy_tables:
+        legacy_columns = set(_columns(cursor, f'legacy_{table}'))
+        columns = [column for column in _columns(cursor, table) if column in legacy_columns]
+        # Строки переносятся в порядке вставки: из дубликатов ячеек остается самая ранняя
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO {table} (session_key, {", ".join(columns)})
+            SELECT s.id, {", ".join(f"l.{column}" for column in columns)}
+            FROM legacy_{table} l JOIN sessions s ON s.session_id = l.session_id
+            ORDER BY l.rowid
+        ''')
+        cursor.execute(f'DROP TABLE legacy_{table}')
+
+    # Строки, записанные до появления порядка открытия, нумеруются по id
+    cursor.execute('UPDATE opened_cells SET seq = id WHERE seq IS NULL')
+    if 'opened_cells' in legacy_tables and 'session_sequences' not in legacy_tables:
+        cursor.execute('''
+            INSERT OR IGNORE INTO session_sequences (session_key, last_seq, log_start)
+            SELECT session_key, MAX(seq), MAX(seq) FROM opened_cells GROUP BY session_key
+        ''')
+    if 'opened_cells' in legacy_tables and 'opened_bitmaps' not in legacy_tables:
+        _backfill_opened_bitmaps(cursor)
+
+
+def _backfill_opened_bitmaps(cursor: sqlite3.Cursor) -> None:
+    """
+    Одноразовая миграция: строит битовые карты из строк opened_cells существующей базы
+    """
+    cursor.execute('SELECT session_key, round_num, row_num, col_num FROM opened_cells')
+    opened = {}
+    for session_key, round_num, row_num, col_num in cursor.fetchall():
+        index = cell_index(row_num, col_num)
+        if index is not None:
+            opened.setdefault((session_key, round_num), set()).add(index)
+
+    cursor.executemany(
+        'INSERT OR REPLACE INTO opened_bitmaps (session_key, round_num, bits_lo, bits_hi) VALUES (?, ?, ?, ?)',
+        [key + cells_bitmap(indices) for key, indices in opened.items()])
+
+
+def _migrate_questions_unique(cursor: sqlite3.Cursor) -> None:
+    """
+    Одноразовая миграция: удаляет дубликаты вопросов, накопленные до появления
+    уникального ключа, и создает уникальный индекс (round_num, question_text)
+    """
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_questions_round_text'")
+    if cursor.fetchone():
+        return
+
+    # Оставляем самую раннюю копию каждого вопроса, чтобы сохранить исходные id
+    cursor.execute('''
+        DELETE FROM questions
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM questions GROUP BY round_num, question_text
+        )
+    ''')
+    if cursor.rowcount:
+        logger.info(f"Removed {cursor.rowcount} duplicate questions")
+
+    cursor.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_questions_round_text ON questions (round_num, question_text)')
+
+
+def _create_questions_rev(cursor: sqlite3.Cursor) -> None:
+    """
+    Счетчик изменений таблицы вопросов (metadata.questions_rev): триггеры увеличивают
+    его при любой вставке, правке и удалении, в том числе сделанных в обход приложения
+    """
+    cursor.execute("INSERT OR IGNORE INTO metadata (key, value) VALUES ('questions_rev', 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS questions_rev_{event.lower()} AFTER {event} ON questions
+            BEGIN
+                UPDATE metadata SET value = value + 1 WHERE key = 'questions_rev';
+            END
+        ''')
+
+
+def _seed_questions(cursor: sqlite3.Cursor) -> None:
+    """
+    Заполняет таблицу вопросов из config.QUESTIONS, только если их содержимое изменилось
+    """
+    from config import get_questions
+    questions = get_questions()
+    digest = questions_hash(questions)
+
+    cursor.execute("SELECT value FROM metadata WHERE key = 'questions_hash'")
+    stored = cursor.fetchone()
+    if stored and stored[0] == digest:
+        return
+
+    cursor.executemany('''
+        INSERT INTO questions (round_num, question_text, answer, theme) VALUES (?, ?, ?, ?)
+        ON CONFLICT (round_num, question_text) DO UPDATE SET answer = excluded.answer, theme = excluded.theme
+    ''', questions)
+    cursor.execute(
+        "INSERT OR REPLACE INTO metadata (key, value) VALUES ('questions_hash', ?)", (digest,))
+
+
+# --- write operations (run on the writer thread, never commit themselves) ----
+
+def _create_session(cursor: sqlite3.Cursor, session_id: str) -> int:
+    """
+    Заводит сессию (или находит созданную параллельно) и возвращает ее ключ
+    """
+    cursor.execute(f'''
+        INSERT INTO sessions (session_id, last_seen) VALUES (?, {_NOW})
+        ON CONFLICT (session_id) DO UPDATE SET session_id = excluded.session_id
+        RETURNING id
+    ''', (session_id,))
+    return cursor.fetchone()[0]
+
+
+def _save_state(cursor: sqlite3.Cursor, session_key: int, values: Dict[str, Any], version: int) -> Tuple[bool, int]:
+    """
+    Условная запись состояния: одно UPDATE ... WHERE version = ?; версия 0 создает
+    отсутствующее состояние. Возвращает (записано ли, текущая версия)
+    """
+    columns = tuple(values)
+    cursor.execute(f'''
+        UPDATE game_states SET {", ".join(f"{column} = ?" for column in columns)}, version = version + 1
+        WHERE session_key = ? AND version = ?
+    ''', tuple(values.values()) + (session_key, version))
+    if cursor.rowcount:
+        _mark_change(cursor, session_key, 'state_seq')
+        return True, version + 1
+    if version == 0:
+        cursor.execute(f'''
+            INSERT INTO game_states (session_key, {", ".join(columns)}, version) VALUES (?{", ?" * len(columns)}, 1)
+            ON CONFLICT (session_key) DO NOTHING
+        ''', (session_key,) + tuple(values.values()))
+        if cursor.rowcount:
+            _mark_change(cursor, session_key, 'state_seq')
+            return True, 1
+    cursor.execute('SELECT version FROM game_states WHERE session_key = ?', (session_key,))
+    row = cursor.fetchone()
+    return False, row[0] if row else 0
+
+
+def _touch_sessions(cursor: sqlite3.Cursor, session_ids: List[str], seen_at: int) -> None:
+    """
+    Отмечает активность сессий
+    """
+    cursor.executemany('UPDATE sessions SET last_seen = ? WHERE session_id = ?',
+                       [(seen_at, session_id) for session_id in session_ids])
+
+
+def _delete_sessions(cursor: sqlite3.Cursor, session_ids: List[str]) -> int:
+    """
+    Удаляет сессии; строки дочерних таблиц удаляются каскадом по внешним ключам
+    """
+    return cursor.executemany('DELETE FROM sessions WHERE session_id = ?',
+                              [(session_id,) for session_id in session_ids]).rowcount
+
+
+def _next_seq(cursor: sqlite3.Cursor, session_key: int, count: int = 1) -> int:
+    """
+    Выделяет count номеров из монотонного счетчика сессии и возвращает последний из них
+    """
+    cursor.execute('''
+        INSERT INTO session_sequences (session_key, last_seq) VALUES (?, ?)
+        ON CONFLICT (session_key) DO UPDATE SET last_seq = last_seq + excluded.last_seq
+        RETURNING last_seq
+    ''', (session_key, count))
+    return cursor.fetchone()[0]
+
+
+def _log_cells(cursor: sqlite3.Cursor, session_key: int, changes: List[CellChange], last_seq: int) -> None:
+    """
+    Пишет изменения ячеек в журнал изменений под номерами, выделенными из счетчика
+    сессии и заканчивающимися на last_seq; отрезает старые записи, когда журнал
+    становится слишком длинным
+    """
+    cursor.executemany('''
+        INSERT INTO session_changes (session_key, seq, opened, round_num, row_num, col_num, cell_value)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(session_key, seq) + tuple(change) for seq, change in enumerate(changes, last_seq - len(changes) + 1)])
+    cursor.execute('SELECT log_start FROM session_sequences WHERE session_key = ?', (session_key,))
+    cutoff = change_log_cutoff(last_seq, cursor.fetchone()[0])
+    if cutoff is not None:
+        cursor.execute('DELETE FROM session_changes WHERE session_key = ? AND seq <= ?', (session_key, cutoff))
+        cursor.execute('UPDATE session_sequences SET log_start = ? WHERE session_key = ?', (cutoff, session_key))
+
+
+def _mark_change(cursor: sqlite3.Cursor, session_key: int, column: str) -> None:
+    """
+    Отмечает изменение, которое не пишется в журнал по строкам (игроки, сброс поля,
+    сохраненное состояние игры): column получает следующий номер счетчика сессии
+    """
+    cursor.execute(f'''
+        INSERT INTO session_sequences (session_key, last_seq, {column}) VALUES (?, 1, 1)
+        ON CONFLICT (session_key) DO UPDATE SET last_seq = last_seq + 1, {column} = last_seq + 1
+    ''', (session_key,))
+
+
+def _clear_cell_bits(cursor: sqlite3.Cursor, session_key: int, round_num: int, indices) -> None:
+    """
+    Снимает биты ячеек в битовой карте открытых ячеек
+    """
+    bits_lo, bits_hi = cells_bitmap(indices)
+    cursor.execute('''
+        UPDATE opened_bitmaps SET bits_lo = bits_lo & ~?, bits_hi = bits_hi & ~?
+        WHERE session_key = ? AND round_num = ?
+    ''', (bits_lo, bits_hi, session_key, round_num))
+
+
+def _open_cell(cursor: sqlite3.Cursor, session_key: int, round_num: int, row: int, col: int, cell_value) -> bool:
+    """
+    Открывает ячейку: ставит бит в битовой карте и пишет строку журнала opened_cells.
+    Возвращает False, если ячейка уже была открыта
+    """
+    # The duplicate check and the write are one statement:
+    # the conditional upsert changes no row if the cell was already opened
+    bits_lo, bits_hi = cell_bit(cell_index(row, col))
+    cursor.execute('''
+        INSERT INTO opened_bitmaps (session_key, round_num, bits_lo, bits_hi) VALUES (?, ?, ?, ?)
+        ON CONFLICT (session_key, round_num) DO UPDATE
+        SET bits_lo = bits_lo | excluded.bits_lo, bits_hi = bits_hi | excluded.bits_hi
+        WHERE (opened_bitmaps.bits_lo & excluded.bits_lo) = 0 AND (opened_bitmaps.bits_hi & excluded.bits_hi) = 0
+    ''', (session_key, round_num, bits_lo, bits_hi))
+    if cursor.rowcount == 0:
+        return False
+
+    # Keep the per-cell audit log (also used to find the last opened cell);
+    # the unique cell index makes a racing duplicate a no-op
+    seq = _next_seq(cursor, session_key)
+    cursor.execute('''
+        INSERT INTO opened_cells (session_key, round_num, row_num, col_num, cell_value, seq)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (session_key, round_num, row_num, col_num) DO NOTHING
+    ''', (session_key, round_num, row, col, cell_value, seq))
+    _log_cells(cursor, session_key, [(True, round_num, row, col, cell_value)], seq)
+    return True
+
+
+def _close_cell(cursor: sqlite3.Cursor, session_key: int, round_num: int, row: int, col: int) -> None:
+    """
+    Закрывает ячейку: удаляет строку журнала opened_cells и снимает бит
+    """
+    cursor.execute('''
+        DELETE FROM opened_cells WHERE session_key = ? AND round_num = ? AND row_num = ? AND col_num = ?
+    ''', (session_key, round_num, row, col))
+    _clear_cell_bits(cursor, session_key, round_num, [cell_index(row, col)])
+    _log_cells(cursor, session_key, [(False, round_num, row, col, None)], _next_seq(cursor, session_key))
+
+
+def _history_state(cursor: sqlite3.Cursor, session_key: int) -> Dict[str, bool]:
+    """
+    Читает курсор журнала отмены сессии и возвращает флаги can_undo/can_redo
+    """
+    cursor.execute('SELECT position, head FROM undo_cursors WHERE session_key = ?', (session_key,))
+    state = cursor.fetchone()
+    return history_flags(state[0], state[1]) if state else history_flags(0, 0)
+
+
+def _record_history(cursor: sqlite3.Cursor, session_key: int, round_num: int, row: int, col: int,
+                    cell_value) -> Dict[str, bool]:
+    """
+    Добавляет открытие ячейки в журнал отмены: отбрасывает ветку redo
+    и записи старше HISTORY_LIMIT шагов
+    """
+    cursor.execute('''
+        INSERT INTO undo_cursors (session_key, position, head) VALUES (?, 1, 1)
+        ON CONFLICT (session_key) DO UPDATE SET position = position + 1, head = position + 1
+        RETURNING position
+    ''', (session_key,))
+    position = cursor.fetchone()[0]
+
+    cursor.execute('DELETE FROM undo_log WHERE session_key = ? AND (position >= ? OR position <= ?)',
+                   (session_key, position, position - HISTORY_LIMIT))
+    cursor.execute('''
+        INSERT INTO undo_log (session_key, position, round_num, row_num, col_num, cell_value)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (session_key, position, round_num, row, col, cell_value))
+    return history_flags(position, position)
+
+
+def _draw_from_bag(cursor: sqlite3.Cursor, session_key: int, round_num: int, shuffle: Callable[[], List[int]]):
+    """
+    Вытягивает следующий вопрос из перемешанного мешка сессии, не повторяя вопросы.
+    Возвращает (question_id, remaining) или None, если в раунде нет вопросов
+    """
+    # Один индексированный UPDATE продвигает курсор и возвращает перестановку
+    cursor.execute('''
+        UPDATE question_bags SET position = position + 1
+        WHERE session_key = ? AND round_num = ? AND position < size
+        RETURNING question_order, position, size
+    ''', (session_key, round_num))
+    row = cursor.fetchone()
+    if row:
+        question_order, position, size = row
+        return bag_item(question_order, position - 1), size - position
+
+    # Мешка нет или он исчерпан - начинаем новую перестановку
+    question_ids = shuffle()
+    if not question_ids:
+        return None
+    # Смена раунда сбрасывает мешки остальных раундов сессии
+    cursor.execute('DELETE FROM question_bags WHERE session_key = ? AND round_num != ?', (session_key, round_num))
+    cursor.execute('''
+        INSERT OR REPLACE INTO question_bags (session_key, round_num, question_order, position, size)
+        VALUES (?, ?, ?, 1, ?)
+    ''', (session_key, round_num, pack_bag(question_ids), len(question_ids)))
+    return question_ids[0], len(question_ids) - 1
+
+
+def _load_opened_cells(cursor: sqlite3.Cursor, session_key: int, round_num: int, board_state=None) -> list:
+    """
+    Читает открытые ячейки раунда из битовой карты и раскладки поля
+    """
+    # One small row: the bitmap plus the board layout to decode cell values
+    cursor.execute('''
+        SELECT b.bits_lo, b.bits_hi, g.board_state FROM opened_bitmaps b
+        LEFT JOIN game_states g ON g.session_key = b.session_key
+        WHERE b.session_key = ? AND b.round_num = ?
+    ''', (session_key, round_num))
+    bitmap = cursor.fetchone()
+    if not bitmap:
+        return []
+
+    def audit_values():
+        # No saved layout - fall back to the values recorded in the audit log
+        cursor.execute('''
+            SELECT row_num, col_num, cell_value FROM opened_cells
+            WHERE session_key = ? AND round_num = ?
+        ''', (session_key, round_num))
+        return {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+
+    return opened_cells_from_bitmap(bitmap[0], bitmap[1], bitmap[2] if board_state is None else board_state,
+                                    audit_values)
+
+
+# --- repositories -------------------------------------------------------------
+
+class _Repository:
+    def __init__(self, storage: 'SQLiteStorage'):
+        self.storage = storage
+
+
+class SQLiteQuestions(_Repository, QuestionRepository):
+    def all(self) -> List[tuple]:
+        with self.storage.reading() as cursor:
+            cursor.execute('SELECT id, round_num, question_text, answer, theme FROM questions')
+            return cursor.fetchall()
+
+    def version(self) -> Optional[int]:
+        # Bumped by triggers on every change of the questions table
+        with self.storage.reading() as cursor:
+            cursor.execute("SELECT value FROM metadata WHERE key = 'questions_rev'")
+            row = cursor.fetchone()
+            return int(row[0]) if row else None
+
+
+class SQLiteGameStates(_Repository, GameStateRepository):
+    def get(self, session_id: str, columns: Iterable[str] = GAME_STATE_COLUMNS) -> Optional[Dict[str, Any]]:
+        columns = tuple(columns)
+        key = self.storage.session_key(session_id)
+        if key is None:
+            return None
+        with self.storage.reading() as cursor:
+            cursor.execute(f'SELECT {", ".join(columns)} FROM game_states WHERE session_key = ?', (key,))
+            row = cursor.fetchone()
+            return dict(zip(columns, row)) if row else None
+
+    def create(self, session_id: str, values: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        def write(cursor: sqlite3.Cursor, key: int):
+            # Проверяем, существует ли уже игра с этим session_id
+            cursor.execute(f'SELECT {", ".join(VERSIONED_STATE_COLUMNS)} FROM game_states WHERE session_key = ?',
+                           (key,))
+            existing_game = cursor.fetchone()
+            if existing_game:
+                return dict(zip(VERSIONED_STATE_COLUMNS, existing_game))
+            columns = tuple(values)
+            cursor.execute(f'INSERT INTO game_states (session_key, {", ".join(columns)}) VALUES (?{", ?" * len(columns)})',
+                           (key,) + tuple(values.values()))
+            _mark_change(cursor, key, 'state_seq')
+            return None
+
+        return self.storage.write_session(session_id, write)
+
+    def save(self, session_id: str, values: Dict[str, Any], version: int) -> Tuple[bool, int]:
+        if version != 0 and self.storage.session_key(session_id) is None:
+            return False, 0
+        return self.storage.write_session(session_id, _save_state, values, version)
+
+    def upsert_many(self, states: Dict[str, Dict[str, Any]]) -> None:
+        # Flushed off the request threads: the keys are resolved by the statements themselves
+        def write(cursor: sqlite3.Cursor):
+            cursor.executemany(f'''INSERT INTO sessions (session_id, last_seen) VALUES (?, {_NOW})
+                                   ON CONFLICT (session_id) DO NOTHING''', [(session_id,) for session_id in states])
+            # One executemany per set of columns
+            groups: Dict[tuple, list] = {}
+            for session_id, values in states.items():
+                columns = tuple(sorted(values))
+                groups.setdefault(columns, []).append((session_id,) + tuple(values[column] for column in columns))
+            for columns, rows in groups.items():
+                cursor.executemany(f'''
+                    INSERT INTO game_states (session_key, {', '.join(columns)}, version)
+                    VALUES ((SELECT id FROM sessions WHERE session_id = ?){', ?' * len(columns)}, 1)
+                    ON CONFLICT (session_key) DO UPDATE
+                    SET {', '.join(f'{column} = excluded.{column}' for column in columns)}, version = version + 1
+                ''', rows)
+            # Other screens reload the board and state of these sessions
+            cursor.execute(f'SELECT id FROM sessions WHERE session_id IN ({", ".join("?" * len(states))})',
+                           tuple(states))
+            for (key,) in cursor.fetchall():
+                _mark_change(cursor, key, 'state_seq')
+
+        self.storage.write(write)
+
+
+class SQLitePlayers(_Repository, PlayerRepository):
+    def list(self, session_id: str) -> List[Dict[str, Any]]:
+        key = self.storage.session_key(session_id)
+        if key is None:
+            return []
+        with self.storage.reading() as cursor:
+            cursor.execute('SELECT player_name, score FROM players WHERE session_key = ? ORDER BY position', (key,))
+            return [{'player_name': row[0], 'score': row[1]} for row in cursor.fetchall()]
+
+    def add(self, session_id: str, player_name: str) -> None:
+        def write(cursor: sqlite3.Cursor, key: int):
+            # The position is computed by the insert itself
+            cursor.execute('''
+                INSERT INTO players (session_key, player_name, score, position)
+                SELECT ?, ?, 0, COALESCE(MAX(position), 0) + 1 FROM players WHERE session_key = ?
+            ''', (key, player_name, key))
+            _mark_change(cursor, key, 'players_seq')
+
+        self.storage.write_session(session_id, write)
+
+    def update(self, session_id: str, player_name: str, score: int, new_player_name: str) -> None:
+        key = self.storage.session_key(session_id)
+        if key is None:
+            return
+
+        def write(cursor: sqlite3.Cursor):
+            cursor.execute('UPDATE players SET score = ?, player_name = ? WHERE session_key = ? AND player_name = ?',
+                           (score, new_player_name, key, player_name))
+            if cursor.rowcount:
+                _mark_change(cursor, key, 'players_seq')
+
+        self.storage.write(write)
+
+    def remove(self, session_id: str, player_name: str) -> None:
+        key = self.storage.session_key(session_id)
+        if key is None:
+            return
+
+        def write(cursor: sqlite3.Cursor):
+            cursor.execute('DELETE FROM players WHERE session_key = ? AND player_name = ?', (key, player_name))
+
+            # Reorder positions after deletion in one statement, writing only the players that move
+            cursor.execute('''
+                UPDATE players SET position = ranked.new_position
+                FROM (SELECT id, ROW_NUMBER() OVER (ORDER BY position, id) AS new_position
+                      FROM players WHERE session_key = ?) AS ranked
+                WHERE players.id = ranked.id AND players.position IS NOT ranked.new_position
+            ''', (key,))
+            _mark_change(cursor, key, 'players_seq')
+
+        self.storage.write(write)
+
+    def reset(self, session_id: str, player_names: List[str]) -> None:
+        def write(cursor: sqlite3.Cursor, key: int):
+            cursor.execute('DELETE FROM players WHERE session_key = ?', (key,))
+            cursor.executemany('INSERT INTO players (session_key, player_name, score, position) VALUES (?, ?, 0, ?)',
+                               [(key, name, position) for position, name in enumerate(player_names, 1)])
+            _mark_change(cursor, key, 'players_seq')
+
+        self.storage.write_session(session_id, write)
+
+
+class SQLiteBags(_Repository, BagRepository):
+    def draw(self, session_id: str, round_num: int, shuffle: Callable[[], List[int]]) -> Optional[Tuple[int, int]]:
+        return self.storage.write_session(session_id, _draw_from_bag, round_num, shuffle)
+
+    def reset(self, session_id: str, round_num: int) -> None:
+        key = self.storage.session_key(session_id)
+        if key is not None:
+            self.storage.write(_execute, 'DELETE FROM question_bags WHERE session_key = ? AND round_num = ?',
+                               (key, round_num))
+
+
+class SQLiteCells(_Repository, CellRepository):
+    def open(self, session_id: str, round_num: int, row: int, col: int, cell_value) -> Optional[Dict[str, bool]]:
+        def write(cursor: sqlite3.Cursor, key: int):
+            if not _open_cell(cursor, key, round_num, row, col, cell_value):
+                return None
+            return _record_history(cursor, key, round_num, row, col, cell_value)
+
+        return self.storage.write_session(session_id, write)
+
+    def load(self, session_id: str, round_num: int, board_state=None) -> List[dict]:
+        key = self.storage.session_key(session_id)
+        if key is None:
+            return []
+        with self.storage.reading() as cursor:
+            return _load_opened_cells(cursor, key, round_num, board_state)
+
+    def opening_order(self, session_id: str, round_num: int) -> List[Tuple[int, int, int]]:
+        key = self.storage.session_key(session_id)
+        if key is None:
+            return []
+        with self.storage.reading() as cursor:
+            cursor.execute('''
+                SELECT seq, row_num, col_num FROM opened_cells WHERE session_key = ? AND round_num = ? ORDER BY seq
+            ''', (key, round_num))
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def revert(self, session_id: str, round_num: int, steps: int) -> List[Tuple[int, int, int]]:
+        key = self.storage.session_key(session_id)
+        if key is None:
+            return []
+
+        def write(cursor: sqlite3.Cursor):
+            # Index seek on (session_key, round_num, seq DESC): the true last actions, newest first
+            cursor.execute('''
+                SELECT id, row_num, col_num FROM opened_cells
+                WHERE session_key = ? AND round_num = ?
+                ORDER BY seq DESC
+                LIMIT ?
+            ''', (key, round_num, steps))
+            last_cells = [tuple(cell) for cell in cursor.fetchall()]
+
+            if last_cells:
+                # Delete the reverted opened cell records
+                cursor.executemany('DELETE FROM opened_cells WHERE id = ?', [(cell[0],) for cell in last_cells])
+                _clear_cell_bits(cursor, key, round_num,
+                                 [index for index in (cell_index(cell[1], cell[2]) for cell in last_cells)
+                                  if index is not None])
+                _log_cells(cursor, key, [(False, round_num, row, col, None) for _, row, col in last_cells],
+                           _next_seq(cursor, key, len(last_cells)))
+            return last_cells
+
+        return self.storage.write(write)
+
+    def replace(self, session_id: str, round_num: int, submitted: Dict[int, Any]) -> Tuple[List[int], List[int]]:
+        # Runs on the writer, so the diff and its writes are one transaction
+        def write(cursor: sqlite3.Cursor, key: int):
+            cursor.execute('SELECT bits_lo, bits_hi FROM opened_bitmaps WHERE session_key = ? AND round_num = ?',
+                           (key, round_num))
+            bitmap = cursor.fetchone()
+            stored = set(bitmap_cells(*bitmap)) if bitmap else set()
+
+            to_open = [index for index in submitted if index not in stored]
+            to_close = sorted(stored.difference(submitted))
+
+            if to_close:
+                cursor.executemany('''
+                    DELETE FROM opened_cells WHERE session_key = ? AND round_num = ? AND row_num = ? AND col_num = ?
+                ''', [(key, round_num) + divmod(index, COLS) for index in to_close])
+
+            if to_open or to_close:
+                # Closed cells take the first numbers, opened cells the rest (also their opening order)
+                last_seq = _next_seq(cursor, key, len(to_close) + len(to_open))
+                first_seq = last_seq - len(to_open) + 1
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO opened_cells (session_key, round_num, row_num, col_num, cell_value, seq)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', [(key, round_num) + divmod(index, COLS) + (submitted[index], seq)
+                      for seq, index in enumerate(to_open, first_seq)])
+                _log_cells(cursor, key,
+                           [(False, round_num) + divmod(index, COLS) + (None,) for index in to_close] +
+                           [(True, round_num) + divmod(index, COLS) + (submitted[index],) for index in to_open],
+                           last_seq)
+
+            if to_open or to_close or bitmap is None:
+                cursor.execute(
+                    'INSERT OR REPLACE INTO opened_bitmaps (session_key, round_num, bits_lo, bits_hi) VALUES (?, ?, ?, ?)',
+                    (key, round_num) + cells_bitmap(submitted))
+            return to_open, to_close
+
+        return self.storage.write_session(session_id, write)
+
+    def clear(self, session_id: str, round_num: int) -> None:
+        key = self.storage.session_key(session_id)
+        if key is None:
+            return
+
+        def write(cursor: sqlite3.Cursor):
+            # Delete all opened cells for this session and round
+            cursor.execute('DELETE FROM opened_cells WHERE session_key = ? AND round_num = ?', (key, round_num))
+            cursor.execute('DELETE FROM opened_bitmaps WHERE session_key = ? AND round_num = ?', (key, round_num))
+
+            # Reset the question shuffle bag so the new game starts from a fresh permutation
+            cursor.execute('DELETE FROM question_bags WHERE session_key = ? AND round_num = ?', (key, round_num))
+
+            # A new game starts a new undo/redo history
+            cursor.execute('DELETE FROM undo_log WHERE session_key = ?', (key,))
+            cursor.execute('DELETE FROM undo_cursors WHERE session_key = ?', (key,))
+
+            # Clients that have not seen the reset resync from a snapshot
+            _mark_change(cursor, key, 'reset_seq')
+
+        self.storage.write(write)
+
+    def history(self, session_id: str) -> Dict[str, bool]:
+        key = self.storage.session_key(session_id)
+        if key is None:
+            return history_flags(0, 0)
+        with self.storage.reading() as cursor:
+            return _history_state(cursor, key)
+
+    def undo(self, session_id: str):
+        key = self.storage.session_key(session_id)
+        if key is None:
+            return None, history_flags(0, 0)
+
+        def write(cursor: sqlite3.Cursor):
+            # Moving the cursor first serializes concurrent undos of the same session
+            cursor.execute('''
+                UPDATE undo_cursors SET position = position - 1
+                WHERE session_key = ? AND position > MAX(0, head - ?)
+                RETURNING position, head
+            ''', (key, HISTORY_LIMIT))
+            moved = cursor.fetchone()
+            if moved is None:
+                return None, _history_state(cursor, key)
+            position, head = moved
+
+            cursor.execute('''
+                SELECT round_num, row_num, col_num, cell_value FROM undo_log WHERE session_key = ? AND position = ?
+            ''', (key, position + 1))
+            entry = cursor.fetchone()
+            changed_cells = []
+            if entry:
+                round_num, row, col, cell_value = entry
+                _close_cell(cursor, key, round_num, row, col)
+                changed_cells.append({'round_num': round_num, 'row': row, 'col': col, 'value': cell_value,
+                                      'is_revealed': False})
+            return changed_cells, history_flags(position, head)
+
+        return self.storage.write(write)
+
+    def redo(self, session_id: str):
+        key = self.storage.session_key(session_id)
+        if key is None:
+            return None, history_flags(0, 0)
+
+        def write(cursor: sqlite3.Cursor):
+            cursor.execute('''
+                UPDATE undo_cursors SET position = position + 1
+                WHERE session_key = ? AND position < head
+                RETURNING position, head
+            ''', (key,))
+            moved = cursor.fetchone()
+            if moved is None:
+                return None, _history_state(cursor, key)
+            position, head = moved
+
+            cursor.execute('''
+                SELECT round_num, row_num, col_num, cell_value FROM undo_log WHERE session_key = ? AND position = ?
+            ''', (key, position))
+            entry = cursor.fetchone()
+            changed_cells = []
+            if entry:
+                round_num, row, col, cell_value = entry
+                _open_cell(cursor, key, round_num, row, col, cell_value)
+                changed_cells.append({'round_num': round_num, 'row': row, 'col': col, 'value': cell_value,
+                                      'is_revealed': True})
+            return changed_cells, history_flags(position, head)
+
+        return self.storage.write(write)
+
+
+def _execute(cursor: sqlite3.Cursor, sql: str, params=()) -> int:
+    """
+    Операция записи из одного запроса: возвращает число измененных строк
+    """
+    return cursor.execute(sql, params).rowcount
+
+
+class SQLiteStorage(Storage):
+    """SQLite file in WAL mode: per-thread read connections, one group-committing writer."""
+
+    name = 'sqlite'
+
+    def __init__(self, path: str = DATABASE):
+        self.path = path
+        # Соединения потоков переиспользуются между запросами (WAL, настроенные PRAGMA)
+        self.connections = SQLiteConnections(row_factory=sqlite3.Row)  # Позволяет обращаться к столбцам по имени
+        # Все изменения выполняет один поток-писатель: операции, пришедшие за несколько
+        # миллисекунд, фиксируются одной транзакцией (group commit); чтение идет параллельно
+        self.writer = WriteQueue(lambda: self.connections.get(self.path), on_exit=self.connections.close_all)
+        # Целочисленные ключи сессий, найденные в текущем запросе
+        self.session_keys = SessionKeys()
+        self.questions = SQLiteQuestions(self)
+        self.game_states = SQLiteGameStates(self)
+        self.players = SQLitePlayers(self)
+        self.bags = SQLiteBags(self)
+        self.cells = SQLiteCells(self)
+
+    def connection(self) -> sqlite3.Connection:
+        """This thread's connection (close() only releases it)."""
+        try:
+            return self.connections.get(self.path)
+        except sqlite3.Error as e:
+            raise StorageError(f'Database connection error: {e}') from e
+
+    @contextmanager
+    def reading(self):
+        """Cursor of this thread's connection for reads."""
+        conn = self.connection()
+        try:
+            yield conn.cursor()
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+        finally:
+            conn.close()
+
+    def write(self, operation, *args):
+        """Run operation(cursor, *args) on the writer and return its result once committed."""
+        try:
+            return self.writer.run(operation, *args)
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+    def session_key(self, session_id: str) -> Optional[int]:
+        """
+        Целочисленный ключ сессии (один поиск на запрос) или None для неизвестной сессии
+        """
+        key = self.session_keys.get(session_id)
+        if key is None:
+            with self.reading() as cursor:
+                row = cursor.execute('SELECT id FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+            if row is None:
+                return None
+            key = row[0]
+            self.session_keys.put(session_id, key)
+        return key
+
+    def write_session(self, session_id: str, operation, *args):
+        """
+        Выполняет operation(cursor, key, *args) на писателе; неизвестная сессия
+        создается в той же транзакции
+        """
+        key = self.session_key(session_id)
+        if key is not None:
+            return self.write(operation, key, *args)
+
+        created = []
+
+        def write(cursor: sqlite3.Cursor):
+            created.append(_create_session(cursor, session_id))
+            return operation(cursor, created[0], *args)
+
+        result = self.write(write)
+        self.session_keys.put(session_id, created[0])
+        return result
+
+    def init_schema(self) -> None:
+        self.write(_create_schema)
+        self._enable_incremental_vacuum()
+
+    def _enable_incremental_vacuum(self) -> None:
+        # Files created before incremental auto-vacuum are rebuilt once, at startup, so that the
+        # scheduled vacuum() only ever runs the non-blocking incremental_vacuum
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        try:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                conn.executescript('PRAGMA auto_vacuum = INCREMENTAL; VACUUM')
+                logger.info("Enabled incremental auto-vacuum (the database file was rebuilt once)")
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+        finally:
+            conn.close()
+
+    def snapshot(self, session_id: str, round_num: int, board_state=None) -> Dict[str, Any]:
+        key = self.session_key(session_id)
+        if key is None:
+            return {'game_state': None, 'players': [], 'opened_cells': [], 'history': history_flags(0, 0), 'seq': 0}
+        with self.reading() as cursor:
+            # One read transaction, so all sections come from the same snapshot
+            cursor.execute('BEGIN')
+            cursor.execute('SELECT last_seq FROM session_sequences WHERE session_key = ?', (key,))
+            seq = cursor.fetchone()
+            cursor.execute(f'SELECT {", ".join(GAME_STATE_COLUMNS)} FROM game_states WHERE session_key = ?', (key,))
+            game_state = cursor.fetchone()
+
+            cursor.execute('SELECT player_name, score FROM players WHERE session_key = ? ORDER BY position', (key,))
+            players = [{'player_name': row[0], 'score': row[1]} for row in cursor.fetchall()]
+
+            opened_cells = _load_opened_cells(cursor, key, round_num, board_state)
+            history = _history_state(cursor, key)
+            cursor.execute('COMMIT')
+
+        return {
+            'game_state': dict(zip(GAME_STATE_COLUMNS, game_state)) if game_state else None,
+            'players': players,
+            'opened_cells': opened_cells,
+            'history': history,
+            'seq': seq[0] if seq else 0
+        }
+
+    def changes(self, session_id: str, since: int) -> Optional[Dict[str, Any]]:
+        key = self.session_key(session_id)
+        if key is None:
+            return None
+        with self.reading() as cursor:
+            cursor.execute('BEGIN')
+            try:
+                cursor.execute('''
+                    SELECT last_seq, players_seq, reset_seq, state_seq, log_start FROM session_sequences
+                    WHERE session_key = ?
+                ''', (key,))
+                last_seq, players_seq, reset_seq, state_seq, log_start = cursor.fetchone() or (0, 0, 0, 0, 0)
+                if not changes_reachable(since, last_seq, reset_seq, state_seq, log_start):
+                    return None
+                cursor.execute('''
+                    SELECT opened, round_num, row_num, col_num, cell_value FROM session_changes
+                    WHERE session_key = ? AND seq > ? ORDER BY seq
+                ''', (key, since))
+                cell_changes = cursor.fetchall()
+                players = None
+                if players_seq > since:
+                    cursor.execute('SELECT player_name, score FROM players WHERE session_key = ? ORDER BY position',
+                                   (key,))
+                    players = [{'player_name': row[0], 'score': row[1]} for row in cursor.fetchall()]
+            finally:
+                cursor.execute('COMMIT')
+        return collect_changes(last_seq, cell_changes, players)
+
+    def touch_sessions(self, session_ids: Iterable[str], seen_at: int) -> None:
+        self.write(_touch_sessions, list(session_ids), seen_at)
+
+    def idle_sessions(self, seen_before: int, limit: int) -> List[str]:
+        with self.reading() as cursor:
+            cursor.execute('SELECT session_id FROM sessions WHERE last_seen < ? ORDER BY last_seen LIMIT ?',
+                           (seen_before, limit))
+            return [row[0] for row in cursor.fetchall()]
+
+    def session_rows(self, session_ids: Iterable[str]) -> int:
+        session_ids = list(session_ids)
+        if not session_ids:
+            return 0
+        with self.reading() as cursor:
+            cursor.execute(f'''
+                WITH doomed (id) AS (SELECT id FROM sessions WHERE session_id IN ({', '.join('?' * len(session_ids))}))
+                SELECT (SELECT COUNT(*) FROM doomed) + {' + '.join(
+                    f'(SELECT COUNT(*) FROM {table} WHERE session_key IN (SELECT id FROM doomed))'
+                    for table in SESSION_TABLES)}
+            ''', session_ids)
+            return cursor.fetchone()[0]
+
+    def delete_sessions(self, session_ids: Iterable[str]) -> int:
+        session_ids = list(session_ids)
+        self.session_keys.forget(session_ids)
+        return self.write(_delete_sessions, session_ids)
+
+    def vacuum(self) -> Dict[str, Any]:
+        # VACUUM and incremental_vacuum cannot run inside the writer's transactions:
+        # they take the write lock on a connection of their own (waiting up to the busy timeout)
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        try:
+            free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                # executescript steps the pragma to the end, execute() would free a single page
+                conn.executescript('PRAGMA incremental_vacuum')
+                mode = 'incremental'
+            else:
+                # Not converted by init_schema(): a full VACUUM would block the writers, so nothing is freed
+                mode = 'none'
+            conn.execute('PRAGMA optimize')
+            free_pages -= conn.execute('PRAGMA freelist_count').fetchone()[0]
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+        finally:
+            conn.close()
+        return {'vacuum': mode, 'pages_freed': free_pages}
+
+    def release(self) -> None:
+        # Откатывает незавершенную транзакцию соединения потока и забывает ключи сессий запроса
+        self.connections.release()
+        self.session_keys.clear()
+
+    def ping(self) -> bool:
+        try:
+            with self.reading() as cursor:
+                return cursor.execute('SELECT 1').fetchone() is not None
+        except StorageError:
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.connections.stats(), 'group_commit': dict(self.writer.stats)}
+
+    def close(self) -> None:
+        self.writer.stop()
+        self.connections.close_all()
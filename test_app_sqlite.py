@@ -0,0 +1,1259 @@
+"""
+Unit tests for the SQLite version of the application (app.py)
+Each test runs against a fresh temporary database file
+"""
+
+import gzip
+import json
+import os
+import re
+import shutil
+import signal
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import app as lala_app
+import config
+import models
+import storage
+from storage.sqlite import SESSION_TABLES, SQLiteStorage
+from game_archive import GameArchive
+from session_janitor import SessionJanitor
+from sqlite_writer import WriteQueue
+from write_behind import WriteBehindBuffer
+
+
+class SQLiteAppTestCase(unittest.TestCase):
+    """Base test case with a temporary database and a Flask test client"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.database = os.path.join(self.tmpdir, 'test.db')
+        self.storage = SQLiteStorage(self.database)
+        self._orig_storage = lala_app.use_storage(self.storage)
+        lala_app.init_db()
+        self.client = lala_app.app.test_client()
+
+    def tearDown(self):
+        lala_app.use_storage(self._orig_storage)
+        self.storage.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def query(self, sql, params=()):
+        conn = sqlite3.connect(self.database)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def key(self, session_id):
+        """Integer key of the session in the sessions table (None if it has none)"""
+        rows = self.query('SELECT id FROM sessions WHERE session_id = ?', (session_id,))
+        return rows[0][0] if rows else None
+
+
+class TestQuestionSeeding(SQLiteAppTestCase):
+    """Test idempotent question seeding in init_db"""
+
+    def test_seeding_is_idempotent(self):
+        """Repeated init_db calls must not duplicate questions"""
+        lala_app.init_db()
+        lala_app.init_db()
+
+        count = self.query('SELECT COUNT(*) FROM questions')[0][0]
+        self.assertEqual(count, len(config.QUESTIONS))
+
+    def test_hash_is_stored(self):
+        """The content hash of config.QUESTIONS is stored in metadata"""
+        stored = self.query("SELECT value FROM metadata WHERE key = 'questions_hash'")
+        self.assertEqual(stored[0][0], storage.questions_hash(config.QUESTIONS))
+
+    def test_existing_duplicates_are_removed(self):
+        """Databases created before the unique key are deduplicated once"""
+        conn = sqlite3.connect(self.database)
+        conn.execute('DROP INDEX idx_questions_round_text')
+        conn.executemany(
+            'INSERT INTO questions (round_num, question_text, answer, theme) VALUES (?, ?, ?, ?)',
+            config.QUESTIONS)
+        conn.execute("DELETE FROM metadata WHERE key = 'questions_hash'")
+        conn.commit()
+        conn.close()
+
+        with self.assertLogs('storage.sqlite', 'INFO') as logs:
+            lala_app.init_db()
+        self.assertIn(f'Removed {len(config.QUESTIONS)} duplicate questions', logs.output[0])
+
+        count = self.query('SELECT COUNT(*) FROM questions')[0][0]
+        self.assertEqual(count, len(config.QUESTIONS))
+        max_id = self.query('SELECT MAX(id) FROM questions')[0][0]
+        self.assertEqual(max_id, len(config.QUESTIONS))
+
+    def test_changed_answer_is_updated(self):
+        """A changed config triggers re-seeding that updates existing rows"""
+        round_num, text, answer, theme = config.QUESTIONS[0]
+        original = config.QUESTIONS
+        config.QUESTIONS = [(round_num, text, 'Новый ответ', theme)] + list(original[1:])
+        try:
+            lala_app.init_db()
+        finally:
+            config.QUESTIONS = original
+
+        rows = self.query('SELECT answer FROM questions WHERE question_text = ?', (text,))
+        self.assertEqual(rows, [('Новый ответ',)])
+
+
+class TestQuestionEndpoints(SQLiteAppTestCase):
+    """Test question endpoints served from the question bank"""
+
+    def test_get_question_and_check_answer(self):
+        """A drawn question can be answered by id"""
+        response = self.client.post('/api/get_question', json={'session_id': 's1', 'round_num': 2})
+        self.assertEqual(response.status_code, 200)
+        question_id = response.get_json()['question_id']
+
+        answer = self.query('SELECT answer FROM questions WHERE id = ?', (question_id,))[0][0]
+        response = self.client.post('/api/check_answer', json={'question_id': question_id, 'answer': answer.upper()})
+        self.assertTrue(response.get_json()['correct'])
+
+    def test_missing_round_and_question(self):
+        """Unknown rounds and ids return 404"""
+        response = self.client.post('/api/get_question', json={'session_id': 's1', 'round_num': 99})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post('/api/check_answer', json={'question_id': 100000, 'answer': 'x'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_external_edit_reloads_bank(self):
+        """An answer edited outside the application changes the version, and the bank reloads it"""
+        bank = lala_app.QuestionBank(self.storage.questions.all, self.storage.questions.version, refresh_interval=0)
+        question = bank.get(1)
+        version = self.storage.questions.version()
+        conn = sqlite3.connect(self.database)
+        conn.execute("UPDATE questions SET answer = 'Другой ответ' WHERE id = 1")
+        conn.commit()
+        conn.close()
+
+        self.assertNotEqual(self.storage.questions.version(), version)
+        self.assertEqual(bank.get(1), dict(question, answer='Другой ответ'))
+        lala_app.init_db()
+        self.assertEqual(self.storage.questions.version(), version + 1)
+
+    def test_get_all_questions(self):
+        """All questions are returned ordered by id"""
+        questions = self.client.get('/api/get_all_questions').get_json()['questions']
+        self.assertEqual(len(questions), len(config.QUESTIONS))
+        self.assertEqual(questions[0]['question_text'], config.QUESTIONS[0][1])
+
+
+class TestQuestionShuffleBag(SQLiteAppTestCase):
+    """Test the per-session non-repeating question draw"""
+
+    def draw(self, session_id='bag', round_num=1):
+        return self.client.post('/api/get_question', json={'session_id': session_id, 'round_num': round_num}).get_json()
+
+    def round_size(self, round_num=1):
+        return sum(1 for q in config.QUESTIONS if q[0] == round_num)
+
+    def test_no_repeats_within_round(self):
+        """Every question of the round is drawn once before any repeats"""
+        size = self.round_size()
+        drawn = [self.draw() for _ in range(size)]
+        self.assertEqual(len({d['question_id'] for d in drawn}), size)
+        self.assertEqual([d['remaining'] for d in drawn], list(range(size - 1, -1, -1)))
+
+        # The exhausted bag starts a new permutation
+        self.assertEqual(self.draw()['remaining'], size - 1)
+
+    def test_sessions_have_independent_bags(self):
+        """Draws of one session do not advance another session's bag"""
+        self.draw('a')
+        self.draw('a')
+        self.assertEqual(self.draw('b')['remaining'], self.round_size() - 1)
+
+    def test_round_change_and_clear_reset_bag(self):
+        """Changing the round or clearing opened cells resets the bag"""
+        self.draw(round_num=1)
+        self.draw(round_num=2)
+        rows = self.query("SELECT round_num FROM question_bags WHERE session_key = ?", (self.key('bag'),))
+        self.assertEqual(rows, [(2,)])
+
+        self.client.post('/api/clear_opened_cells', json={'session_id': 'bag', 'round_num': 2})
+        self.assertEqual(self.query('SELECT COUNT(*) FROM question_bags')[0][0], 0)
+
+
+def make_text_keyed_database(path, game_states=(), players=(), opened_cells=()):
+    """Replace the session tables with the layout of older versions, keyed by the text session_id"""
+    conn = sqlite3.connect(path)
+    for table in SESSION_TABLES + ('sessions',):
+        conn.execute(f'DROP TABLE {table}')
+    conn.executescript('''
+        CREATE TABLE game_states (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT UNIQUE NOT NULL,
+                                  current_round INTEGER DEFAULT 1, current_cell TEXT, score INTEGER DEFAULT 0,
+                                  revealed_cells TEXT, board_state TEXT, created_at TIMESTAMP);
+        CREATE TABLE players (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, player_name TEXT,
+                              score INTEGER DEFAULT 0, position INTEGER, created_at TIMESTAMP);
+        CREATE TABLE opened_cells (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL,
+                                   round_num INTEGER NOT NULL, row_num INTEGER NOT NULL, col_num INTEGER NOT NULL,
+                                   cell_value TEXT NOT NULL, created_at TIMESTAMP);
+        CREATE INDEX idx_opened_cells_session ON opened_cells (session_id, round_num);
+    ''')
+    conn.executemany('INSERT INTO game_states (session_id, score) VALUES (?, ?)', game_states)
+    conn.executemany('INSERT INTO players (session_id, player_name, score, position) VALUES (?, ?, ?, ?)', players)
+    conn.executemany('''INSERT INTO opened_cells (session_id, round_num, row_num, col_num, cell_value)
+                        VALUES (?, ?, ?, ?, ?)''', opened_cells)
+    conn.commit()
+    conn.close()
+
+
+def make_layout():
+    """Return a board layout with numbers 1..TOTAL_CELLS in row-major order"""
+    return [[str(row * config.COLS + col + 1) for col in range(config.COLS)] for row in range(config.ROWS)]
+
+
+class TestCellQuestionMapping(SQLiteAppTestCase):
+    """Test the cell-to-question mapping assigned at board creation"""
+
+    def save_layout(self, layout, session_id='map'):
+        response = self.client.post('/api/save_board_layout', json={
+            'session_id': session_id, 'round_num': 1, 'board_layout': layout})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['cell_questions']
+
+    def test_every_cell_gets_a_question(self):
+        """All cells are mapped to questions of the round without early repeats"""
+        cell_questions = self.save_layout(make_layout())
+        self.assertEqual(len(cell_questions), config.TOTAL_CELLS)
+
+        round_ids = {q['id'] for q in self.client.get('/api/get_all_questions').get_json()['questions']
+                     if q['round_num'] == 1}
+        self.assertTrue(set(cell_questions) <= round_ids)
+        self.assertEqual(len(set(cell_questions[:len(round_ids)])), len(round_ids))
+
+    def test_mapping_is_kept_for_same_layout(self):
+        """Re-saving the same layout (page reload) keeps the mapping, a new layout replaces it"""
+        layout = make_layout()
+        first = self.save_layout(layout)
+        lala_app.state_buffer.flush()
+        version = self.client.get('/api/load_state?session_id=map').get_json()['version']
+        self.assertEqual(self.client.post('/api/save_state', json={
+            'session_id': 'map', 'current_round': 1, 'score': 0, 'board_state': json.dumps(layout),
+            'version': version}).status_code, 200)
+        self.assertEqual(self.save_layout(layout), first)
+
+        layout[0][0], layout[0][1] = layout[0][1], layout[0][0]
+        self.assertEqual(len(self.save_layout(layout)), config.TOTAL_CELLS)
+
+    def test_cell_lookup(self):
+        """Opening a cell resolves its question with one lookup"""
+        cell_questions = self.save_layout(make_layout())
+        response = self.client.get('/api/get_cell_question?session_id=map&row=2&col=3')
+        self.assertEqual(response.get_json()['question_id'], cell_questions[2 * config.COLS + 3])
+
+        response = self.client.get('/api/get_cell_question?session_id=map&row=99&col=0')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/get_cell_question?session_id=other&row=0&col=0')
+        self.assertEqual(response.status_code, 404)
+
+    def test_round_questions_prefetch(self):
+        """The round's question texts are returned in one batch without answers"""
+        questions = self.client.get('/api/get_round_questions?round_num=1').get_json()['questions']
+        self.assertEqual(len(questions), sum(1 for q in config.QUESTIONS if q[0] == 1))
+        self.assertEqual(set(questions[0]), {'question_id', 'question_text'})
+
+
+class TestOpenedCellsBitmap(SQLiteAppTestCase):
+    """Test the bitmap storage of opened cells"""
+
+    def open_cell(self, row, col, session_id='bits', round_num=1):
+        return self.client.post('/api/mark_cell_opened', json={
+            'session_id': session_id, 'round_num': round_num, 'row': row, 'col': col,
+            'cell_value': str(row * config.COLS + col + 1)})
+
+    def opened(self, session_id='bits', round_num=1):
+        response = self.client.get(f'/api/get_opened_cells?session_id={session_id}&round_num={round_num}')
+        return response.get_json()['opened_cells']
+
+    def test_open_and_decode(self):
+        """Opened cells on both bitmap words decode to the legacy JSON shape"""
+        self.client.post('/api/save_board_layout', json={'session_id': 'bits', 'board_layout': make_layout()})
+        last_row, last_col = config.ROWS - 1, config.COLS - 1
+        self.assertEqual(self.open_cell(0, 1).status_code, 200)
+        self.assertEqual(self.open_cell(last_row, last_col).status_code, 200)
+
+        self.assertEqual(self.opened(), [
+            {'row': 0, 'col': 1, 'value': '2'},
+            {'row': last_row, 'col': last_col, 'value': str(config.TOTAL_CELLS)},
+        ])
+        self.assertEqual(self.query('SELECT COUNT(*) FROM opened_bitmaps')[0][0], 1)
+
+    def test_duplicate_and_invalid_cells(self):
+        """Opening a cell twice or off the board is rejected"""
+        self.open_cell(3, 3)
+        response = self.open_cell(3, 3)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], 'Cell already opened')
+        self.assertEqual(self.open_cell(config.ROWS, 0).status_code, 400)
+
+    def test_values_without_layout(self):
+        """Without a saved layout values come from the audit log"""
+        self.open_cell(1, 2)
+        self.assertEqual(self.opened(), [{'row': 1, 'col': 2, 'value': str(config.COLS + 3)}])
+
+    def test_revert_and_clear_update_bitmap(self):
+        """Reverting and clearing keep the bitmap in sync"""
+        self.open_cell(0, 0)
+        self.open_cell(0, 1)
+        self.client.post('/api/revert_last_opened_cell', json={'session_id': 'bits', 'round_num': 1})
+        self.assertEqual(len(self.opened()), 1)
+
+        self.client.post('/api/clear_opened_cells', json={'session_id': 'bits', 'round_num': 1})
+        self.assertEqual(self.opened(), [])
+        self.assertEqual(self.open_cell(0, 0).status_code, 200)
+
+    def test_backfill_from_rows(self):
+        """Existing databases get bitmaps built from their opened_cells rows"""
+        make_text_keyed_database(self.database, opened_cells=[('old', 1, 7, 9, '80')])
+        lala_app.init_db()
+        self.assertEqual(self.opened('old'), [{'row': 7, 'col': 9, 'value': '80'}])
+
+
+class TestOpenedCellsIndexes(SQLiteAppTestCase):
+    """Test the opened_cells indexes and conflict-safe inserts"""
+
+    def test_indexes_are_used(self):
+        """Lookups by session and round are index seeks, not scans"""
+        plan = self.query('''
+            EXPLAIN QUERY PLAN SELECT id FROM opened_cells
+            WHERE session_key = ? AND round_num = 1 ORDER BY seq DESC LIMIT 1
+        ''', (self.key('s'),))
+        self.assertIn('idx_opened_cells_last', ' '.join(row[-1] for row in plan))
+
+        conn = sqlite3.connect(self.database)
+        key = conn.execute("INSERT INTO sessions (session_id) VALUES ('s')").lastrowid
+        with self.assertRaises(sqlite3.IntegrityError):
+            conn.execute('''INSERT INTO opened_cells (session_key, round_num, row_num, col_num, cell_value)
+                            VALUES (?, 1, 0, 0, '1'), (?, 1, 0, 0, '1')''', (key, key))
+        conn.close()
+
+    def test_sequence_numbers(self):
+        """Opened cells are numbered in opening order"""
+        for col in (4, 2, 7):
+            self.client.post('/api/mark_cell_opened', json={
+                'session_id': 'seq', 'round_num': 1, 'row': 0, 'col': col, 'cell_value': str(col + 1)})
+        rows = self.query("SELECT col_num FROM opened_cells WHERE session_key = ? ORDER BY seq", (self.key('seq'),))
+        self.assertEqual(rows, [(4,), (2,), (7,)])
+
+    def test_migration_removes_duplicate_rows(self):
+        """Duplicate rows of databases created before the index are removed"""
+        make_text_keyed_database(self.database, opened_cells=[('dup', 1, 1, 1, '12')] * 2)
+        lala_app.init_db()
+        rows = self.query("SELECT seq FROM opened_cells WHERE session_key = ?", (self.key('dup'),))
+        self.assertEqual(len(rows), 1)
+        self.assertIsNotNone(rows[0][0])
+
+
+class TestSessionKeys(SQLiteAppTestCase):
+    """Test the sessions table, its migration and cascading deletes"""
+
+    def test_migration_keeps_data(self):
+        """Text-keyed tables of older databases are rebuilt on integer keys without losing rows"""
+        make_text_keyed_database(self.database, game_states=[('old', 7)], players=[('old', 'Аня', 3, 1)],
+                                 opened_cells=[('old', 1, 0, 2, '3')])
+        lala_app.init_db()
+        key = self.key('old')
+        self.assertIsNotNone(key)
+        self.assertEqual(self.query('SELECT score FROM game_states WHERE session_key = ?', (key,)), [(7,)])
+        self.assertEqual(self.query('SELECT player_name, score FROM players WHERE session_key = ?', (key,)),
+                         [('Аня', 3)])
+        self.assertEqual(self.query("SELECT name FROM sqlite_master WHERE name LIKE 'legacy_%'"), [])
+        response = self.client.get('/api/get_opened_cells?session_id=old&round_num=1')
+        self.assertEqual(len(response.get_json()['opened_cells']), 1)
+
+    def test_reads_do_not_create_sessions(self):
+        """Only writes register a session"""
+        self.client.get('/api/get_players?session_id=ghost')
+        self.client.get('/api/get_opened_cells?session_id=ghost&round_num=1')
+        self.assertIsNone(self.key('ghost'))
+
+    def test_delete_cascades(self):
+        """Deleting a session row removes the rows of every session table"""
+        self.client.post('/api/add_player', json={'session_id': 'gone', 'player_name': 'p'})
+        self.client.post('/api/mark_cell_opened', json={
+            'session_id': 'gone', 'round_num': 1, 'row': 0, 'col': 0, 'cell_value': '1'})
+        key = self.key('gone')
+        self.assertEqual(self.storage.delete_sessions(['gone']), 1)
+        for table in SESSION_TABLES:
+            self.assertEqual(self.query(f'SELECT COUNT(*) FROM {table} WHERE session_key = ?', (key,)),
+                             [(0,)], table)
+
+
+class TestRevertSequence(SQLiteAppTestCase):
+    """Test reverting opened cells by their monotonic sequence number"""
+
+    def open_cells(self, cells, session_id='rev'):
+        for row, col in cells:
+            self.client.post('/api/mark_cell_opened', json={
+                'session_id': session_id, 'round_num': 1, 'row': row, 'col': col, 'cell_value': 'x'})
+
+    def revert(self, steps=1, session_id='rev'):
+        return self.client.post('/api/revert_last_opened_cell', json={
+            'session_id': session_id, 'round_num': 1, 'steps': steps}).get_json()
+
+    def test_reverts_true_last_action(self):
+        """Cells opened within the same second are reverted newest first"""
+        self.open_cells([(0, 0), (5, 5), (2, 2)])
+        self.assertEqual(self.revert()['reverted_cell'], {'id': 3, 'row': 2, 'col': 2})
+        self.assertEqual(self.revert()['reverted_cell']['row'], 5)
+
+    def test_revert_several_steps(self):
+        """Several actions are reverted in one call"""
+        self.open_cells([(0, 0), (1, 1), (2, 2)])
+        result = self.revert(steps=2)
+        self.assertEqual([cell['row'] for cell in result['reverted_cells']], [2, 1])
+        self.assertEqual(self.revert(steps=5)['reverted_cells'][0]['row'], 0)
+        self.assertEqual(self.revert()['status'], 'no_cells_to_revert')
+
+    def test_invalid_steps(self):
+        """A non-numeric step count is rejected and reverts nothing"""
+        self.open_cells([(0, 0)])
+        for steps in ('two', None, [1]):
+            response = self.client.post('/api/revert_last_opened_cell', json={
+                'session_id': 'rev', 'round_num': 1, 'steps': steps})
+            self.assertEqual((response.status_code, response.get_json()), (400, {'error': 'Invalid steps'}))
+        self.assertEqual(self.revert()['reverted_cell']['row'], 0)
+
+    def test_sequence_is_not_reused(self):
+        """Sequence numbers keep growing after a revert"""
+        self.open_cells([(0, 0), (0, 1)])
+        self.revert()
+        self.open_cells([(0, 2)])
+        rows = self.query('SELECT col_num, seq FROM opened_cells WHERE session_key = ? ORDER BY seq',
+                          (self.key('rev'),))
+        self.assertEqual(rows, [(0, 1), (2, 4)])  # the revert took number 3
+
+
+class TestUndoRedoHistory(SQLiteAppTestCase):
+    """Test the server-side undo/redo log of cell deltas"""
+
+    def open_cell(self, row, col, session_id='hist'):
+        return self.client.post('/api/mark_cell_opened', json={
+            'session_id': session_id, 'round_num': 1, 'row': row, 'col': col,
+            'cell_value': f'{row}{col}'}).get_json()
+
+    def step(self, action, session_id='hist'):
+        return self.client.post(f'/api/{action}', json={'session_id': session_id}).get_json()
+
+    def opened(self, session_id='hist'):
+        cells = self.client.get(f'/api/get_opened_cells?session_id={session_id}&round_num=1').get_json()
+        return sorted((cell['row'], cell['col']) for cell in cells['opened_cells'])
+
+    def test_undo_and_redo_return_changed_cells(self):
+        """Each step applies one delta and returns only the changed cell"""
+        self.assertEqual(self.open_cell(0, 0), {'status': 'success', 'can_undo': True, 'can_redo': False})
+        self.open_cell(1, 1)
+
+        result = self.step('undo')
+        self.assertEqual(result['changed_cells'], [
+            {'round_num': 1, 'row': 1, 'col': 1, 'value': '11', 'is_revealed': False}])
+        self.assertEqual((result['can_undo'], result['can_redo']), (True, True))
+        self.assertEqual(self.opened(), [(0, 0)])
+
+        result = self.step('redo')
+        self.assertTrue(result['changed_cells'][0]['is_revealed'])
+        self.assertEqual((result['can_undo'], result['can_redo']), (True, False))
+        self.assertEqual(self.opened(), [(0, 0), (1, 1)])
+
+    def test_nothing_to_undo_or_redo(self):
+        """Steps past either end of the history change nothing"""
+        self.assertEqual(self.step('undo')['status'], 'nothing_to_undo')
+        self.open_cell(0, 0)
+        self.assertEqual(self.step('redo')['status'], 'nothing_to_redo')
+        self.step('undo')
+        result = self.step('undo')
+        self.assertEqual(result['changed_cells'], [])
+        self.assertEqual((result['can_undo'], result['can_redo']), (False, True))
+
+    def test_new_action_discards_redo_branch(self):
+        """Opening a cell after an undo drops the undone actions"""
+        self.open_cell(0, 0)
+        self.open_cell(0, 1)
+        self.step('undo')
+        self.assertFalse(self.open_cell(0, 2)['can_redo'])
+        self.assertEqual(self.step('redo')['status'], 'nothing_to_redo')
+        self.assertEqual(self.query('SELECT position FROM undo_log WHERE session_key = ?', (self.key('hist'),)),
+                         [(1,), (2,)])
+
+    def test_history_is_limited(self):
+        """Only the last HISTORY_LIMIT actions can be undone"""
+        cells = [(row, col) for row in range(config.ROWS) for col in range(config.COLS)]
+        for row, col in cells[:config.HISTORY_LIMIT + 3]:
+            self.open_cell(row, col)
+        self.assertEqual(self.query('SELECT COUNT(*) FROM undo_log WHERE session_key = ?', (self.key('hist'),))[0][0],
+                         config.HISTORY_LIMIT)
+
+        undone = 0
+        while self.step('undo')['status'] == 'success':
+            undone += 1
+        self.assertEqual(undone, config.HISTORY_LIMIT)
+        self.assertEqual(len(self.opened()), 3)
+
+    def test_history_survives_client_and_resets_on_clear(self):
+        """History flags are read from the server and a new game starts a new history"""
+        self.open_cell(0, 0)
+        flags = self.client.get('/api/history?session_id=hist').get_json()
+        self.assertEqual(flags, {'can_undo': True, 'can_redo': False})
+
+        self.client.post('/api/clear_opened_cells', json={'session_id': 'hist', 'round_num': 1})
+        flags = self.client.get('/api/history?session_id=hist').get_json()
+        self.assertEqual(flags, {'can_undo': False, 'can_redo': False})
+        self.assertEqual(self.step('undo')['status'], 'nothing_to_undo')
+
+
+class TestSetOpenedCellsDiff(SQLiteAppTestCase):
+    """Test that set_opened_cells writes only the difference to the stored set"""
+
+    def set_cells(self, cells, session_id='diff'):
+        return self.client.post('/api/set_opened_cells', json={
+            'session_id': session_id, 'round_num': 1,
+            'opened_cells': [{'row': row, 'col': col, 'value': f'{row}{col}'} for row, col in cells]})
+
+    def test_returns_only_changes(self):
+        """Cells kept open are not rewritten and the response lists the changes"""
+        self.assertEqual(self.set_cells([(0, 0), (1, 1)]).get_json()['opened'],
+                         [{'row': 0, 'col': 0, 'value': '00'}, {'row': 1, 'col': 1, 'value': '11'}])
+        kept_before = self.query('SELECT id, seq FROM opened_cells WHERE session_key = ? AND row_num = 0',
+                                 (self.key('diff'),))
+
+        result = self.set_cells([(0, 0), (2, 3)]).get_json()
+        self.assertEqual(result['opened'], [{'row': 2, 'col': 3, 'value': '23'}])
+        self.assertEqual(result['closed'], [{'row': 1, 'col': 1}])
+        self.assertEqual(self.query('SELECT id, seq FROM opened_cells WHERE session_key = ? AND row_num = 0',
+                                    (self.key('diff'),)),
+                         kept_before)
+
+        opened = self.client.get('/api/get_opened_cells?session_id=diff&round_num=1').get_json()['opened_cells']
+        self.assertEqual(sorted((cell['row'], cell['col']) for cell in opened), [(0, 0), (2, 3)])
+        self.assertEqual(self.query('SELECT COUNT(*) FROM opened_cells WHERE session_key = ?',
+                                    (self.key('diff'),))[0][0], 2)
+
+    def test_unchanged_set_and_clearing(self):
+        """Submitting the stored set changes nothing; an empty set closes every cell"""
+        self.set_cells([(0, 0)])
+        self.assertEqual(self.set_cells([(0, 0), (0, 0)]).get_json(),
+                         {'status': 'success', 'opened': [], 'closed': []})
+        self.assertEqual(self.set_cells([]).get_json()['closed'], [{'row': 0, 'col': 0}])
+        self.assertEqual(self.query('SELECT bits_lo, bits_hi FROM opened_bitmaps WHERE session_key = ?',
+                                    (self.key('diff'),)),
+                         [(0, 0)])
+
+    def test_invalid_cell(self):
+        """An off-board cell rejects the whole request"""
+        self.set_cells([(0, 0)])
+        self.assertEqual(self.set_cells([(1, 1), (config.ROWS, 0)]).status_code, 400)
+        self.assertEqual(self.query('SELECT row_num, col_num FROM opened_cells WHERE session_key = ?',
+                                    (self.key('diff'),)), [(0, 0)])
+
+
+class TestBootstrap(SQLiteAppTestCase):
+    """Test the combined page-load endpoint"""
+
+    def bootstrap(self, versions=None):
+        query = 'session_id=boot&round_num=1'
+        if versions:
+            query += '&versions=' + ','.join(f'{name}:{version}' for name, version in versions.items())
+        return self.client.get(f'/api/bootstrap?{query}').get_json()
+
+    def test_new_session(self):
+        """A session without saved state still gets config and empty sections"""
+        data = self.bootstrap()
+        self.assertEqual(data['config']['settings']['rows'], config.ROWS)
+        self.assertIsNone(data['state'])
+        self.assertIsNone(data['board'])
+        self.assertEqual(data['opened_cells'], [])
+        self.assertEqual(data['history'], {'can_undo': False, 'can_redo': False})
+
+    def test_all_sections(self):
+        """The response matches what the separate endpoints return"""
+        layout = make_layout()
+        saved = self.client.post('/api/save_board_layout', json={
+            'session_id': 'boot', 'round_num': 1, 'board_layout': layout}).get_json()
+        self.client.post('/api/reset_players', json={'session_id': 'boot'})
+        self.client.post('/api/mark_cell_opened', json={
+            'session_id': 'boot', 'round_num': 1, 'row': 2, 'col': 3, 'cell_value': layout[2][3]})
+
+        data = self.bootstrap()
+        self.assertEqual(data['board'], {'layout': layout, 'cell_questions': saved['cell_questions']})
+        self.assertEqual(data['config'], self.client.get('/api/config').get_json())
+        self.assertEqual([player['player_name'] for player in data['players']], ['Игрок 1', 'Игрок 2'])
+        self.assertEqual(data['opened_cells'], [{'row': 2, 'col': 3, 'value': layout[2][3]}])
+        self.assertTrue(data['history']['can_undo'])
+
+    def test_known_sections_are_skipped(self):
+        """Sections with an unchanged version are omitted until they change"""
+        versions = self.bootstrap()['versions']
+        data = self.bootstrap(versions)
+        self.assertEqual(data, {'versions': versions, 'seq': 0})
+
+        self.client.post('/api/reset_players', json={'session_id': 'boot'})
+        data = self.bootstrap(versions)
+        self.assertEqual(set(data), {'versions', 'seq', 'players'})
+        self.assertNotEqual(data['versions']['players'], versions['players'])
+
+
+class TestConfigEndpoint(SQLiteAppTestCase):
+    """Test the precompressed, ETag-cached configuration response"""
+
+    def test_variants_and_etag(self):
+        """The same content is served plain or gzipped, each with its own strong ETag"""
+        plain = self.client.get('/api/config')
+        self.assertEqual(plain.get_json()['settings']['cols'], config.COLS)
+        self.assertIn('max-age', plain.headers['Cache-Control'])
+        self.assertEqual(plain.headers['Vary'], 'Accept-Encoding')
+
+        zipped = self.client.get('/api/config', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(zipped.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(zipped.data), plain.data)
+        self.assertNotEqual(zipped.headers['ETag'], plain.headers['ETag'])
+        self.assertFalse(zipped.headers['ETag'].startswith('W/'))
+
+    def test_not_modified(self):
+        """A current ETag of any variant gets 304 without a body"""
+        etag = self.client.get('/api/config', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+        response = self.client.get('/api/config', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        response = self.client.get('/api/config', headers={'If-None-Match': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_reload(self):
+        """reload_config rebuilds the payload from config.py"""
+        payload = lala_app.config_payload
+        lala_app.reload_config()
+        self.assertIsNot(lala_app.config_payload, payload)
+        self.assertEqual(lala_app.config_payload.version, payload.version)
+
+    def test_reload_endpoint(self):
+        """The reload endpoint rebuilds the payload, but only for requests from the server machine"""
+        payload = lala_app.config_payload
+        response = self.client.post('/api/reload_config', environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(response.status_code, 403)
+        self.assertIs(lala_app.config_payload, payload)
+
+        response = self.client.post('/api/reload_config')
+        self.assertEqual(response.get_json(), {'status': 'success', 'version': payload.version})
+        self.assertIsNot(lala_app.config_payload, payload)
+
+    @unittest.skipUnless(hasattr(signal, 'SIGHUP'), 'no SIGHUP on this platform')
+    def test_reload_signal(self):
+        """SIGHUP rebuilds the payload once the handler is installed"""
+        self.addCleanup(signal.signal, signal.SIGHUP, signal.getsignal(signal.SIGHUP))
+        self.assertTrue(lala_app.install_reload_signal())
+        payload = lala_app.config_payload
+        os.kill(os.getpid(), signal.SIGHUP)
+        self.assertIsNot(lala_app.config_payload, payload)
+
+
+class TestStaticAssets(SQLiteAppTestCase):
+    """Test the content-hashed assets and the pre-rendered page shell"""
+
+    def asset_urls(self, page):
+        return re.findall(r'(?:href|src)="(/assets/[^"]+)"', page)
+
+    def test_shell_links_hashed_assets(self):
+        """The page is a small shell linking immutable, precompressed CSS and JS"""
+        page = self.client.get('/')
+        self.assertEqual(page.headers['Cache-Control'], 'no-cache')
+        urls = self.asset_urls(page.get_data(as_text=True))
+        self.assertEqual(len(urls), 2)
+        self.assertEqual(urls[0], lala_app.assets.url('css/index.css'))
+
+        for url in urls:
+            asset = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(asset.status_code, 200)
+            self.assertIn('immutable', asset.headers['Cache-Control'])
+            self.assertEqual(asset.headers['Content-Encoding'], 'gzip')
+        self.assertTrue(asset.content_type.startswith('text/javascript'))
+
+    def test_revalidation(self):
+        """An unchanged shell or asset costs a bodyless 304"""
+        page = self.client.get('/')
+        response = self.client.get('/', headers={'If-None-Match': page.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        url = self.asset_urls(page.get_data(as_text=True))[1]
+        etag = self.client.get(url).headers['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+
+    def test_unknown_asset(self):
+        """Stale or unknown hashed names are not served"""
+        self.assertEqual(self.client.get('/assets/js/index.0000.js').status_code, 404)
+
+
+class TestManagedConnections(SQLiteAppTestCase):
+    """Test the reused per-thread SQLite connections"""
+
+    def test_connection_is_reused_in_wal_mode(self):
+        """Requests reuse the thread's connection, which runs in WAL mode"""
+        self.client.get('/api/get_opened_cells?session_id=c&round_num=1')
+        before = self.storage.connections.stats()
+        self.client.get('/api/get_opened_cells?session_id=c&round_num=1')
+        self.client.get('/api/get_opened_cells?session_id=c&round_num=1')
+        after = self.client.get('/api/db_stats').get_json()
+        self.assertEqual(after['opened'], before['opened'])
+        self.assertGreaterEqual(after['reused'], before['reused'] + 2)
+        self.assertEqual(self.query('PRAGMA journal_mode'), [('wal',)])
+
+    def test_writes_are_timed(self):
+        """Writes start an explicit write transaction whose lock wait is measured"""
+        before = self.storage.connections.stats()
+        self.client.post('/api/mark_cell_opened', json={
+            'session_id': 'c', 'round_num': 1, 'row': 0, 'col': 0, 'cell_value': '1'})
+        after = self.storage.connections.stats()
+        self.assertEqual(after['write_transactions'], before['write_transactions'] + 1)
+        self.assertGreater(after['lock_wait_seconds'], before['lock_wait_seconds'])
+
+    def test_nested_use_keeps_transaction(self):
+        """Releasing a nested use does not roll back the outer transaction"""
+        outer = self.storage.connection()
+        outer.execute("INSERT INTO metadata (key, value) VALUES ('nested', '1')")
+        inner = self.storage.connection()
+        self.assertIs(inner, outer)
+        inner.close()
+        self.assertTrue(outer.in_transaction)
+        outer.commit()
+        outer.close()
+        self.assertEqual(self.query("SELECT value FROM metadata WHERE key = 'nested'"), [('1',)])
+
+    def test_unfinished_transaction_is_rolled_back(self):
+        """Work left uncommitted is rolled back when the connection is released"""
+        conn = self.storage.connection()
+        conn.execute("INSERT INTO metadata (key, value) VALUES ('lost', '1')")
+        self.storage.connections.release()
+        self.assertFalse(conn.in_transaction)
+        self.assertEqual(self.query("SELECT value FROM metadata WHERE key = 'lost'"), [])
+
+    def test_shared_orm_session_ends_with_request(self):
+        """The thread's session of the models registry is discarded when the request ends"""
+        with lala_app.app.app_context():
+            models.db_session()
+            self.assertTrue(models.db_session.registry.has())
+        self.assertFalse(models.db_session.registry.has())
+
+
+class TestWriteQueue(SQLiteAppTestCase):
+    """Test the single-writer queue with group commit"""
+
+    def make_queue(self, **kwargs):
+        queue = WriteQueue(lambda: self.storage.connections.get(self.database),
+                           on_exit=self.storage.connections.close_all, **kwargs)
+        self.addCleanup(queue.stop)
+        return queue
+
+    def insert(self, cursor, key):
+        cursor.execute('INSERT INTO metadata (key, value) VALUES (?, ?)', (key, 'v'))
+        return key
+
+    def test_operations_share_one_commit(self):
+        """Operations queued within the window are committed together"""
+        queue = self.make_queue(delay=0.2)
+        futures = [queue.submit(self.insert, f'k{i}') for i in range(5)]
+        self.assertEqual([future.result() for future in futures], [f'k{i}' for i in range(5)])
+        self.assertEqual(queue.stats, {'operations': 5, 'commits': 1})
+        self.assertEqual(len(self.query("SELECT key FROM metadata WHERE key LIKE 'k%'")), 5)
+
+    def test_failing_operation_is_isolated(self):
+        """A failing operation is rolled back alone and raises only for its caller"""
+        def fail(cursor):
+            self.insert(cursor, 'partial')
+            raise ValueError('boom')
+
+        queue = self.make_queue(delay=0.2)
+        first, failing, last = queue.submit(self.insert, 'a'), queue.submit(fail), queue.submit(self.insert, 'b')
+        self.assertEqual(first.result(), 'a')
+        self.assertEqual(last.result(), 'b')
+        with self.assertRaises(ValueError):
+            failing.result()
+        self.assertEqual(self.query('SELECT key FROM metadata WHERE key IN (?, ?, ?) ORDER BY key',
+                                    ('a', 'b', 'partial')), [('a',), ('b',)])
+
+    def test_result_is_visible_to_readers(self):
+        """When run() returns, the write is committed and visible to other connections"""
+        self.make_queue().run(self.insert, 'seen')
+        self.assertEqual(self.query("SELECT value FROM metadata WHERE key = 'seen'"), [('v',)])
+
+    def test_endpoints_write_through_the_queue(self):
+        """Write endpoints are executed by the writer thread"""
+        before = dict(self.storage.writer.stats)
+        self.client.post('/api/add_player', json={'session_id': 'w', 'player_name': 'Игрок'})
+        self.client.post('/api/mark_cell_opened', json={
+            'session_id': 'w', 'round_num': 1, 'row': 0, 'col': 0, 'cell_value': '1'})
+        stats = self.client.get('/api/db_stats').get_json()['group_commit']
+        self.assertEqual(stats['operations'], before['operations'] + 2)
+        self.assertEqual(self.query('SELECT player_name FROM players WHERE session_key = ?', (self.key('w'),)),
+                         [('Игрок',)])
+
+
+class TestWriteBehind(SQLiteAppTestCase):
+    """Test the write-behind buffer of save_board_layout"""
+
+    def save_layout(self, layout):
+        return self.client.post('/api/save_board_layout', json={'session_id': 'wb', 'board_layout': layout})
+
+    def stored_layouts(self):
+        return self.query("SELECT board_state, version FROM game_states WHERE session_key = ?", (self.key('wb'),))
+
+    def test_reads_see_buffered_state(self):
+        """A saved layout is readable before it is flushed, then written once with a new version"""
+        first, second = make_layout(), make_layout()
+        second[0][0], second[0][1] = second[0][1], second[0][0]
+        self.save_layout(first)
+        self.save_layout(second)
+        self.assertEqual(self.stored_layouts(), [])
+        state = self.client.get('/api/load_state?session_id=wb').get_json()
+        self.assertEqual(state['board_state'], second)
+        self.assertEqual(self.client.post('/api/init_game', json={'session_id': 'wb'}).get_json()['board_state'],
+                         json.dumps(second))
+
+        self.assertEqual(lala_app.state_buffer.flush(), 1)
+        self.assertEqual(self.stored_layouts(), [(json.dumps(second), 1)])
+
+    def test_unchanged_saves_are_skipped(self):
+        """Saving the same layout again writes nothing"""
+        layout = make_layout()
+        before = dict(lala_app.state_buffer.stats)
+        for _ in range(3):
+            self.save_layout(layout)
+        self.assertEqual(lala_app.state_buffer.stats['buffered'], before['buffered'] + 1)
+        lala_app.state_buffer.flush()
+        self.save_layout(layout)
+        self.assertEqual(lala_app.state_buffer.stats['skipped'], before['skipped'] + 3)
+        self.assertEqual(lala_app.state_buffer.flush(), 0)
+
+    def test_failed_flush_keeps_values(self):
+        """Values stay buffered when the flush fails; newer values win"""
+        attempts = []
+
+        def flush(states):
+            attempts.append(states)
+            if len(attempts) == 1:
+                raise sqlite3.OperationalError('database is locked')
+
+        buffer = WriteBehindBuffer(flush, interval=60)
+        self.addCleanup(buffer.stop)
+        buffer.put('s', {'score': 1, 'current_cell': 'A1'})
+        with self.assertRaises(sqlite3.OperationalError):
+            buffer.flush()
+        buffer.put('s', {'score': 2})
+        self.assertEqual(buffer.get('s'), {'score': 2, 'current_cell': 'A1'})
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(attempts[-1], {'s': {'score': 2, 'current_cell': 'A1'}})
+
+    def test_background_failure_is_logged(self):
+        """A failed background flush is logged with its traceback and retried"""
+        attempts = []
+
+        def flush(states):
+            attempts.append(states)
+            if len(attempts) == 1:
+                raise sqlite3.OperationalError('database is locked')
+
+        buffer = WriteBehindBuffer(flush, interval=0.01)
+        self.addCleanup(buffer.stop)
+        with self.assertLogs('write_behind', 'ERROR') as logs:
+            buffer.put('s', {'score': 1})
+            deadline = time.monotonic() + 5
+            while len(attempts) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(len(attempts), 2)
+        self.assertIn('database is locked', logs.output[0])
+        self.assertIsNotNone(logs.records[0].exc_info)
+
+
+
+class TestVersionedSaves(SQLiteAppTestCase):
+    """Test the optimistic concurrency of save_state with a version"""
+
+    def save_state(self, score, version=None):
+        data = {'session_id': 'vs', 'current_round': 1, 'current_cell': 'A1', 'score': score, 'board_state': {'k': 1}}
+        if version is not None:
+            data['version'] = version
+        return self.client.post('/api/save_state', json=data)
+
+    def test_stale_save_is_rejected(self):
+        """The second writer of the same version gets 409 with the current state"""
+        self.assertEqual(self.client.post('/api/init_game', json={'session_id': 'vs'}).get_json()['version'], 0)
+        first = self.save_state(10, version=0)
+        self.assertEqual((first.status_code, first.get_json()['version']), (200, 1))
+
+        stale = self.save_state(20, version=0)
+        self.assertEqual(stale.status_code, 409)
+        self.assertEqual({key: stale.get_json()[key] for key in ('version', 'score', 'board_state')},
+                         {'version': 1, 'score': 10, 'board_state': {'k': 1}})
+
+        self.assertEqual(self.save_state(20, version=1).get_json()['version'], 2)
+        state = self.client.get('/api/load_state?session_id=vs').get_json()
+        self.assertEqual((state['score'], state['version']), (20, 2))
+        self.assertEqual(self.save_state(1, version='2').status_code, 400)
+
+    def test_save_without_version_is_rejected(self):
+        """Every state save is conditional"""
+        response = self.save_state(5)
+        self.assertEqual((response.status_code, response.get_json()['error']), (400, 'Missing version'))
+        self.assertIsNone(self.key('vs'))
+
+    def test_buffered_layout_bumps_the_version(self):
+        """A layout saved without a version replaces the state: a save over the version read before is rejected"""
+        self.assertEqual(self.save_state(6, version=0).get_json()['version'], 1)
+        self.client.post('/api/save_board_layout', json={'session_id': 'vs', 'board_layout': make_layout()})
+        stale = self.save_state(7, version=1)
+        self.assertEqual((stale.status_code, stale.get_json()['version']), (409, 2))
+        self.assertEqual(lala_app.state_buffer.get('vs'), {})
+        self.assertEqual(self.save_state(7, version=2).get_json()['version'], 3)
+
+        bootstrap = self.client.get('/api/bootstrap?session_id=vs').get_json()
+        self.assertEqual(bootstrap['state']['version'], 3)
+
+    def test_versioned_layout_save(self):
+        """A layout saved with a version is written at once, or rejected over a newer state"""
+        layout = make_layout()
+        saved = self.client.post('/api/save_board_layout', json={
+            'session_id': 'vs', 'board_layout': layout, 'version': 0}).get_json()
+        self.assertEqual((saved['version'], len(saved['cell_questions'])), (1, config.TOTAL_CELLS))
+        self.assertEqual(lala_app.state_buffer.get('vs'), {})
+        stale = self.client.post('/api/save_board_layout', json={
+            'session_id': 'vs', 'board_layout': layout[::-1], 'version': 0})
+        self.assertEqual((stale.status_code, stale.get_json()['board_state']), (409, layout))
+
+    def test_other_sessions_stay_buffered(self):
+        """A versioned save writes only its own session's buffered values"""
+        layout = make_layout()
+        self.client.post('/api/save_board_layout', json={'session_id': 'other', 'board_layout': layout})
+        self.assertEqual(self.save_state(6, version=0).status_code, 200)
+        self.assertEqual(lala_app.state_buffer.get('other')['board_state'], json.dumps(layout))
+        self.assertEqual(self.query('SELECT COUNT(*) FROM game_states WHERE session_key = ?',
+                                    (self.key('other'),)), [(0,)])
+
+    def test_unchanged_versioned_save_is_skipped(self):
+        """Saving the same state again with the current version writes nothing and keeps the version"""
+        self.assertEqual(self.save_state(7, version=0).get_json()['version'], 1)
+        response = self.save_state(7, version=1)
+        self.assertEqual((response.status_code, response.get_json()['version']), (200, 1))
+        self.assertEqual(self.query('SELECT version FROM game_states WHERE session_key = ?',
+                                    (self.key('vs'),)), [(1,)])
+        # A stale client is still told about the newer state
+        self.assertEqual(self.save_state(8, version=0).status_code, 409)
+
+    def test_saved_values_keep_buffered_columns(self):
+        """Values saved past the buffer do not drop a layout buffered meanwhile"""
+        buffer = WriteBehindBuffer(lambda states: None, interval=60)
+        self.addCleanup(buffer.stop)
+        buffer.put('s', {'board_state': 'new'})
+        buffer.written('s', {'score': 1, 'board_state': 'old'})
+        self.assertEqual(buffer.get('s'), {'board_state': 'new'})
+        self.assertFalse(buffer.unchanged('s', {'board_state': 'old'}))
+        self.assertFalse(buffer.put('s', {'score': 1}))
+        self.assertTrue(buffer.flush_key('s'))
+        self.assertTrue(buffer.unchanged('s', {'score': 1, 'board_state': 'new'}))
+
+
+class TestDeltaSync(SQLiteAppTestCase):
+    """Test that /api/changes sends only what changed after the client's change number"""
+
+    def changes(self, since):
+        return self.client.get(f'/api/changes?session_id=ds&round_num=1&since={since}').get_json()
+
+    def open_cell(self, row, col, round_num=1):
+        self.client.post('/api/mark_cell_opened', json={
+            'session_id': 'ds', 'round_num': round_num, 'row': row, 'col': col, 'cell_value': f'{row}{col}'})
+
+    def test_delta(self):
+        """Cells of the round and changed players are sent; nothing else"""
+        self.client.post('/api/reset_players', json={'session_id': 'ds'})
+        self.open_cell(0, 0)
+        seq = self.client.get('/api/bootstrap?session_id=ds&round_num=1').get_json()['seq']
+        self.assertEqual(self.changes(seq), {'seq': seq, 'cells': [], 'players': None})
+
+        self.open_cell(1, 2)
+        self.open_cell(3, 3, round_num=2)
+        delta = self.changes(seq)
+        self.assertEqual(delta['cells'], [{'round_num': 1, 'row': 1, 'col': 2, 'value': '12', 'is_revealed': True}])
+        self.assertIsNone(delta['players'])
+
+        self.client.post('/api/update_player', json={'session_id': 'ds', 'player_name': 'Игрок 1', 'score': 5})
+        self.assertEqual(self.changes(delta['seq'])['players'][0], {'player_name': 'Игрок 1', 'score': 5})
+        # Updating a missing player changes nothing
+        seq = self.changes(delta['seq'])['seq']
+        self.client.post('/api/update_player', json={'session_id': 'ds', 'player_name': 'nobody', 'score': 1})
+        self.assertEqual(self.changes(seq), {'seq': seq, 'cells': [], 'players': None})
+
+    def test_snapshot_fallback(self):
+        """An unknown number or a reset board gets the compact snapshot"""
+        layout = make_layout()
+        self.client.post('/api/save_board_layout', json={'session_id': 'ds', 'round_num': 1, 'board_layout': layout})
+        self.open_cell(2, 3)
+        snapshot = self.changes(0)
+        self.assertTrue(snapshot['snapshot'])
+        self.assertEqual(snapshot['layout'], layout)
+        self.assertEqual(snapshot['opened_cells'], [[2, 3, layout[2][3]]])
+
+        self.client.post('/api/clear_opened_cells', json={'session_id': 'ds', 'round_num': 1})
+        snapshot = self.changes(snapshot['seq'])
+        self.assertEqual((snapshot['snapshot'], snapshot['opened_cells']), (True, []))
+        self.assertNotIn('snapshot', self.changes(snapshot['seq']))
+
+    def test_saved_board_gets_a_snapshot(self):
+        """A board saved on another screen reaches this one as a snapshot once it is written"""
+        self.open_cell(0, 0)
+        seq = self.changes(0)['seq']
+        layout = make_layout()
+        self.client.post('/api/save_board_layout', json={'session_id': 'ds', 'round_num': 1, 'board_layout': layout})
+        self.assertNotIn('snapshot', self.changes(seq))
+        lala_app.state_buffer.flush()
+        snapshot = self.changes(seq)
+        self.assertEqual((snapshot['snapshot'], snapshot['layout'], snapshot['version']), (True, layout, 1))
+
+        saved = self.client.post('/api/save_state', json={'session_id': 'ds', 'current_round': 1, 'score': 0,
+                                                          'board_state': '[]', 'version': 1}).get_json()
+        snapshot = self.changes(snapshot['seq'])
+        self.assertEqual((snapshot['snapshot'], snapshot['version']), (True, saved['version']))
+
+    def test_log_is_pruned(self):
+        """The change log keeps a bounded number of rows per session"""
+        self.open_cell(0, 0)
+        for _ in range(config.CHANGE_LOG_LIMIT):
+            self.storage.cells.replace('ds', 1, {1: 'a', 2: 'b'})
+            self.storage.cells.replace('ds', 1, {})
+        self.assertLessEqual(self.query('SELECT COUNT(*) FROM session_changes WHERE session_key = ?',
+                                        (self.key('ds'),))[0][0], 2 * config.CHANGE_LOG_LIMIT)
+        self.assertTrue(self.changes(1)['snapshot'])
+
+    def test_log_is_pruned_between_marks(self):
+        """Pruning is due by the span of the log, also when player changes take the numbers in between"""
+        self.storage.cells.replace('ds', 1, {0: '1'})
+        self.storage.players.add('ds', 'Игрок')
+        # Cell changes get the odd numbers, player changes the even ones
+        for i in range(config.CHANGE_LOG_LIMIT):
+            self.storage.cells.replace('ds', 1, {} if i % 2 == 0 else {0: '1'})
+            self.storage.players.update('ds', 'Игрок', i, 'Игрок')
+        self.assertLessEqual(self.query('SELECT COUNT(*) FROM session_changes WHERE session_key = ?',
+                                        (self.key('ds'),))[0][0], config.CHANGE_LOG_LIMIT)
+        seq = self.changes(0)['seq']
+        self.assertEqual(len(self.changes(seq - config.CHANGE_LOG_LIMIT)['cells']), 1)
+
+    def test_numbers_before_the_log_get_a_snapshot(self):
+        """Sessions numbered before the change log existed resync from a snapshot"""
+        for col in range(5):
+            self.open_cell(0, col)
+        conn = sqlite3.connect(self.database)
+        conn.execute('ALTER TABLE session_sequences DROP COLUMN log_start')
+        conn.execute('DELETE FROM session_changes')
+        conn.commit()
+        conn.close()
+        lala_app.init_db()
+        self.assertTrue(self.changes(1)['snapshot'])
+        seq = self.changes(0)['seq']
+        self.assertEqual(self.changes(seq)['cells'], [])
+        self.open_cell(1, 0)
+        self.assertEqual(len(self.changes(seq)['cells']), 1)
+
+
+class TestSessionJanitor(SQLiteAppTestCase):
+    """Test the expiry of idle sessions, their archive and the vacuum"""
+
+    def make_janitor(self, **options):
+        forgotten = []
+        janitor = SessionJanitor(lambda: self.storage, ttl=3600, batch_size=2, pause=0, vacuum_interval=0,
+                                 forget=forgotten.append, **options)
+        self.addCleanup(janitor.stop)
+        return janitor, forgotten
+
+    def test_requests_mark_activity(self):
+        """The session of every request is marked as seen and written by the next run"""
+        self.client.post('/api/add_player', json={'session_id': 'seen', 'player_name': 'p'})
+        self.client.get('/api/get_players?session_id=seen')
+        lala_app.janitor.flush_seen(now=2000000000)
+        self.assertEqual(self.query('SELECT last_seen FROM sessions WHERE session_id = ?', ('seen',)), [(2000000000,)])
+
+    def test_background_failure_is_logged(self):
+        """A failed background run is logged with its traceback"""
+        failing = [True]
+
+        def storage():
+            if failing[0]:
+                raise sqlite3.OperationalError('database is locked')
+            return self.storage
+
+        janitor = SessionJanitor(storage, interval=0.01, vacuum_interval=0)
+        with self.assertLogs('session_janitor', 'ERROR') as logs:
+            janitor.touch('s')
+            deadline = time.monotonic() + 5
+            while not logs.records and time.monotonic() < deadline:
+                time.sleep(0.01)
+        failing[0] = False
+        janitor.stop()
+        self.assertIn('database is locked', logs.output[0])
+        self.assertIsNotNone(logs.records[0].exc_info)
+
+    def test_idle_sessions_expire_in_batches(self):
+        """Idle sessions are deleted in batches with all their rows; active ones are kept"""
+        for number in range(5):
+            self.client.post('/api/add_player', json={'session_id': f'idle{number}', 'player_name': 'p'})
+        self.client.post('/api/add_player', json={'session_id': 'live', 'player_name': 'p'})
+        janitor, forgotten = self.make_janitor()
+        janitor.touch('live')
+
+        report = janitor.run_once(now=time.time() + 7200)
+        self.assertEqual(report['expired'], 5)
+        self.assertEqual(report['rows_reclaimed'], 15)  # the session row, the player and the change counter of each
+        self.assertEqual(janitor.stats['batches'], 3)
+        self.assertEqual(sorted(forgotten), [f'idle{number}' for number in range(5)])
+        self.assertEqual(self.query('SELECT session_id FROM sessions'), [('live',)])
+        self.assertEqual(self.query('SELECT COUNT(*) FROM players'), [(1,)])
+
+    def test_expired_games_are_archived(self):
+        """Games are moved into the archive before they are deleted"""
+        self.client.post('/api/init_game', json={'session_id': 'old'})
+        self.client.post('/api/add_player', json={'session_id': 'old', 'player_name': 'Аня'})
+        self.client.post('/api/mark_cell_opened', json={
+            'session_id': 'old', 'round_num': 1, 'row': 0, 'col': 0, 'cell_value': '1'})
+        janitor, _ = self.make_janitor(archive=GameArchive(os.path.join(self.tmpdir, 'archive')))
+        self.assertEqual(janitor.run_once(now=time.time() + 7200)['archived'], 1)
+
+        record = janitor.archive.read('old')
+        self.assertEqual(record['players'], [{'player_name': 'Аня', 'score': 0}])
+        self.assertEqual(record['opened_cells']['1'], [{'row': 0, 'col': 0, 'value': '1'}])
+        self.assertIsNone(self.key('old'))
+
+    def test_vacuum(self):
+        """The scheduled vacuum is always incremental; older files are converted once by init_schema"""
+        self.assertEqual(self.storage.vacuum()['vacuum'], 'incremental')
+
+        path = os.path.join(self.tmpdir, 'old.db')
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE t (x)')
+        conn.close()
+        old = SQLiteStorage(path)
+        self.addCleanup(old.close)
+        self.assertEqual(old.vacuum()['vacuum'], 'none')
+        with self.assertLogs('storage.sqlite', 'INFO'):
+            old.init_schema()
+        self.assertEqual(old.vacuum()['vacuum'], 'incremental')
+        conn = sqlite3.connect(path)
+        self.assertEqual(conn.execute('PRAGMA auto_vacuum').fetchone()[0], 2)
+        conn.close()
+
+    def test_vacuum_is_scheduled(self):
+        """The vacuum runs when its interval has passed since the previous one"""
+        janitor, _ = self.make_janitor()
+        janitor.vacuum_interval = 3600
+        janitor.run_once()
+        self.assertEqual(janitor.stats['vacuums'], 0)
+        janitor.run_once(now=time.time() + 7200)
+        self.assertEqual(janitor.stats['vacuums'], 1)
+        self.assertIn('pages_freed', janitor.stats['last_vacuum'])
+        self.assertIn('expired', self.client.get('/api/db_stats').get_json()['janitor'])
+
+
+
+class TestGameArchive(SQLiteAppTestCase):
+    """Test the day segments of finished games and the endpoints reading them"""
+
+    def setUp(self):
+        super().setUp()
+        self.archive = GameArchive(os.path.join(self.tmpdir, 'archive'))
+        self._orig_archive, lala_app.game_archive = lala_app.game_archive, self.archive
+        self.addCleanup(setattr, lala_app, 'game_archive', self._orig_archive)
+
+    def play(self, session_id, player_name='p'):
+        self.client.post('/api/save_state', json={'session_id': session_id, 'current_round': 1, 'score': 7,
+                                                  'version': 0})
+        self.client.post('/api/add_player', json={'session_id': session_id, 'player_name': player_name})
+        self.client.post('/api/mark_cell_opened', json={
+            'session_id': session_id, 'round_num': 1, 'row': 0, 'col': 1, 'cell_value': '2'})
+
+    def test_finish_game_moves_it_to_the_archive(self):
+        """A finished game leaves the live tables and is served from the archive"""
+        self.play('done')
+        response = self.client.post('/api/finish_game', json={'session_id': 'done'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(self.key('done'))
+        self.assertEqual(self.client.post('/api/finish_game', json={'session_id': 'done'}).status_code, 404)
+
+        response = self.client.get('/api/archived_game?session_id=done', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        record = json.loads(gzip.decompress(response.data))
+        self.assertEqual(record['game_state']['score'], 7)  # buffered save included
+        self.assertEqual(record['players'], [{'player_name': 'p', 'score': 0}])
+        self.assertEqual(record['opened_cells']['1'], [{'row': 0, 'col': 1, 'value': '2'}])
+
+        plain = self.client.get('/api/archived_game?session_id=done', headers={'Accept-Encoding': 'identity'})
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(plain.get_json(), record)
+        self.assertEqual(self.client.get('/api/archived_game?session_id=other').status_code, 404)
+
+    def test_opening_order_is_archived(self):
+        """The record keeps the order the cells were opened in, without the reverted ones"""
+        self.play('order')
+        for row, col in ((3, 3), (2, 2), (4, 4)):
+            self.client.post('/api/mark_cell_opened', json={
+                'session_id': 'order', 'round_num': 1, 'row': row, 'col': col, 'cell_value': 'x'})
+        self.client.post('/api/revert_last_opened_cell', json={'session_id': 'order', 'round_num': 1})
+        self.client.post('/api/finish_game', json={'session_id': 'order'})
+        order = self.archive.read('order')['opening_order']['1']
+        self.assertEqual([(row, col) for _, row, col in order], [(0, 1), (3, 3), (2, 2)])
+        self.assertEqual([seq for seq, _, _ in order], sorted(seq for seq, _, _ in order))
+
+    def test_retried_finish_is_not_archived_twice(self):
+        """A game archived by a request that crashed before deleting it is not appended again"""
+        self.play('retry')
+        lala_app.state_buffer.flush()
+        self.assertEqual(self.archive.append([lala_app.archive_record(self.storage, 'retry')]), 1)
+        self.assertIsNotNone(self.key('retry'))
+
+        self.assertEqual(self.client.post('/api/finish_game', json={'session_id': 'retry'}).status_code, 200)
+        self.assertIsNone(self.key('retry'))
+        day, _, _ = self.archive.locate('retry')
+        self.assertEqual([record['session_id'] for record in GameArchive(self.archive.directory).records(day)],
+                         ['retry'])
+
+        # The same session id playing a new game is archived again
+        self.play('retry', 'again')
+        self.client.post('/api/finish_game', json={'session_id': 'retry'})
+        self.assertEqual(len(list(self.archive.records(day))), 2)
+        self.assertEqual(self.archive.read('retry')['players'][0]['player_name'], 'again')
+
+    def test_index_locates_every_game(self):
+        """Each game is a gzip member of the day's segment at its indexed offset"""
+        for number in range(3):
+            self.play(f'g{number}', f'player{number}')
+            self.client.post('/api/finish_game', json={'session_id': f'g{number}'})
+        day, offset, length = self.archive.locate('g1')
+        self.assertGreater(offset, 0)
+        self.assertEqual(self.archive.read('g1')['players'][0]['player_name'], 'player1')
+
+        # A fresh instance reads the index from disk
+        reopened = GameArchive(self.archive.directory)
+        self.assertEqual(reopened.locate('g1'), (day, offset, length))
+        self.assertEqual([record['session_id'] for record in reopened.records(day)], ['g0', 'g1', 'g2'])
+
+        self.assertEqual(self.client.get('/api/archived_games').get_json(), {'days': [day]})
+        lines = self.client.get(f'/api/archived_games?day={day}').get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['session_id'] for line in lines], ['g0', 'g1', 'g2'])
+        self.assertEqual(self.client.get('/api/archived_games?day=1999-01-01').status_code, 404)
+
+    def test_torn_append_is_cut_off(self):
+        """Bytes of an append that never reached the index are dropped by the next append"""
+        self.archive.append([{'session_id': 'a', 'players': []}], at=0)
+        day, _, _ = self.archive.locate('a')
+        with open(os.path.join(self.archive.directory, f'sessions-{day}.jsonl.gz'), 'ab') as segment:
+            segment.write(b'\x1f\x8b torn')
+        self.archive.append([{'session_id': 'b', 'players': []}], at=0)
+        reopened = GameArchive(self.archive.directory)
+        self.assertEqual([record['session_id'] for record in reopened.records(day)], ['a', 'b'])
+        self.assertEqual(reopened.read('b')['session_id'], 'b')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -3,13 +3,20 @@ Unit tests for database connection functionality
 Tests both the connection pool and transaction handling
 """
 
+import importlib
+import shutil
+import sqlite3
+import tempfile
 import unittest
 import os
 from unittest.mock import patch, MagicMock
 
+from mysql.connector.errors import PoolError
+
 # Import our database modules
+import db_config
 from db_config import get_db_connection, get_db_transaction, test_connection, DatabaseConfig
-from models import get_session, Question, GameState, init_database
+from models import get_engine, get_session, Question, GameState, init_database
 
 
 class TestDatabaseConnection(unittest.TestCase):
@@ -89,6 +96,56 @@ class TestTransactionHandling(unittest.TestCase):
         self.assertTrue(callable(get_db_transaction))
 
 
+class TestConnectionPool(unittest.TestCase):
+    """Test the lazily created pool, its connection setup and checkout counters"""
+    
+    def setUp(self):
+        self._timeout = db_config._pool_timeout
+        self.addCleanup(setattr, db_config, '_pool_timeout', self._timeout)
+    
+    def test_pool_not_created_on_import(self):
+        """Importing the module does not connect to the database"""
+        with patch('mysql.connector.pooling.MySQLConnectionPool') as mock_pool_class:
+            importlib.reload(db_config)
+            self.assertIsNone(db_config.connection_pool)
+            mock_pool_class.assert_not_called()
+    
+    def test_connection_initialized_once(self):
+        """The isolation level is set by init_command, sessions are not reset on return"""
+        with patch.dict(os.environ, {'DB_POOL_SIZE': '100', 'DB_ISOLATION_LEVEL': 'REPEATABLE READ'}):
+            config = DatabaseConfig().get_pool_config()
+        self.assertEqual(config['init_command'], 'SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        self.assertFalse(config['pool_reset_session'])
+        self.assertEqual(config['pool_size'], 32)
+    
+    @patch('db_config.connection_pool')
+    def test_checkout_has_no_extra_statements(self, mock_pool):
+        """A checkout hands out the pooled connection without running any statement"""
+        mock_conn = MagicMock()
+        mock_pool.get_connection.return_value = mock_conn
+        before = db_config.pool_stats()
+        self.assertIs(db_config.get_connection(), mock_conn)
+        mock_conn.cursor.assert_not_called()
+        self.assertEqual(db_config.pool_stats()['checkouts'], before['checkouts'] + 1)
+    
+    @patch('db_config.connection_pool')
+    def test_exhausted_pool_waits(self, mock_pool):
+        """An exhausted pool is waited on, and gives up after DB_POOL_TIMEOUT"""
+        mock_conn = MagicMock()
+        mock_pool.get_connection.side_effect = [PoolError('pool exhausted'), PoolError('pool exhausted'), mock_conn]
+        before = db_config.pool_stats()
+        self.assertIs(db_config.get_connection(), mock_conn)
+        after = db_config.pool_stats()
+        self.assertEqual(after['waits'], before['waits'] + 1)
+        self.assertGreater(after['wait_seconds'], before['wait_seconds'])
+        
+        db_config._pool_timeout = 0.01
+        mock_pool.get_connection.side_effect = PoolError('pool exhausted')
+        with self.assertRaises(PoolError):
+            db_config.get_connection()
+        self.assertEqual(db_config.pool_stats()['exhausted'], after['exhausted'] + 1)
+
+
 class TestModelInitialization(unittest.TestCase):
     """Test model initialization functionality"""
     
@@ -106,10 +163,37 @@ class TestModelInitialization(unittest.TestCase):
             self.assertTrue(hasattr(Question, attr))
         
         # Test GameState model
-        gamestate_attrs = ['id', 'session_id', 'current_round', 'current_cell', 'score', 'revealed_cells', 'board_state', 'created_at']
+        gamestate_attrs = ['id', 'session_key', 'current_round', 'current_cell', 'score', 'revealed_cells', 'board_state', 'version', 'created_at']
         for attr in gamestate_attrs:
             self.assertTrue(hasattr(GameState, attr))
 
+    
+    def test_session_key_migration(self):
+        """Tables keyed by the text session_id are rebuilt on the sessions table"""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        path = os.path.join(tmpdir, 'legacy.db')
+        conn = sqlite3.connect(path)
+        conn.executescript('''
+            CREATE TABLE game_states (id INTEGER PRIMARY KEY, session_id VARCHAR(255) UNIQUE, score INTEGER);
+            CREATE TABLE players (id INTEGER PRIMARY KEY, session_id VARCHAR(255), player_name VARCHAR(255),
+                                  score INTEGER, position INTEGER);
+            INSERT INTO game_states (session_id, score) VALUES ('old', 5);
+            INSERT INTO players (session_id, player_name, score, position) VALUES ('old', 'p', 2, 1);
+        ''')
+        conn.commit()
+        conn.close()
+        
+        init_database(get_engine(f'sqlite:///{path}'))
+        conn = sqlite3.connect(path)
+        key, last_seen = conn.execute("SELECT id, last_seen FROM sessions WHERE session_id = 'old'").fetchone()
+        self.assertIsNotNone(last_seen)
+        self.assertEqual(conn.execute('SELECT score, version FROM game_states WHERE session_key = ?', (key,)).fetchall(),
+                         [(5, 0)])
+        self.assertEqual(conn.execute('SELECT player_name FROM players WHERE session_key = ?', (key,)).fetchall(),
+                         [('p',)])
+        conn.close()
+
 
 if __name__ == '__main__':
     print("Running database connection tests...")
@@ -0,0 +1,65 @@
+"""
+Unit tests for the process-local question bank
+"""
+
+import unittest
+
+from question_bank import QuestionBank
+
+
+ROWS = [
+    (1, 1, 'Вопрос 1', 'Ответ 1', 'Тема'),
+    (2, 1, 'Вопрос 2', 'Ответ 2', 'Тема'),
+    (3, 2, 'Вопрос 3', 'Ответ 3', 'Тема'),
+]
+
+
+class TestQuestionBank(unittest.TestCase):
+    """Test loading, lookups and refresh of the question bank"""
+
+    def setUp(self):
+        self.loads = 0
+        self.rows = list(ROWS)
+        self.version = 1
+
+        def loader():
+            self.loads += 1
+            return self.rows
+
+        self.bank = QuestionBank(loader, lambda: self.version, refresh_interval=0)
+
+    def test_random_question_stays_in_round(self):
+        """Random questions come only from the requested round"""
+        for _ in range(20):
+            self.assertIn(self.bank.random_question(1)['id'], (1, 2))
+        self.assertEqual(self.bank.random_question('2')['id'], 3)
+        self.assertIsNone(self.bank.random_question(9))
+
+    def test_get_by_id(self):
+        """Questions are looked up by id without reloading"""
+        question = self.bank.get('3')
+        self.assertEqual(question['answer'], 'Ответ 3')
+        self.assertEqual(question['round_num'], 2)
+        self.assertIsNone(self.bank.get(42))
+        self.assertIsNone(self.bank.get(None))
+        self.assertEqual(self.loads, 1)
+
+    def test_reload_on_version_change(self):
+        """A changed version stamp reloads the bank"""
+        self.assertEqual(self.bank.round_ids(2), [3])
+        self.rows.append((4, 2, 'Вопрос 4', 'Ответ 4', 'Тема'))
+        self.assertEqual(self.bank.round_ids(2), [3])
+        self.version = 2
+        self.assertEqual(self.bank.round_ids(2), [3, 4])
+        self.assertEqual(self.loads, 2)
+
+    def test_invalidate(self):
+        """invalidate() forces a reload on the next read"""
+        self.bank.all_questions()
+        self.bank.invalidate()
+        self.assertEqual([q['id'] for q in self.bank.all_questions()], [1, 2, 3])
+        self.assertEqual(self.loads, 2)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,508 @@
+"""
+Conformance tests of the storage backends (storage/)
+The same cases run against every backend; MySQL runs only when DB_HOST, DB_NAME,
+DB_USER and DB_PASSWORD are set and the server is reachable
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import config
+from question_bank import pack_bag
+from storage import StorageError, create_storage, questions_hash
+
+
+class StorageConformance:
+    """Behaviour every backend must share; subclasses provide make_storage()"""
+
+    def make_storage(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.storage = self.make_storage()
+        self.addCleanup(self.storage.close)
+        self.storage.init_schema()
+        # Unique per test, so a shared MySQL database does not leak state between tests
+        self.sid = f'conformance-{self.id()}'[:100]
+
+    def test_questions_seeded_once(self):
+        """Questions are seeded from config and reseeding keeps their ids"""
+        rows = self.storage.questions.all()
+        self.assertEqual(len(rows), len(config.get_questions()))
+        version = self.storage.questions.version()
+        self.storage.init_schema()
+        self.assertEqual(self.storage.questions.all(), rows)
+        self.assertEqual(self.storage.questions.version(), version)
+
+    def test_game_state_create_and_upsert(self):
+        """create() inserts once; upsert_many() keeps the columns it does not write"""
+        values = {'current_round': 1, 'current_cell': None, 'score': 0, 'revealed_cells': None, 'board_state': None}
+        self.assertIsNone(self.storage.game_states.create(self.sid, values))
+        self.assertEqual(self.storage.game_states.create(self.sid, dict(values, score=5)), dict(values, version=0))
+
+        self.storage.game_states.upsert_many({self.sid: {'score': 7, 'cell_questions': b'\x01\x00\x00\x00'}})
+        self.storage.game_states.upsert_many({self.sid: {'current_cell': 'A1'}})
+        state = self.storage.game_states.get(self.sid)
+        self.assertEqual((state['score'], state['current_cell'], state['cell_questions']),
+                         (7, 'A1', b'\x01\x00\x00\x00'))
+        self.assertEqual(self.storage.game_states.get(self.sid, ('score',)), {'score': 7})
+        self.assertIsNone(self.storage.game_states.get(self.sid + '-missing'))
+
+    def test_versioned_save(self):
+        """save() writes only over the version it was given; upsert_many() bumps the version"""
+        game_states = self.storage.game_states
+        values = {'current_round': 1, 'current_cell': 'A1', 'score': 3, 'revealed_cells': None, 'board_state': None}
+        self.assertEqual(game_states.save(self.sid + '-missing', values, 4), (False, 0))
+        self.assertEqual(game_states.save(self.sid, values, 0), (True, 1))
+        self.assertEqual(game_states.save(self.sid, dict(values, score=9), 0), (False, 1))
+        self.assertEqual(game_states.get(self.sid, ('score', 'version')), {'score': 3, 'version': 1})
+        self.assertEqual(game_states.save(self.sid, dict(values, score=5), 1), (True, 2))
+
+        game_states.upsert_many({self.sid: {'score': 6}, self.sid + '-new': {'score': 1}})
+        self.assertEqual(game_states.get(self.sid, ('score', 'version')), {'score': 6, 'version': 3})
+        self.assertEqual(game_states.get(self.sid + '-new', ('score', 'version')), {'score': 1, 'version': 1})
+        self.assertEqual(game_states.save(self.sid, dict(values, score=7), 2), (False, 3))
+        self.assertEqual(game_states.create(self.sid, values)['version'], 3)
+
+    def test_changes(self):
+        """changes() returns the last change of each cell after a number, and the players only if they changed"""
+        cells, players = self.storage.cells, self.storage.players
+        self.assertIsNone(self.storage.changes(self.sid, 0))
+        cells.open(self.sid, 1, 0, 0, '1')
+        players.add(self.sid, 'a')
+        seq = self.storage.snapshot(self.sid, 1)['seq']
+        self.assertEqual(self.storage.changes(self.sid, seq), {'seq': seq, 'cells': [], 'players': None})
+
+        cells.open(self.sid, 1, 2, 3, '7')
+        cells.undo(self.sid)
+        cells.open(self.sid, 1, 4, 4, '9')
+        players.update(self.sid, 'a', 3, 'a')
+        delta = self.storage.changes(self.sid, seq)
+        self.assertEqual(delta['cells'], [
+            {'round_num': 1, 'row': 2, 'col': 3, 'value': None, 'is_revealed': False},
+            {'round_num': 1, 'row': 4, 'col': 4, 'value': '9', 'is_revealed': True}])
+        self.assertEqual(delta['players'], [{'player_name': 'a', 'score': 3}])
+        self.assertEqual(delta['seq'], self.storage.snapshot(self.sid, 1)['seq'])
+        self.assertIsNone(self.storage.changes(self.sid, delta['seq'] + 1))
+
+        # A reset cannot be sent as a delta, and neither can a gap longer than the kept log
+        cells.clear(self.sid, 1)
+        self.assertIsNone(self.storage.changes(self.sid, delta['seq']))
+        seq = self.storage.snapshot(self.sid, 1)['seq']
+        for _ in range(config.CHANGE_LOG_LIMIT // 40 + 1):
+            cells.replace(self.sid, 1, {index: str(index) for index in range(20)})
+            cells.replace(self.sid, 1, {})
+        self.assertIsNone(self.storage.changes(self.sid, seq))
+        latest = self.storage.snapshot(self.sid, 1)['seq']
+        self.assertEqual(len(self.storage.changes(self.sid, latest - 20)['cells']), 20)
+
+        # A saved game state or board layout is sent as a snapshot as well
+        game_states = self.storage.game_states
+        for save in (lambda: game_states.create(self.sid, {'score': 1}),
+                     lambda: game_states.save(self.sid, {'score': 2}, 0),
+                     lambda: game_states.upsert_many({self.sid: {'board_state': '[]'}})):
+            seq = self.storage.snapshot(self.sid, 1)['seq']
+            save()
+            self.assertIsNone(self.storage.changes(self.sid, seq))
+            self.assertEqual(self.storage.changes(self.sid, seq + 1)['cells'], [])
+
+    def test_players(self):
+        """Players keep their order; removing one renumbers the rest"""
+        players = self.storage.players
+        for name in ('a', 'b', 'c'):
+            players.add(self.sid, name)
+        players.update(self.sid, 'b', 3, 'bee')
+        players.remove(self.sid, 'a')
+        players.add(self.sid, 'd')
+        self.assertEqual(players.list(self.sid), [
+            {'player_name': 'bee', 'score': 3}, {'player_name': 'c', 'score': 0}, {'player_name': 'd', 'score': 0}])
+
+        players.reset(self.sid, ['x', 'y'])
+        self.assertEqual([player['player_name'] for player in players.list(self.sid)], ['x', 'y'])
+
+    def test_bag_draws_without_repeats(self):
+        """A bag hands out every question once, then starts a new permutation"""
+        drawn = [self.storage.bags.draw(self.sid, 1, lambda: [10, 20, 30]) for _ in range(4)]
+        self.assertEqual(sorted(qid for qid, _ in drawn[:3]), [10, 20, 30])
+        self.assertEqual([remaining for _, remaining in drawn], [2, 1, 0, 2])
+        self.assertIsNone(self.storage.bags.draw(self.sid, 2, lambda: []))
+
+        self.storage.bags.reset(self.sid, 1)
+        self.assertEqual(self.storage.bags.draw(self.sid, 1, lambda: [40]), (40, 0))
+
+    def test_open_load_and_revert(self):
+        """Opened cells are loaded with their values and reverted newest first"""
+        cells = self.storage.cells
+        self.assertEqual(cells.open(self.sid, 1, 0, 0, '1'), {'can_undo': True, 'can_redo': False})
+        self.assertIsNone(cells.open(self.sid, 1, 0, 0, '1'))
+        cells.open(self.sid, 1, 1, 2, '2')
+        cells.open(self.sid, 1, 2, 1, '3')
+        self.assertEqual(sorted((cell['row'], cell['col'], cell['value']) for cell in cells.load(self.sid, 1)),
+                         [(0, 0, '1'), (1, 2, '2'), (2, 1, '3')])
+
+        reverted = cells.revert(self.sid, 1, 2)
+        self.assertEqual([(row, col) for _, row, col in reverted], [(2, 1), (1, 2)])
+        self.assertEqual([(cell['row'], cell['col']) for cell in cells.load(self.sid, 1)], [(0, 0)])
+        self.assertEqual(cells.revert(self.sid, 2, 1), [])
+
+    def test_opening_order(self):
+        """opening_order() lists the open cells of a round by their opening number"""
+        cells = self.storage.cells
+        for row, col in ((3, 1), (0, 2), (1, 1)):
+            cells.open(self.sid, 1, row, col, 'v')
+        cells.revert(self.sid, 1, 1)
+        cells.open(self.sid, 2, 0, 0, 'v')
+        order = cells.opening_order(self.sid, 1)
+        self.assertEqual([(row, col) for _, row, col in order], [(3, 1), (0, 2)])
+        self.assertLess(order[0][0], order[1][0])
+        self.assertEqual(cells.opening_order(self.sid + '-missing', 1), [])
+
+    def test_replace_writes_difference(self):
+        """replace() reports only the cells it opened and closed"""
+        cells = self.storage.cells
+        cells.open(self.sid, 1, 0, 0, '1')
+        cells.open(self.sid, 1, 0, 1, '2')
+        opened, closed = cells.replace(self.sid, 1, {0: '1', 5: '6'})
+        self.assertEqual((opened, closed), ([5], [1]))
+        self.assertEqual(sorted((cell['row'], cell['col']) for cell in cells.load(self.sid, 1)), [(0, 0), (0, 5)])
+
+    def test_undo_redo(self):
+        """Undo and redo replay the log; a new action drops the redo branch"""
+        cells = self.storage.cells
+        cells.open(self.sid, 1, 0, 0, '1')
+        cells.open(self.sid, 1, 0, 1, '2')
+
+        changed, flags = cells.undo(self.sid)
+        self.assertEqual(changed, [{'round_num': 1, 'row': 0, 'col': 1, 'value': '2', 'is_revealed': False}])
+        self.assertEqual(flags, {'can_undo': True, 'can_redo': True})
+        changed, flags = cells.redo(self.sid)
+        self.assertEqual(changed[0]['is_revealed'], True)
+        self.assertEqual(cells.redo(self.sid), (None, {'can_undo': True, 'can_redo': False}))
+
+        cells.undo(self.sid)
+        cells.open(self.sid, 1, 3, 3, '4')
+        self.assertEqual(cells.history(self.sid), {'can_undo': True, 'can_redo': False})
+
+    def test_clear(self):
+        """clear() closes the round's cells and drops the undo log"""
+        cells = self.storage.cells
+        cells.open(self.sid, 1, 0, 0, '1')
+        cells.clear(self.sid, 1)
+        self.assertEqual(cells.load(self.sid, 1), [])
+        self.assertEqual(cells.undo(self.sid), (None, {'can_undo': False, 'can_redo': False}))
+
+    def test_snapshot(self):
+        """A snapshot holds the game state, players, opened cells and history"""
+        self.storage.game_states.upsert_many({self.sid: {'score': 4, 'board_state': '[["a","b"]]'}})
+        self.storage.players.add(self.sid, 'p')
+        self.storage.cells.open(self.sid, 1, 0, 1, 'b')
+        snapshot = self.storage.snapshot(self.sid, 1)
+        self.assertEqual(snapshot['game_state']['score'], 4)
+        self.assertEqual(snapshot['players'], [{'player_name': 'p', 'score': 0}])
+        self.assertEqual(snapshot['opened_cells'], [{'row': 0, 'col': 1, 'value': 'b'}])
+        self.assertEqual(snapshot['history'], {'can_undo': True, 'can_redo': False})
+        self.assertTrue(self.storage.ping())
+
+    def test_delete_sessions(self):
+        """delete_sessions() removes everything of the sessions and counts the deleted ones"""
+        for sid in (self.sid, 'other'):
+            self.storage.game_states.create(sid, {'score': 1})
+            self.storage.players.add(sid, 'p')
+            self.storage.cells.open(sid, 1, 0, 0, '1')
+        self.assertEqual(self.storage.delete_sessions([self.sid, 'missing']), 1)
+        self.storage.release()
+        self.assertIsNone(self.storage.game_states.get(self.sid))
+        self.assertEqual(self.storage.players.list(self.sid), [])
+        self.assertEqual(self.storage.cells.load(self.sid, 1), [])
+        self.assertEqual(self.storage.game_states.get('other')['score'], 1)
+        self.assertEqual(len(self.storage.cells.load('other', 1)), 1)
+
+        self.storage.players.add(self.sid, 'again')
+        self.assertEqual(len(self.storage.players.list(self.sid)), 1)
+
+    def test_idle_sessions(self):
+        """Sessions are idle from their last recorded activity; their rows are counted before deletion"""
+        now = int(time.time())
+        for sid in (self.sid, 'active'):
+            self.storage.players.add(sid, 'p')
+        self.storage.cells.open(self.sid, 1, 0, 0, '1')
+        self.storage.touch_sessions(['active'], now + 1000)
+        idle = self.storage.idle_sessions(now + 500, 1000)
+        self.assertIn(self.sid, idle)
+        self.assertNotIn('active', idle)
+        self.assertEqual(self.storage.idle_sessions(now + 500, 1), idle[:1])
+
+        self.assertGreaterEqual(self.storage.session_rows([self.sid]), 4)  # session, player, cell, undo entry
+        self.assertEqual(self.storage.session_rows(['missing']), 0)
+        self.storage.delete_sessions([self.sid])
+        self.assertEqual(self.storage.session_rows([self.sid]), 0)
+        self.assertIsInstance(self.storage.vacuum(), dict)
+
+
+class TestSQLiteStorage(StorageConformance, unittest.TestCase):
+    def make_storage(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        return create_storage('sqlite', path=os.path.join(tmpdir, 'test.db'))
+
+
+class TestMemoryStorage(StorageConformance, unittest.TestCase):
+    def make_storage(self):
+        return create_storage('memory')
+
+
+class TestORMStorage(StorageConformance, unittest.TestCase):
+    def make_storage(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        return create_storage('orm', url=f"sqlite:///{os.path.join(tmpdir, 'orm.db')}")
+
+    def test_engine_is_shared(self):
+        """Storages and sessions on the same URL share one engine and its pool"""
+        import models
+        other = create_storage('orm', url=str(self.storage.engine.url))
+        self.assertIs(other.engine, self.storage.engine)
+        self.assertIs(models.get_engine(str(self.storage.engine.url)), self.storage.engine)
+
+        before = self.storage.stats()['pool']
+        for _ in range(3):
+            self.storage.players.list(self.sid)
+            self.storage.release()
+        after = self.storage.stats()['pool']
+        self.assertEqual(after['connects'], before['connects'])
+        self.assertEqual(after['checkouts'], before['checkouts'] + 3)
+
+    def test_question_hash_migration(self):
+        """A questions table of an older version is deduplicated and gets the unique question hash"""
+        import models
+        from sqlalchemy.exc import IntegrityError
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        engine = models.get_engine(f"sqlite:///{os.path.join(tmpdir, 'old.db')}")
+        self.addCleanup(engine.dispose)
+        with engine.begin() as connection:
+            connection.exec_driver_sql('CREATE TABLE questions (id INTEGER PRIMARY KEY AUTOINCREMENT, round_num INTEGER '
+                                       'NOT NULL, question_text TEXT NOT NULL, answer TEXT NOT NULL, theme VARCHAR(255))')
+            for text in ('a', 'b', 'a'):
+                connection.exec_driver_sql(
+                    f"INSERT INTO questions (round_num, question_text, answer, theme) VALUES (1, '{text}', 'x', 't')")
+
+        models.init_database(engine)
+        with engine.connect() as connection:
+            rows = connection.exec_driver_sql('SELECT id, question_hash FROM questions ORDER BY id').fetchall()
+            self.assertEqual(rows, [(1, models.question_text_hash(1, 'a')), (2, models.question_text_hash(1, 'b'))])
+            with self.assertRaises(IntegrityError):
+                connection.exec_driver_sql("INSERT INTO questions (round_num, question_text, answer, theme, "
+                                           f"question_hash) VALUES (1, 'a', 'y', 't', '{rows[0][1]}')")
+
+    def test_question_edit_changes_version(self):
+        """An edited question moves the version stamp although count and last id stay the same"""
+        import models
+        from sqlalchemy import update
+        # Rows written in an earlier second, as SQLite keeps the change time in seconds
+        with self.storage.engine.begin() as connection:
+            connection.exec_driver_sql("UPDATE questions SET updated_at = '2000-01-01 00:00:00'")
+        version = self.storage.questions.version()
+        with self.storage.engine.begin() as connection:
+            connection.execute(update(models.Question).where(models.Question.id == 1).values(answer='edited'))
+        self.assertNotEqual(self.storage.questions.version(), version)
+
+    def test_questions_bulk_upsert(self):
+        """Reseeding changed questions updates them in place and adds the new ones"""
+        ids = {row[2]: row[0] for row in self.storage.questions.all()}
+        first = config.get_questions()[0]
+        changed = [(first[0], first[1], 'new answer', first[3])] + config.get_questions()[1:] + [(1, 'extra', 'x', 't')]
+        original = config.get_questions
+        config.get_questions = lambda: changed
+        self.addCleanup(setattr, config, 'get_questions', original)
+
+        self.storage.init_schema()
+        reseeded = {row[2]: row for row in self.storage.questions.all()}
+        self.assertEqual(len(reseeded), len(ids) + 1)
+        self.assertEqual(reseeded[first[1]][0], ids[first[1]])
+        self.assertEqual(reseeded[first[1]][3], 'new answer')
+
+
+class TestDurableMemoryStorage(StorageConformance, unittest.TestCase):
+    def make_storage(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        return create_storage('memory', path=self.tmpdir, snapshot_every=5)
+
+    def reopen(self):
+        """Simulate a restart: a new storage recovers from the same directory"""
+        storage = create_storage('memory', path=self.tmpdir, snapshot_every=5)
+        self.addCleanup(storage.close)
+        return storage
+
+    def play(self, storage):
+        storage.players.reset(self.sid, ['a', 'b'])
+        storage.game_states.upsert_many({self.sid: {'score': 3, 'cell_questions': b'\x02\x00\x00\x00'}})
+        storage.bags.draw(self.sid, 1, lambda: [7, 8, 9])
+        for col in range(4):
+            storage.cells.open(self.sid, 1, 0, col, str(col))
+        storage.cells.undo(self.sid)
+
+    def assert_same_state(self, expected, actual):
+        self.assertEqual(actual.snapshot(self.sid, 1), expected.snapshot(self.sid, 1))
+        self.assertEqual(actual.questions.all(), expected.questions.all())
+        self.assertEqual(actual.bags.draw(self.sid, 1, lambda: []), expected.bags.draw(self.sid, 1, lambda: []))
+
+    def test_restart_replays_journal(self):
+        """Snapshot plus journal rebuild the state after a crash (no close())"""
+        self.play(self.storage)
+        self.assert_same_state(self.storage, self.reopen())
+
+    def test_close_compacts_into_snapshot(self):
+        """close() writes a snapshot, so the next start replays nothing"""
+        self.play(self.storage)
+        self.storage.close()
+        restarted = self.reopen()
+        self.assertEqual(restarted.stats()['replayed'], 0)
+        self.assert_same_state(self.storage, restarted)
+
+    def test_torn_record_is_dropped(self):
+        """A record cut off by a crash is ignored and removed from the journal"""
+        self.play(self.storage)
+        self.storage.players.add(self.sid, 'c')
+        with open(os.path.join(self.tmpdir, 'journal.pickle'), 'ab') as journal:
+            journal.write(b'\x80\x05\x95garbage')
+        restarted = self.reopen()
+        self.assertEqual([player['player_name'] for player in restarted.players.list(self.sid)], ['a', 'b', 'c'])
+        restarted.players.add(self.sid, 'd')
+        self.assertEqual(len(self.reopen().players.list(self.sid)), 4)
+
+
+@unittest.skipUnless(all(os.getenv(var) for var in ('DB_HOST', 'DB_NAME', 'DB_USER', 'DB_PASSWORD')),
+                     'MySQL is not configured')
+class TestMySQLStorage(StorageConformance, unittest.TestCase):
+    def make_storage(self):
+        try:
+            storage = create_storage('mysql')
+        except ImportError as e:
+            self.skipTest(f'MySQL driver is not available: {e}')
+        if not storage.ping():
+            self.skipTest('MySQL server is not reachable')
+        return storage
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(self.storage.cells.clear, self.sid, 1)
+        self.addCleanup(self.storage.players.reset, self.sid, [])
+
+
+class TestMySQLRoundTrips(unittest.TestCase):
+    """Statements per write in the MySQL backend, counted on a mocked pooled connection"""
+
+    def setUp(self):
+        try:
+            from storage import mysql as mysql_storage
+        except ImportError as e:
+            self.skipTest(f'MySQL driver is not available: {e}')
+        self.round_trips = mysql_storage.round_trips
+        # The session was looked up earlier in the request
+        mysql_storage.session_keys.put('s', 1)
+        self.addCleanup(mysql_storage.session_keys.clear)
+        self.cursor = mock.MagicMock(rowcount=1, lastrowid=1)
+        connection = mock.MagicMock()
+        connection.cursor.return_value = self.cursor
+        patcher = mock.patch('db_config.get_connection', return_value=connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.storage = create_storage('mysql')
+
+    def count(self, operation):
+        before = self.round_trips.count
+        operation()
+        return self.round_trips.count - before
+
+    def test_single_statement_writes(self):
+        # Player and game state writes add one statement marking the change for delta sync
+        self.assertEqual(self.count(lambda: self.storage.players.add('s', 'Игрок 1')), 2)
+        self.assertEqual(self.count(lambda: self.storage.players.update('s', 'Игрок 1', 5, 'Игрок 2')), 2)
+        self.assertEqual(self.count(lambda: self.storage.game_states.create('s', {'score': 0})), 2)
+        self.assertEqual(self.count(lambda: self.storage.bags.reset('s', 1)), 1)
+
+    def test_upsert_many_is_one_statement_per_column_group(self):
+        """Plus one multi-row INSERT of the sessions and one of their change marks"""
+        states = {f's{i}': {'score': i} for i in range(20)}
+        self.assertEqual(self.count(lambda: self.storage.game_states.upsert_many(states)), 3)
+
+    def test_session_key_is_looked_up_once_per_request(self):
+        self.assertEqual(self.count(lambda: self.storage.players.add('new', 'a')), 3)
+        self.assertEqual(self.count(lambda: self.storage.players.add('new', 'b')), 2)
+        self.storage.release()
+        self.assertEqual(self.count(lambda: self.storage.players.add('new', 'c')), 3)
+
+    def test_draw_from_existing_bag(self):
+        """The claim and the read of the bag, without a transaction around them"""
+        self.cursor.lastrowid = 3
+        self.cursor.fetchone.return_value = (pack_bag(list(range(11, 21))), 10)
+        self.assertEqual(self.count(lambda: self.assertEqual(self.storage.bags.draw('s', 1, list), (13, 7))), 2)
+
+    def test_revert_deletes_in_one_statement(self):
+        self.cursor.fetchall.return_value = [(id_, 0, id_) for id_ in range(1, 6)]
+        self.cursor.fetchone.return_value = (0,)  # start of the change log
+        deletes_before = self.deletes('opened_cells')
+        self.storage.cells.revert('s', 1, 5)
+        self.assertEqual(self.deletes('opened_cells') - deletes_before, 1)
+
+    def test_seed_is_hash_gated_upsert(self):
+        """Questions are upserted by their unique hash, and only when the seed changed"""
+        from storage import mysql as mysql_storage
+        self.cursor.fetchone.return_value = (questions_hash(config.get_questions()),)
+        with mysql_storage._transaction() as cursor:
+            mysql_storage._seed_questions(cursor)
+        self.cursor.executemany.assert_not_called()
+
+        self.cursor.fetchone.return_value = ('',)
+        with mysql_storage._transaction() as cursor:
+            mysql_storage._seed_questions(cursor)
+        statement, rows = self.cursor.executemany.call_args.args
+        self.assertIn('ON DUPLICATE KEY UPDATE', statement)
+        self.assertEqual(len(rows), len(config.get_questions()))
+        self.assertEqual(len({row[4] for row in rows}), len(rows))
+        self.assertEqual(self.cursor.execute.call_args.args[1], (questions_hash(config.get_questions()),))
+
+    def test_round_trips_in_stats(self):
+        self.storage.players.add('s', 'Игрок 1')
+        self.assertEqual(self.storage.stats()['round_trips'], self.round_trips.count)
+
+    def deletes(self, table):
+        return sum(1 for call in self.cursor.execute.call_args_list
+                   if call.args[0].lstrip().startswith(f'DELETE FROM {table}'))
+
+
+class TestStorageSelection(unittest.TestCase):
+    """Test create_storage() and the app's handling of backend failures"""
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_storage('redis')
+
+    def test_storage_error_is_reported(self):
+        """A failing backend yields a JSON 500 instead of a traceback"""
+        import app as lala_app
+
+        class BrokenStorage(type(create_storage('memory'))):
+            def ping(self):
+                return False
+
+            def snapshot(self, *args):
+                raise StorageError('gone')
+
+        previous = lala_app.use_storage(BrokenStorage())
+        self.addCleanup(lala_app.use_storage, previous)
+        client = lala_app.app.test_client()
+        response = client.get('/api/bootstrap?session_id=s')
+        self.assertEqual((response.status_code, response.get_json()), (500, {'error': 'Database operation failed'}))
+        health = client.get('/health')
+        self.assertEqual((health.status_code, health.get_json()['backend']), (503, 'memory'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+"""
+Write-behind buffer for frequently re-saved rows.
+
+The client saves the game state and the board layout after nearly every
+interaction, mostly without changes. The buffer keeps only the latest values
+per key, drops saves whose content hash matches what was already written and
+flushes the pending rows in one batch on an interval (and on shutdown).
+Reads overlay the pending values, so a session never reads back an older state
+than it wrote.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_MS', 1000)) / 1000
+
+Values = Dict[str, Any]  # column -> value
+
+
+def content_hash(value: Any) -> bytes:
+    """Short digest of a column value (str, bytes, number or None)."""
+    data = value if isinstance(value, bytes) else repr(value).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class WriteBehindBuffer:
+    """
+    Latest unsaved column values per key, flushed in the background.
+
+    flush receives {key: {column: value}} and must persist it (raising on
+    failure, in which case the values stay buffered for the next flush).
+    """
+
+    def __init__(self, flush: Callable[[Dict[Hashable, Values]], None], interval: float = FLUSH_INTERVAL):
+        self._flush = flush
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._pending: Dict[Hashable, Values] = {}
+        self._flushing: Dict[Hashable, Values] = {}  # taken by the running flush, still readable
+        self._written: Dict[Hashable, Dict[str, bytes]] = {}  # key -> column -> hash of the last saved value
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {'buffered': 0, 'skipped': 0, 'flushed': 0, 'flushes': 0}
+
+    def put(self, key: Hashable, values: Values) -> bool:
+        """Buffer the values; returns False if they are the same as the last saved ones."""
+        hashes = {column: content_hash(value) for column, value in values.items()}
+        with self._lock:
+            written = self._written.setdefault(key, {})
+            changed = {column: values[column] for column, digest in hashes.items() if written.get(column) != digest}
+            if not changed:
+                self.stats['skipped'] += 1
+                return False
+            for column in changed:
+                written[column] = hashes[column]
+            self._pending.setdefault(key, {}).update(changed)
+            self.stats['buffered'] += 1
+        self._ensure_started()
+        return True
+
+    def get(self, key: Hashable) -> Values:
+        """Return the buffered (not yet flushed) values of the key."""
+        with self._lock:
+            return {**self._flushing.get(key, {}), **self._pending.get(key, {})}
+
+    def overlay(self, key: Hashable, row: Optional[Values]) -> Optional[Values]:
+        """Apply the buffered values of the key to a row read from the database."""
+        pending = self.get(key)
+        if not pending:
+            return row
+        return {**(row or {}), **pending}
+
+    def unchanged(self, key: Hashable, values: Values) -> bool:
+        """True if the values are the last saved ones and none of their columns has a newer pending value."""
+        with self._lock:
+            written = self._written.get(key, {})
+            pending = {**self._flushing.get(key, {}), **self._pending.get(key, {})}
+            return all(column not in pending and written.get(column) == content_hash(value)
+                       for column, value in values.items())
+
+    def written(self, key: Hashable, values: Values) -> None:
+        """Record values the caller saved past the buffer; columns with pending values keep their hashes."""
+        hashes = {column: content_hash(value) for column, value in values.items()}
+        with self._lock:
+            pending = {**self._flushing.get(key, {}), **self._pending.get(key, {})}
+            written = self._written.setdefault(key, {})
+            written.update((column, digest) for column, digest in hashes.items() if column not in pending)
+
+    def discard(self, key: Hashable) -> None:
+        """Forget the key (its row was deleted or rewritten elsewhere)."""
+        with self._lock:
+            self._pending.pop(key, None)
+            self._written.pop(key, None)
+
+    def flush(self) -> int:
+        """Write the pending values now; returns the number of flushed keys."""
+        with self._flush_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, {}
+            return self._write_flushing()
+
+    def flush_key(self, key: Hashable) -> bool:
+        """Write the pending values of one key now, leaving the other keys buffered; returns True if it had any."""
+        with self._flush_lock:
+            with self._lock:
+                values = self._pending.pop(key, None)
+                self._flushing = {key: values} if values else {}
+            return self._write_flushing() > 0
+
+    def _write_flushing(self) -> int:
+        # Called under _flush_lock with the batch already moved to _flushing
+        if not self._flushing:
+            return 0
+        try:
+            self._flush(self._flushing)
+        except Exception:
+            # Keep the values for the next flush; newer puts win over them
+            with self._lock:
+                for key, values in self._flushing.items():
+                    self._pending[key] = {**values, **self._pending.get(key, {})}
+                self._flushing = {}
+            raise
+        with self._lock:
+            flushed, self._flushing = len(self._flushing), {}
+            self.stats['flushed'] += flushed
+            self.stats['flushes'] += 1
+        return flushed
+
+    def stop(self) -> None:
+        """Stop the flush thread, write the pending values and forget the saved hashes."""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+            self._stop.clear()
+        self.flush()
+        with self._lock:
+            self._written.clear()
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='write-behind', daemon=True)
+                self._thread.start()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Write-behind flush failed")